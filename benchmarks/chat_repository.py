@@ -0,0 +1,127 @@
+"""Compares the thread based ChatRepository with AsyncChatRepository.
+
+Runs against whatever AWS_ENDPOINT_URL_DYNAMODB points to, e.g. the
+dynamodb-local container of docker-compose-test.yaml:
+
+    python benchmarks/chat_repository.py --chats 20 --concurrency 200
+"""
+
+import asyncio
+import statistics
+import time
+import uuid
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from gptbundle.common.dynamodb import AsyncDynamoDBClient
+from gptbundle.messaging.async_repository import AsyncChatRepository
+from gptbundle.messaging.repository import ChatRepository
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+from gptbundle.messaging.service import (
+    append_messages as service_append_messages,
+)
+from gptbundle.messaging.service import get_chat as service_get_chat
+
+app = typer.Typer()
+console = Console()
+
+USER_EMAIL = "benchmark@example.com"
+
+
+def _message(content: str) -> MessageCreate:
+    return MessageCreate(content=content, role=MessageRole.USER, llm_model="bench")
+
+
+async def _run_operations(
+    chat_repo, chats: list[tuple[str, float]], operations: int, concurrency: int
+) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def _one(i: int) -> None:
+        chat_id, timestamp = chats[i % len(chats)]
+        async with semaphore:
+            start = time.perf_counter()
+            if i % 2:
+                await service_get_chat(chat_id, timestamp, chat_repo, USER_EMAIL)
+            else:
+                await service_append_messages(
+                    chat_id,
+                    timestamp,
+                    [_message(f"message {i}")],
+                    chat_repo,
+                    USER_EMAIL,
+                )
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_one(i) for i in range(operations)))
+    return time.perf_counter() - start, latencies
+
+
+async def _create_chats(chat_repo: AsyncChatRepository, chats: int) -> list:
+    created = []
+    for _ in range(chats):
+        chat_id, timestamp = f"bench-{uuid.uuid4()}", time.time()
+        await chat_repo.create_chat(
+            ChatCreate(
+                chat_id=chat_id,
+                timestamp=timestamp,
+                user_email=USER_EMAIL,
+                messages=[_message("hello")],
+            )
+        )
+        created.append((chat_id, timestamp))
+    return created
+
+
+async def _benchmark(chats: int, operations: int, concurrency: int) -> None:
+    client = AsyncDynamoDBClient(max_connections=concurrency)
+    async_repo = AsyncChatRepository(client)
+
+    table = Table(title=f"{operations} operations, concurrency {concurrency}")
+    table.add_column("Repository", style="cyan")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("ops/s", justify="right", style="bold green")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+    try:
+        for name, repo in (
+            ("ChatRepository (to_thread)", ChatRepository()),
+            ("AsyncChatRepository", async_repo),
+        ):
+            # fresh chats for every run, appends make the chats grow
+            created = await _create_chats(async_repo, chats)
+            try:
+                total, latencies = await _run_operations(
+                    repo, created, operations, concurrency
+                )
+            finally:
+                for chat_id, timestamp in created:
+                    await async_repo.delete_chat(chat_id, timestamp, USER_EMAIL)
+            quantiles = statistics.quantiles(latencies, n=20)
+            table.add_row(
+                name,
+                f"{total:.2f}",
+                f"{operations / total:.0f}",
+                f"{statistics.median(latencies) * 1000:.1f}",
+                f"{quantiles[18] * 1000:.1f}",
+            )
+    finally:
+        await client.close()
+    console.print(table)
+
+
+@app.command()
+def main(
+    chats: int = typer.Option(20, help="Number of chats to spread operations on"),
+    operations: int = typer.Option(2000, help="Number of get/append operations"),
+    concurrency: int = typer.Option(200, help="Operations in flight at once"),
+):
+    asyncio.run(_benchmark(chats, operations, concurrency))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,132 @@
+"""Measures the per-call overhead of S3 storage calls.
+
+Compares building a new client for every call, which is what the storage
+functions used to do, with the shared S3Storage client and its presigned URL
+cache, and runs concurrent uploads through AsyncS3Storage. Runs against
+whatever S3_ENDPOINT_URL points to, e.g. the minio container of
+docker-compose-test.yaml:
+
+    python benchmarks/s3_storage.py --calls 200 --concurrency 32
+"""
+
+import asyncio
+import statistics
+import time
+import uuid
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.storage import (
+    AsyncS3Storage,
+    S3Storage,
+    create_s3_client,
+)
+
+app = typer.Typer()
+console = Console()
+
+PREFIX = "benchmark/"
+
+
+def _timed(func, calls: int) -> list[float]:
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _row(table: Table, name: str, latencies: list[float], total: float) -> None:
+    quantiles = statistics.quantiles(latencies, n=20)
+    table.add_row(
+        name,
+        f"{len(latencies) / total:.0f}",
+        f"{statistics.median(latencies) * 1000:.2f}",
+        f"{quantiles[18] * 1000:.2f}",
+    )
+
+
+async def _concurrent_uploads(
+    storage: AsyncS3Storage, keys: list[str], concurrency: int
+) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def _one(key: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await storage.upload_file(b"x" * 1024, key)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_one(key) for key in keys))
+    return time.perf_counter() - start, latencies
+
+
+@app.command()
+def main(
+    calls: int = typer.Option(200, help="Calls per measurement"),
+    concurrency: int = typer.Option(32, help="Concurrent uploads through the facade"),
+):
+    run = uuid.uuid4().hex[:8]
+    keys = [f"{PREFIX}{run}/{i}" for i in range(calls)]
+    storage = S3Storage()
+    body = b"x" * 1024
+
+    table = Table(title=f"{calls} calls per row, 1 KiB objects")
+    table.add_column("Call", style="cyan")
+    table.add_column("calls/s", justify="right", style="bold green")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+
+    measurements = [
+        (
+            "presign, new client per call",
+            lambda i: create_s3_client().generate_presigned_url(
+                "get_object", Params={"Bucket": settings.S3_BUCKET_NAME, "Key": keys[i]}
+            ),
+        ),
+        (
+            "presign, shared client",
+            lambda i: storage.generate_presigned_url(keys[i]),
+        ),
+        (
+            "presign, cached URL",
+            lambda i: storage.generate_presigned_url(keys[i % 10]),
+        ),
+        (
+            "put_object, new client per call",
+            lambda i: create_s3_client().put_object(
+                Bucket=settings.S3_BUCKET_NAME, Key=keys[i], Body=body
+            ),
+        ),
+        (
+            "put_object, shared client",
+            lambda i: storage.upload_file(body, keys[i]),
+        ),
+    ]
+    try:
+        for name, func in measurements:
+            start = time.perf_counter()
+            latencies = _timed(func, calls)
+            _row(table, name, latencies, time.perf_counter() - start)
+
+        async_storage = AsyncS3Storage(storage)
+        try:
+            total, latencies = asyncio.run(
+                _concurrent_uploads(async_storage, keys, concurrency)
+            )
+        finally:
+            async_storage.close()
+        _row(table, f"upload, AsyncS3Storage x{concurrency}", latencies, total)
+    finally:
+        storage.delete_objects(keys)
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
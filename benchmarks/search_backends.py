@@ -0,0 +1,148 @@
+"""Compares the Elasticsearch and the SQLite FTS5 search backends.
+
+Both get the same synthetic corpus through the outbox write path and answer
+the same queries. Elasticsearch runs against ELASTICSEARCH_URL, e.g. the
+container of docker-compose-test.yaml, SQLite against a temporary file:
+
+    python benchmarks/search_backends.py --chats 2000 --queries 500
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from gptbundle.messaging.elasticsearch_repository import (
+    CHATS_ALIAS,
+    MESSAGES_ALIAS,
+    ElasticsearchRepository,
+)
+from gptbundle.messaging.outbox import chat_created_event
+from gptbundle.messaging.schemas import Chat, MessageCreate, MessageRole
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
+
+app = typer.Typer()
+console = Console()
+
+USER_EMAIL = "search-benchmark@example.com"
+BATCH_SIZE = 200
+
+
+def _corpus(chats: int, messages: int, vocabulary: list[str]) -> list[Chat]:
+    rng = random.Random(42)
+    timestamp = time.time()
+    return [
+        Chat(
+            chat_id=f"bench-{uuid.uuid4()}",
+            timestamp=timestamp + i,
+            user_email=USER_EMAIL,
+            messages=[
+                MessageCreate(
+                    content=" ".join(rng.choices(vocabulary, k=40)),
+                    role=MessageRole.USER if j % 2 == 0 else MessageRole.ASSISTANT,
+                    llm_model="bench",
+                )
+                for j in range(messages)
+            ],
+        )
+        for i in range(chats)
+    ]
+
+
+async def _index(backend, corpus: list[Chat]) -> float:
+    events = [chat_created_event(chat) for chat in corpus]
+    start = time.perf_counter()
+    for i in range(0, len(events), BATCH_SIZE):
+        errors = await backend.apply_events(events[i : i + BATCH_SIZE])
+        if any(errors):
+            raise RuntimeError(f"Indexing failed: {next(e for e in errors if e)}")
+    return time.perf_counter() - start
+
+
+async def _query(backend, queries: list[str]) -> list[float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        await backend.search_chat_hits(USER_EMAIL, query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def _elasticsearch_memory(es_repo: ElasticsearchRepository) -> str:
+    stats = await es_repo.client.nodes.stats(metric="jvm")
+    heap = sum(
+        node["jvm"]["mem"]["heap_used_in_bytes"] for node in stats["nodes"].values()
+    )
+    return f"{heap / 2**20:.0f} MiB heap"
+
+
+def _sqlite_memory(path: str) -> str:
+    size = sum(os.path.getsize(f) for f in (path, f"{path}-wal") if os.path.exists(f))
+    return f"{size / 2**20:.1f} MiB on disk"
+
+
+async def _benchmark(chats: int, messages: int, queries: int) -> None:
+    rng = random.Random(7)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    corpus = _corpus(chats, messages, vocabulary)
+    query_terms = [" ".join(rng.choices(vocabulary, k=2)) for _ in range(queries)]
+
+    table = Table(title=f"{chats} chats x {messages} messages, {queries} queries")
+    table.add_column("Backend", style="cyan")
+    table.add_column("Index (docs/s)", justify="right", style="bold green")
+    table.add_column("Query p50 (ms)", justify="right")
+    table.add_column("Query p95 (ms)", justify="right")
+    table.add_column("Memory", justify="right")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        sqlite = SQLiteSearchBackend(path)
+        es_repo = ElasticsearchRepository()
+        try:
+            for name, backend in (("Elasticsearch", es_repo), ("SQLite", sqlite)):
+                total = await _index(backend, corpus)
+                if backend is es_repo:
+                    await es_repo.client.indices.refresh(
+                        index=[CHATS_ALIAS, MESSAGES_ALIAS]
+                    )
+                    memory = await _elasticsearch_memory(es_repo)
+                else:
+                    memory = _sqlite_memory(path)
+                latencies = await _query(backend, query_terms)
+                quantiles = statistics.quantiles(latencies, n=20)
+                table.add_row(
+                    name,
+                    f"{chats / total:.0f}",
+                    f"{statistics.median(latencies) * 1000:.2f}",
+                    f"{quantiles[18] * 1000:.2f}",
+                    memory,
+                )
+        finally:
+            sqlite.close()
+            await es_repo.client.delete_by_query(
+                index=[CHATS_ALIAS, MESSAGES_ALIAS],
+                query={"term": {"user_email": USER_EMAIL}},
+                conflicts="proceed",
+            )
+            await es_repo.client.close()
+    console.print(table)
+
+
+@app.command()
+def main(
+    chats: int = typer.Option(2000, help="Number of chats in the corpus"),
+    messages: int = typer.Option(10, help="Messages per chat"),
+    queries: int = typer.Option(500, help="Number of searches per backend"),
+):
+    asyncio.run(_benchmark(chats, messages, queries))
+
+
+if __name__ == "__main__":
+    app()
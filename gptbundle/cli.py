@@ -3,11 +3,30 @@ from datetime import datetime
 
 import typer
 from rich.console import Console
+from rich.progress import (
+    BarColumn,
+    MofNCompleteColumn,
+    Progress,
+    TaskProgressColumn,
+    TextColumn,
+    TimeElapsedColumn,
+)
 from rich.table import Table
 
+from gptbundle.common.config import settings
 from gptbundle.common.db import get_pg_db
+from gptbundle.common.dynamodb import AsyncDynamoDBClient
+from gptbundle.messaging.elasticsearch_repository import ElasticsearchRepository
 from gptbundle.messaging.models import Chat as ChatModel
+from gptbundle.messaging.models import (
+    ChatPurge,
+    SearchOutboxCheckpoint,
+    SearchOutboxEvent,
+)
+from gptbundle.messaging.outbox import event_id_time
 from gptbundle.messaging.repository import ChatRepository
+from gptbundle.messaging.search_reindex import SearchReindexer, SQLiteSearchReindexer
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
 from gptbundle.user.models import UserCreate
 from gptbundle.user.service import (
     activate_user as service_activate_user,
@@ -175,8 +194,9 @@ def list_chats():
             dt_object = datetime.fromtimestamp(chat.timestamp)
             formatted_ts = dt_object.strftime("%Y-%m-%d %H:%M:%S")
 
+            message_count = chat.message_count + len(chat.messages or [])
             table.add_row(
-                chat.chat_id, chat.user_email, formatted_ts, str(len(chat.messages))
+                chat.chat_id, chat.user_email, formatted_ts, str(message_count)
             )
 
         console.print(table)
@@ -223,7 +243,7 @@ def delete_chats_by_email(
         count = 0
         repo = ChatRepository()
         for chat in chats:
-            if repo.delete_chat(chat.chat_id, chat.timestamp):
+            if repo.delete_chat(chat.chat_id, chat.timestamp, email):
                 count += 1
 
         console.print(
@@ -253,5 +273,228 @@ def delete_all_chats():
         console.print(f"[red]Error deleting all chats:[/red] {e}")
 
 
+@app.command(
+    help="Moves chats stored as a single item with all messages into the "
+    "message-per-item layout. Safe to run more than once."
+)
+def migrate_chat_messages():
+    try:
+        legacy_chats = ChatModel.scan(ChatModel.messages.exists())
+        repo = ChatRepository()
+        chat_count = 0
+        message_count = 0
+        for chat in legacy_chats:
+            try:
+                message_count += repo.migrate_legacy_chat(chat)
+                chat_count += 1
+            except Exception as e:
+                console.print(
+                    f"[red]Error migrating chat {chat.chat_id} "
+                    f"at {chat.timestamp}:[/red] {e}"
+                )
+
+        console.print(
+            f"[green]Successfully migrated {chat_count} chats "
+            f"({message_count} messages).[/green]"
+        )
+    except Exception as e:
+        console.print(f"[red]Error migrating chats:[/red] {e}")
+
+
+@app.command(help="Shows how far the search index lags behind the chat writes.")
+def search_outbox_status():
+    try:
+        table = Table(title="Search Outbox")
+        table.add_column("Shard", style="cyan")
+        table.add_column("Owner", style="green")
+        table.add_column("Lease expires", style="magenta")
+        table.add_column("Pending events", style="bold yellow")
+        table.add_column("Oldest pending", style="red")
+
+        for shard in range(settings.SEARCH_OUTBOX_SHARDS):
+            try:
+                checkpoint = SearchOutboxCheckpoint.get(shard)
+            except SearchOutboxCheckpoint.DoesNotExist:
+                checkpoint = SearchOutboxCheckpoint(shard)
+            pending = list(
+                SearchOutboxEvent.query(
+                    shard,
+                    SearchOutboxEvent.event_id > checkpoint.event_id
+                    if checkpoint.event_id
+                    else None,
+                    attributes_to_get=["shard", "event_id"],
+                )
+            )
+            lease_expires = (
+                datetime.fromtimestamp(checkpoint.lease_expires_at).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+                if checkpoint.lease_expires_at
+                else "-"
+            )
+            oldest = (
+                datetime.fromtimestamp(event_id_time(pending[0].event_id)).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+                if pending
+                else "-"
+            )
+            table.add_row(
+                str(shard),
+                checkpoint.owner or "-",
+                lease_expires,
+                str(len(pending)),
+                oldest,
+            )
+
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error reading the search outbox:[/red] {e}")
+
+
+@app.command(help="Shows the deleted chats whose data is still to be purged.")
+def chat_purge_status(
+    limit: int = typer.Option(20, help="Purges to list, the most retried first"),
+):
+    try:
+        purges = list(ChatPurge.scan())
+        if not purges:
+            console.print("[green]No deleted chats waiting to be purged.[/green]")
+            return
+
+        now = datetime.now().timestamp()
+        failing = [purge for purge in purges if purge.last_error]
+        oldest = min(purge.requested_at for purge in purges)
+        console.print(
+            f"{len(purges)} chats waiting to be purged, {len(failing)} of them "
+            f"failed before. Oldest deletion {now - oldest:.0f}s ago."
+        )
+
+        table = Table(title="Chat Purge Backlog")
+        table.add_column("Chat ID", style="cyan", no_wrap=True)
+        table.add_column("User Email", style="green")
+        table.add_column("Deleted", style="magenta")
+        table.add_column("Attempts", style="bold yellow")
+        table.add_column("Next attempt", style="magenta")
+        table.add_column("Last error", style="red")
+
+        purges.sort(key=lambda purge: (-purge.attempts, purge.requested_at))
+        for purge in purges[:limit]:
+            table.add_row(
+                purge.chat_id,
+                purge.user_email,
+                datetime.fromtimestamp(purge.requested_at).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                str(purge.attempts),
+                datetime.fromtimestamp(purge.next_attempt_at).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                purge.last_error or "-",
+            )
+
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error reading the chat purge backlog:[/red] {e}")
+
+
+@app.command(
+    help="Rebuilds the search index from DynamoDB into a new index and switches "
+    "the chats alias over to it once it is complete. With SEARCH_BACKEND=sqlite "
+    "it fills the SQLite search database in place instead."
+)
+def reindex_search(
+    segments: int = typer.Option(8, help="Parallel scan segments of the Chat table"),
+    concurrency: int = typer.Option(4, help="Bulk requests in flight at once"),
+    batch_size: int = typer.Option(500, help="Chats per scan page and bulk request"),
+):
+    sqlite = settings.SEARCH_BACKEND == "sqlite"
+
+    async def _run():
+        dynamodb_client = AsyncDynamoDBClient()
+        if sqlite:
+            search_backend = SQLiteSearchBackend()
+        else:
+            es_client = ElasticsearchRepository().client
+        progress = Progress(
+            TextColumn("[cyan]Reindexing chats"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TaskProgressColumn(),
+            TextColumn("[bold green]{task.fields[rate]} docs/s"),
+            TimeElapsedColumn(),
+            console=console,
+        )
+        try:
+            with progress:
+                task = progress.add_task("reindex", total=None, rate="-")
+
+                def _advance(documents: int) -> None:
+                    progress.advance(task, documents)
+                    elapsed = progress.tasks[task].elapsed or 0
+                    if elapsed:
+                        rate = progress.tasks[task].completed / elapsed
+                        progress.update(task, rate=f"{rate:.0f}")
+
+                options = {
+                    "segments": segments,
+                    "concurrency": concurrency,
+                    "batch_size": batch_size,
+                    "on_progress": _advance,
+                }
+                if sqlite:
+                    reindexer = SQLiteSearchReindexer(
+                        search_backend, dynamodb_client, **options
+                    )
+                else:
+                    reindexer = SearchReindexer(es_client, dynamodb_client, **options)
+                # only an estimate, the bar may run past it
+                progress.update(task, total=await reindexer.estimated_chats() or None)
+                return await reindexer.run()
+        finally:
+            await dynamodb_client.close()
+            if sqlite:
+                search_backend.close()
+            else:
+                await es_client.close()
+
+    try:
+        result = asyncio.run(_run())
+    except Exception as e:
+        console.print(f"[red]Error reindexing search:[/red] {e}")
+        return
+
+    if sqlite:
+        if result.failed:
+            console.print(
+                f"[red]{result.failed} chats could not be indexed, run "
+                "reindex-search again.[/red]"
+            )
+            return
+        console.print(
+            f"[green]Indexed {result.documents} chats into "
+            f"{settings.SQLITE_SEARCH_PATH}.[/green]"
+        )
+        return
+
+    new_indices = ", ".join(result.indices.values())
+    if not result.swapped:
+        console.print(
+            f"[red]{result.failed} chats could not be indexed, the search keeps "
+            f"using the old indices. The incomplete indices {new_indices} can be "
+            "deleted.[/red]"
+        )
+        return
+    console.print(
+        f"[green]Indexed {result.documents} chats into {new_indices}, "
+        "search now uses them.[/green]"
+    )
+    if result.previous_indices:
+        console.print(
+            f"Previous indices, delete once the new one is verified: "
+            f"{', '.join(result.previous_indices)}"
+        )
+
+
 if __name__ == "__main__":
     app()
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import PostgresDsn, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -23,6 +25,9 @@ class Settings(BaseSettings):
 
     AWS_REGION: str = "eu-central-1"
     AWS_ENDPOINT_URL_DYNAMODB: str
+    # use AsyncChatRepository instead of running ChatRepository in threads
+    DYNAMODB_ASYNC_CLIENT: bool = False
+    DYNAMODB_MAX_POOL_CONNECTIONS: int = 50
 
     S3_ENDPOINT_URL: str
     S3_ACCESS_KEY_ID: str
@@ -32,6 +37,57 @@ class Settings(BaseSettings):
     S3_DOC_PREFIX: str = "pdfs/"
     S3_PERMANENT_PREFIX: str = "permanent/"
     S3_TEMP_PREFIX: str = "temp/"
+    # direct uploads are stored once per user and content, under
+    # S3_PERMANENT_PREFIX + S3_CONTENT_PREFIX
+    S3_CONTENT_PREFIX: str = "content/"
+    # one client is shared by the process, S3 calls of async code run on an
+    # executor of this many threads
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_EXECUTOR_WORKERS: int = 32
+    # presigned URLs are reused while they stay valid for at least
+    # S3_PRESIGNED_URL_MIN_TTL seconds (or half their lifetime, if shorter)
+    S3_PRESIGNED_URL_CACHE_SIZE: int = 10_000
+    S3_PRESIGNED_URL_MIN_TTL: int = 900
+    # moves of the attachments of one message that run at once
+    S3_ATTACHMENT_CONCURRENCY: int = 8
+    # uploads are streamed to S3 in parts of S3_MULTIPART_CHUNK_SIZE bytes,
+    # files above S3_MULTIPART_THRESHOLD as multipart uploads, and
+    # S3_UPLOAD_CONCURRENCY files of a request at once
+    S3_UPLOAD_MAX_FILE_SIZE: int = 50 * 1024 * 1024
+    S3_UPLOAD_MAX_FILES: int = 10
+    S3_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024
+    S3_UPLOAD_CONCURRENCY: int = 4
+    # browsers upload straight to S3 with presigned POST policies valid for
+    # S3_UPLOAD_POLICY_EXPIRATION seconds, for these content types only
+    S3_UPLOAD_POLICY_EXPIRATION: int = 300
+    S3_UPLOAD_CONTENT_TYPES: list[str] = [
+        "image/png",
+        "image/jpeg",
+        "image/gif",
+        "image/webp",
+        "application/pdf",
+    ]
+    # direct uploads that no message attached within S3_PENDING_UPLOAD_TTL
+    # seconds are deleted by a sweeper running every S3_PENDING_SWEEP_INTERVAL
+    S3_PENDING_UPLOAD_TTL: int = 24 * 3600
+    S3_PENDING_SWEEP_INTERVAL: float = 600.0
+    # uploaded and generated images are stored under S3_IMAGE_PREFIX next to
+    # re-encoded variants, rendered once in a pool of IMAGE_PROCESS_WORKERS
+    # processes. LLM calls and chat views use the preview, the thumbnail is
+    # served on request and the original stays as it was uploaded.
+    S3_IMAGE_PREFIX: str = "images/"
+    IMAGE_PROCESS_WORKERS: int = 2
+    IMAGE_FORMAT: Literal["WEBP", "JPEG"] = "WEBP"
+    IMAGE_QUALITY: int = 80
+    IMAGE_PREVIEW_MAX_SIZE: int = 1568
+    IMAGE_THUMBNAIL_MAX_SIZE: int = 256
+    # larger images are stored without variants, guards against
+    # decompression bombs
+    IMAGE_MAX_PIXELS: int = 64_000_000
+    # images are read into memory to be rendered, larger files are stored
+    # without variants
+    IMAGE_MAX_BYTES: int = 20 * 1024 * 1024
 
     CHROMA_PERSIST_DIRECTORY: str = "./chroma_data"
     VECTOR_STORE_COLLECTION_NAME: str = "gptbundle"
@@ -43,6 +99,57 @@ class Settings(BaseSettings):
     ELASTICSEARCH_HOST: str = "http://localhost:9200"
     ELASTICSEARCH_USER: str = "elastic"
     ELASTICSEARCH_PASSWORD: str = "changemepls"
+    ELASTICSEARCH_NUMBER_OF_SHARDS: int = 1
+    ELASTICSEARCH_NUMBER_OF_REPLICAS: int = 1
+    ELASTICSEARCH_MESSAGES_ROLLOVER_MAX_AGE: str = "30d"
+    ELASTICSEARCH_MESSAGES_ROLLOVER_MAX_PRIMARY_SHARD_SIZE: str = "50gb"
+    # writes are buffered and sent with the bulk API by a background task
+    ELASTICSEARCH_BULK_MAX_ACTIONS: int = 500
+    ELASTICSEARCH_BULK_FLUSH_INTERVAL: float = 1.0
+    ELASTICSEARCH_BULK_MAX_QUEUE_SIZE: int = 10_000
+
+    # "sqlite" keeps the search index in an embedded SQLite FTS5 database
+    # instead, for single node deployments without an Elasticsearch cluster
+    SEARCH_BACKEND: Literal["elasticsearch", "sqlite"] = "elasticsearch"
+    SQLITE_SEARCH_PATH: str = "./search.db"
+
+    # search results are cached per user until one of the user's chats changes,
+    # with SEARCH_CACHE_REDIS the processes share the cache through REDIS_URL
+    SEARCH_CACHE_ENABLED: bool = True
+    SEARCH_CACHE_REDIS: bool = False
+    SEARCH_CACHE_MAX_ENTRIES: int = 10_000
+    SEARCH_CACHE_TTL: float = 300.0
+    # a change is searchable once the outbox consumer applied it and the index
+    # refreshed, results fetched within SEARCH_OUTBOX_READ_DELAY +
+    # SEARCH_OUTBOX_POLL_INTERVAL + SEARCH_CACHE_SETTLE_SECONDS after a change
+    # are not cached
+    SEARCH_CACHE_SETTLE_SECONDS: float = 1.0
+    # autocomplete queries of a user wait this long for a newer one to replace
+    # them, and give up on the search backend after the timeout
+    SEARCH_AUTOCOMPLETE_DEBOUNCE: float = 0.075
+    SEARCH_AUTOCOMPLETE_TIMEOUT: float = 0.15
+
+    # chat writes record search index changes in the outbox table, a consumer
+    # in the app applies them. Changing the shard count while events are
+    # pending can reorder the events of a chat.
+    SEARCH_OUTBOX_SHARDS: int = 4
+    SEARCH_OUTBOX_BATCH_SIZE: int = 100
+    SEARCH_OUTBOX_POLL_INTERVAL: float = 0.5
+    # events younger than this are left for the next poll, so that a write
+    # with a slightly older event id that commits late is not skipped
+    SEARCH_OUTBOX_READ_DELAY: float = 2.0
+    SEARCH_OUTBOX_LEASE_SECONDS: int = 30
+    SEARCH_OUTBOX_MAX_ATTEMPTS: int = 5
+    SEARCH_OUTBOX_RETENTION_DAYS: int = 7
+
+    # deleting a chat only drops its header, a worker in the app purges the
+    # rest. A failed purge is retried after CHAT_PURGE_RETRY_DELAY seconds,
+    # doubling with every attempt up to CHAT_PURGE_MAX_RETRY_DELAY.
+    CHAT_PURGE_INTERVAL: float = 5.0
+    CHAT_PURGE_BATCH_SIZE: int = 10
+    CHAT_PURGE_LEASE_SECONDS: int = 300
+    CHAT_PURGE_RETRY_DELAY: float = 30.0
+    CHAT_PURGE_MAX_RETRY_DELAY: float = 3600.0
 
     OPENROUTER_API_KEY: str
     OPENROUTER_MODELS_URL: str = "https://openrouter.ai/api/v1/models"
@@ -60,6 +167,8 @@ class Settings(BaseSettings):
     LOG_DATE_FORMAT: str = "%Y-%m-%d %H:%M:%S"
 
     ALLOW_REGISTRATION: bool = True
+    # users that may read the operational metrics of the API processes
+    ADMIN_EMAILS: list[str] = []
 
     @computed_field  # type: ignore[misc]
     @property
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any
+
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.session import get_session
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+}
+
+
+class DynamoDBError(Exception):
+    """Exception raised when DynamoDB answers a request with an error."""
+
+    def __init__(
+        self,
+        code: str,
+        message: str,
+        cancellation_reasons: list[str | None] | None = None,
+    ):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+        # one reason code per item of a canceled TransactWriteItems
+        self.cancellation_reasons = cancellation_reasons or []
+
+
+class AsyncDynamoDBClient:
+    """Minimal natively async client for the DynamoDB JSON API.
+
+    Requests are signed with botocore (same credential chain as PynamoDB) and
+    sent through a single httpx connection pool that is shared by every
+    repository instance of the process.
+    """
+
+    _shared: "AsyncDynamoDBClient | None" = None
+
+    def __init__(
+        self,
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        max_connections: int | None = None,
+        max_attempts: int = 4,
+    ):
+        self.region = region or settings.AWS_REGION
+        self.endpoint_url = (
+            endpoint_url
+            or settings.AWS_ENDPOINT_URL_DYNAMODB
+            or f"https://dynamodb.{self.region}.amazonaws.com"
+        )
+        self.max_attempts = max_attempts
+        self._credentials = get_session().get_credentials()
+        max_connections = max_connections or settings.DYNAMODB_MAX_POOL_CONNECTIONS
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+        )
+
+    @classmethod
+    def shared(cls) -> "AsyncDynamoDBClient":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    async def close_shared(cls) -> None:
+        if cls._shared is not None:
+            await cls._shared.close()
+            cls._shared = None
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+    async def request(self, operation: str, payload: dict[str, Any]) -> dict[str, Any]:
+        """Sends a request, retrying throttling, server errors and transport
+        errors up to max_attempts times."""
+        if operation == "TransactWriteItems":
+            # like botocore, so that retrying a transaction that went through
+            # before the connection broke does not apply it twice
+            payload = {"ClientRequestToken": str(uuid.uuid4()), **payload}
+        body = json.dumps(payload)
+        attempt = 1
+        while True:
+            try:
+                response = await self._http.post(
+                    self.endpoint_url,
+                    content=body,
+                    headers=self._signed_headers(operation, body),
+                )
+            except httpx.TransportError as e:
+                if attempt >= self.max_attempts:
+                    raise
+                reason = repr(e)
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = self._parse_error(response)
+                retryable = (
+                    error.code in RETRYABLE_ERRORS or response.status_code >= 500
+                )
+                if not retryable or attempt >= self.max_attempts:
+                    raise error
+                reason = error.code
+            delay = 0.05 * 2**attempt
+            logger.debug(
+                f"DynamoDB {operation} failed with {reason}, "
+                f"retrying in {delay:.2f}s (attempt {attempt})"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def batch_write(self, table_name: str, requests: list[dict]) -> None:
+        # BatchWriteItem takes at most 25 requests and may hand back a part of
+        # them as unprocessed when the table is throttled
+        for start in range(0, len(requests), 25):
+            pending = {table_name: requests[start : start + 25]}
+            for attempt in range(1, self.max_attempts + 1):
+                response = await self.request(
+                    "BatchWriteItem", {"RequestItems": pending}
+                )
+                pending = response.get("UnprocessedItems") or {}
+                if not pending:
+                    break
+                await asyncio.sleep(0.05 * 2**attempt)
+            if pending:
+                raise DynamoDBError(
+                    "UnprocessedItems",
+                    f"{len(pending[table_name])} write requests were not processed",
+                )
+
+    def _signed_headers(self, operation: str, body: str) -> dict[str, str]:
+        request = AWSRequest(
+            method="POST",
+            url=self.endpoint_url,
+            data=body,
+            headers={
+                "Content-Type": "application/x-amz-json-1.0",
+                "X-Amz-Target": f"DynamoDB_20120810.{operation}",
+            },
+        )
+        SigV4Auth(
+            self._credentials.get_frozen_credentials(), "dynamodb", self.region
+        ).add_auth(request)
+        return dict(request.headers.items())
+
+    def _parse_error(self, response: httpx.Response) -> DynamoDBError:
+        try:
+            error = response.json()
+        except ValueError:
+            return DynamoDBError(f"HTTP{response.status_code}", response.text)
+        code = error.get("__type", f"HTTP{response.status_code}").split("#")[-1]
+        message = error.get("message") or error.get("Message") or ""
+        return DynamoDBError(
+            code,
+            message,
+            [reason.get("Code") for reason in error.get("CancellationReasons", [])],
+        )
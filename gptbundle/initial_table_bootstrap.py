@@ -1,9 +1,63 @@
-from messaging.models import Chat
+import boto3
+from media_storage.models import ContentObject, PendingUpload
+from messaging.models import (
+    Chat,
+    ChatMessage,
+    ChatPurge,
+    SearchOutboxCheckpoint,
+    SearchOutboxEvent,
+)
+
+from gptbundle.common.config import settings
+
+
+def create_missing_indexes(model) -> None:
+    # PynamoDB only creates indexes together with the table, indexes added to a
+    # model later on have to be created on the existing table
+    description = model.describe_table()
+    existing_indexes = {
+        index["IndexName"] for index in description.get("GlobalSecondaryIndexes", [])
+    }
+    client = boto3.client(
+        "dynamodb",
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.AWS_ENDPOINT_URL_DYNAMODB,
+    )
+    for index in model._get_schema()["global_secondary_indexes"]:
+        if index["index_name"] in existing_indexes:
+            continue
+        client.update_table(
+            TableName=model.Meta.table_name,
+            AttributeDefinitions=index["attribute_definitions"],
+            GlobalSecondaryIndexUpdates=[
+                {
+                    "Create": {
+                        "IndexName": index["index_name"],
+                        "KeySchema": index["key_schema"],
+                        "Projection": index["projection"],
+                        "ProvisionedThroughput": index["provisioned_throughput"],
+                    }
+                }
+            ],
+        )
+        print(f"Created index {index['index_name']} on {model.Meta.table_name}")
 
 
 def init() -> None:
     if not Chat.exists():
         Chat.create_table()
+    else:
+        create_missing_indexes(Chat)
+    for model in (
+        ChatMessage,
+        SearchOutboxEvent,
+        SearchOutboxCheckpoint,
+        PendingUpload,
+        ContentObject,
+        ChatPurge,
+    ):
+        if not model.exists():
+            model.create_table()
 
 
 if __name__ == "__main__":
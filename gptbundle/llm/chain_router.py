@@ -20,6 +20,7 @@ class ChainRouter:
         use_rag: bool,
         chat_id: str,
         is_rag_chat: bool = False,
+        pdf_s3_keys: list[str] | None = None,
     ) -> Runnable:
         if use_rag or is_rag_chat or self._chat_id_to_type.get(chat_id) == "rag":
             logger.debug(f"Routing to RAG chain for chat_id: {chat_id}")
@@ -30,7 +31,7 @@ class ChainRouter:
 
             if use_rag:
                 logger.info(f"Ingesting files for chat_id: {chat_id}")
-                ingest_pdf(chat_id)
+                ingest_pdf(chat_id, pdf_s3_keys)
 
             if self._rag_chain is None:
                 logger.info("Initializing singleton RAG chain")
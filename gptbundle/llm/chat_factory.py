@@ -2,6 +2,8 @@ from typing import Any
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 
+from gptbundle.common.config import settings
+from gptbundle.media_storage.images import ImageVariant, variant_key
 from gptbundle.media_storage.storage import generate_presigned_url
 from gptbundle.messaging.schemas import MessageCreate, MessageRole
 
@@ -12,7 +14,8 @@ def input_to_llm(message: MessageCreate) -> dict[str, Any]:
 
     question_content = [{"type": "text", "text": message.content}]
     for key in message.img_s3_keys:
-        presigned_url = generate_presigned_url(key)
+        # the size capped preview costs the model fewer tokens than the original
+        presigned_url = generate_presigned_url(variant_key(key, ImageVariant.PREVIEW))
         question_content.append(
             {"type": "image_url", "image_url": {"url": presigned_url}}
         )
@@ -20,12 +23,19 @@ def input_to_llm(message: MessageCreate) -> dict[str, Any]:
     return {"input": question_content}
 
 
+def _s3_url_prefix() -> str:
+    return f"s3://{settings.S3_BUCKET_NAME}/"
+
+
 def msg_schema_to_lc_base_message(message: MessageCreate) -> BaseMessage:
+    """Converts a message for the LLM history. Its images refer to their S3
+    objects, presign_images signs them when the history is read for a call,
+    so a URL in the history cannot expire."""
     content: str | list[dict[str, Any]] = message.content
 
     image_urls = []
     if message.img_s3_keys:
-        image_urls = [generate_presigned_url(key) for key in message.img_s3_keys]
+        image_urls = [f"{_s3_url_prefix()}{key}" for key in message.img_s3_keys]
     elif message.img_presigned_urls:
         image_urls = [
             url for url in message.img_presigned_urls if not url.startswith("blob:")
@@ -42,3 +52,27 @@ def msg_schema_to_lc_base_message(message: MessageCreate) -> BaseMessage:
         return AIMessage(content=content)
     else:
         raise ValueError(f"Unsupported role: {message.role}")
+
+
+def _presigned_part(part: str | dict[str, Any]) -> str | dict[str, Any]:
+    if not isinstance(part, dict) or part.get("type") != "image_url":
+        return part
+    url = part["image_url"]["url"]
+    if not url.startswith(_s3_url_prefix()):
+        return part
+    key = url.removeprefix(_s3_url_prefix())
+    # the size capped preview costs the model fewer tokens than the original
+    presigned_url = generate_presigned_url(variant_key(key, ImageVariant.PREVIEW))
+    return {**part, "image_url": {**part["image_url"], "url": presigned_url}}
+
+
+def presign_images(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """Replaces the S3 objects of the images in history messages with
+    presigned URLs of their previews."""
+    presigned = []
+    for message in messages:
+        if isinstance(message.content, list):
+            content = [_presigned_part(part) for part in message.content]
+            message = message.model_copy(update={"content": content})
+        presigned.append(message)
+    return presigned
@@ -4,6 +4,8 @@ from langchain_core.messages import BaseMessage
 
 from gptbundle.common.config import settings
 
+from .chat_factory import presign_images
+
 
 class ChatMessageHistoryWrapper(BaseChatMessageHistory):
     def __init__(self, session_id: str):
@@ -14,7 +16,7 @@ class ChatMessageHistoryWrapper(BaseChatMessageHistory):
 
     @property
     def messages(self) -> list[BaseMessage]:
-        return self.message_history.messages
+        return presign_images(self.message_history.messages)
 
     def add_message(self, message: BaseMessage) -> None:
         self.message_history.add_message(message)
@@ -6,7 +6,7 @@ from langchain_classic.chains.history_aware_retriever import (
     create_history_aware_retriever,
 )
 from langchain_classic.chains.retrieval import create_retrieval_chain
-from langchain_community.document_loaders import S3DirectoryLoader
+from langchain_community.document_loaders import S3DirectoryLoader, S3FileLoader
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.prompts.chat import MessagesPlaceholder
@@ -53,9 +53,22 @@ def _get_document_loader(prefix: str) -> S3DirectoryLoader:
     )
 
 
+def _get_file_loader(key: str) -> S3FileLoader:
+    return S3FileLoader(
+        bucket=settings.S3_BUCKET_NAME,
+        key=key,
+        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+    )
+
+
+def _collection_name(chat_id: str) -> str:
+    return f"{settings.VECTOR_STORE_COLLECTION_NAME}_{chat_id}"
+
+
 def _get_vector_store(chat_id: str):
     return Chroma(
-        collection_name=f"{settings.VECTOR_STORE_COLLECTION_NAME}_{chat_id}",
+        collection_name=_collection_name(chat_id),
         embedding_function=MistralAIEmbeddings(
             model=settings.MISTRAL_EMBED_MODEL,
             api_key=settings.MISTRAL_API_KEY,
@@ -64,6 +77,15 @@ def _get_vector_store(chat_id: str):
     )
 
 
+def delete_vector_store(chat_id: str) -> None:
+    # no embeddings needed to drop it, a chat without PDFs gets an empty
+    # collection created and dropped again
+    Chroma(
+        collection_name=_collection_name(chat_id),
+        persist_directory=settings.CHROMA_PERSIST_DIRECTORY,
+    ).delete_collection()
+
+
 def _ingest(vector_store: VectorStore, loader: BaseLoader):
     docs = loader.load()
     text_splitter = RecursiveCharacterTextSplitter(
@@ -74,12 +96,19 @@ def _ingest(vector_store: VectorStore, loader: BaseLoader):
     vector_store.add_documents(documents=text_splitter.split_documents(docs))
 
 
-def ingest_pdf(chat_id: str):
-    loader = _get_document_loader(
-        f"{settings.S3_PERMANENT_PREFIX}{settings.S3_DOC_PREFIX}{chat_id}/"
-    )
+def ingest_pdf(chat_id: str, s3_keys: list[str] | None = None):
+    """Adds PDFs to the vector store of the chat. Only the given keys when
+    there are any, content addressed PDFs are shared between chats and are not
+    under the document prefix of the chat."""
     vector_store = _get_vector_store(chat_id)
-    _ingest(vector_store, loader)
+    if not s3_keys:
+        loader = _get_document_loader(
+            f"{settings.S3_PERMANENT_PREFIX}{settings.S3_DOC_PREFIX}{chat_id}/"
+        )
+        _ingest(vector_store, loader)
+        return
+    for key in s3_keys:
+        _ingest(vector_store, _get_file_loader(key))
 
 
 def _get_dynamic_retriever(query: str, config: RunnableConfig):
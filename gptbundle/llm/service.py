@@ -9,7 +9,14 @@ from litellm import acompletion
 
 from gptbundle.common.config import settings
 from gptbundle.llm.exceptions import ModelDoesNotSupportReasoningEffortError
-from gptbundle.media_storage.storage import generate_presigned_url, upload_file
+from gptbundle.media_storage.images import (
+    ImageProcessor,
+    ImageVariant,
+    image_key,
+    upload_variants,
+    variant_key,
+)
+from gptbundle.media_storage.storage import AsyncS3Storage, generate_presigned_url
 from gptbundle.messaging.schemas import MessageCreate, MessageRole
 
 from .chain_router import router
@@ -37,6 +44,7 @@ async def generate_text_response(
         use_rag=pdf_was_uploaded,
         chat_id=chat_id,
         is_rag_chat=is_rag_chat,
+        pdf_s3_keys=user_message.pdf_s3_keys,
     )
 
     reasoning_config = (
@@ -81,9 +89,18 @@ async def generate_image_response(user_message: MessageCreate) -> MessageCreate:
             _, encoded = image.get("image_url").get("url").split(",", 1)
             image_bytes = base64.b64decode(encoded)
             s3_key = f"{settings.S3_PERMANENT_PREFIX}{uuid.uuid4()}.png"
-            await asyncio.to_thread(upload_file, image_bytes, s3_key)
+            variants = await ImageProcessor.shared().render(image_bytes)
+            if variants:
+                s3_key = image_key(s3_key)
+            storage = AsyncS3Storage.shared()
+            await asyncio.gather(
+                storage.upload_file(image_bytes, s3_key, content_type="image/png"),
+                upload_variants(storage, s3_key, variants or {}),
+            )
             s3_keys.append(s3_key)
-            presigned_urls.append(generate_presigned_url(s3_key))
+            presigned_urls.append(
+                generate_presigned_url(variant_key(s3_key, ImageVariant.PREVIEW))
+            )
     return MessageCreate(
         content=text_response,
         role=MessageRole.ASSISTANT,
@@ -1,10 +1,20 @@
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from gptbundle.common.config import settings
+from gptbundle.common.dynamodb import AsyncDynamoDBClient
 from gptbundle.common.logging import setup_logging
+from gptbundle.media_storage.images import ImageProcessor
+from gptbundle.media_storage.pending import PendingUploadSweeper
+from gptbundle.media_storage.storage import AsyncS3Storage
+from gptbundle.messaging.elasticsearch_repository import ElasticsearchRepository
+from gptbundle.messaging.outbox_consumer import SearchOutboxConsumer
+from gptbundle.messaging.purge_worker import ChatPurgeWorker
+from gptbundle.messaging.search_cache import SearchResultCache
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
 from gptbundle.routers import api_router
 
 setup_logging(
@@ -14,8 +24,32 @@ setup_logging(
     date_format=settings.LOG_DATE_FORMAT,
 )
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.SEARCH_BACKEND == "elasticsearch":
+        ElasticsearchRepository.start_bulk_indexer()
+    outbox_consumer = SearchOutboxConsumer()
+    outbox_consumer.start()
+    pending_upload_sweeper = PendingUploadSweeper()
+    pending_upload_sweeper.start()
+    chat_purge_worker = ChatPurgeWorker()
+    chat_purge_worker.start()
+    yield
+    await chat_purge_worker.stop()
+    await pending_upload_sweeper.stop()
+    await outbox_consumer.stop()
+    await ElasticsearchRepository.stop_bulk_indexer()
+    SQLiteSearchBackend.close_shared()
+    await SearchResultCache.close_shared()
+    await AsyncDynamoDBClient.close_shared()
+    AsyncS3Storage.close_shared()
+    ImageProcessor.close_shared()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     root_path=settings.SUBDIRECTORY,
 )
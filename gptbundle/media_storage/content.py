@@ -0,0 +1,75 @@
+import hashlib
+import time
+from collections import Counter
+from typing import BinaryIO
+
+from pynamodb.transactions import TransactWrite
+
+from gptbundle.common.config import settings
+
+from .models import ContentObject
+from .pending import record_pending_uploads
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_prefix() -> str:
+    return f"{settings.S3_PERMANENT_PREFIX}{settings.S3_CONTENT_PREFIX}"
+
+
+def user_content_prefix(user_email: str) -> str:
+    # Deduplicated per user only, otherwise uploading a file would tell whether
+    # anybody else stored it before.
+    owner = hashlib.sha256(user_email.encode()).hexdigest()[:16]
+    return f"{content_prefix()}{owner}/"
+
+
+def content_key(user_email: str, digest: str, file_ext: str) -> str:
+    return f"{user_content_prefix(user_email)}{digest}{file_ext.lower()}"
+
+
+def is_content_key(s3_key: str) -> bool:
+    return s3_key.startswith(content_prefix())
+
+
+def file_digest(fileobj: BinaryIO) -> str:
+    """SHA-256 of a file, read in chunks. Leaves the file at its start."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    while chunk := fileobj.read(CHUNK_SIZE):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def add_references(s3_keys: list[str]) -> None:
+    """Counts the attachments of a message that refer to content addressed
+    objects, every occurrence of a key is one reference."""
+    for key, count in Counter(k for k in s3_keys if is_content_key(k)).items():
+        ContentObject(key).update(actions=[ContentObject.refs.add(count)])
+
+
+def release_references(transaction: TransactWrite, s3_keys: list[str]) -> None:
+    """Drops the references of deleted attachments within the transaction that
+    deletes them, so that retrying a deletion cannot release them twice."""
+    for key, count in Counter(k for k in s3_keys if is_content_key(k)).items():
+        transaction.update(ContentObject(key), actions=[ContentObject.refs.add(-count)])
+
+
+def release_unreferenced(user_email: str, s3_keys: list[str]) -> list[str]:
+    """Hands the content addressed objects no attachment refers to anymore to
+    the pending upload sweeper, returns their keys.
+
+    They become expired pending uploads the sweeper deletes on its next run,
+    unless the user attaches them again first, which keeps a concurrent upload
+    of the same file from losing its object.
+    """
+    keys = {key for key in s3_keys if is_content_key(key)}
+    referenced = {
+        content.s3_key for content in ContentObject.batch_get(keys) if content.refs > 0
+    }
+    released = sorted(keys - referenced)
+    if released:
+        expired = time.time() - settings.S3_PENDING_UPLOAD_TTL
+        record_pending_uploads(user_email, released, uploaded_at=expired)
+    return released
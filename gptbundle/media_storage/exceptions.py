@@ -0,0 +1,7 @@
+class PendingUploadError(Exception):
+    """Exception raised when attached S3 keys are not pending uploads of the
+    user, e.g. because they were swept already or uploaded by someone else."""
+
+    def __init__(self, keys: list[str]):
+        super().__init__(f"Not pending uploads of the user: {keys}")
+        self.keys = keys
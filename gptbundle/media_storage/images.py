@@ -0,0 +1,189 @@
+import asyncio
+import io
+import multiprocessing
+import posixpath
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from enum import StrEnum
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from gptbundle.common.config import settings
+
+from .storage import AsyncS3Storage
+
+
+class ImageVariant(StrEnum):
+    ORIGINAL = "original"
+    PREVIEW = "preview"
+    THUMBNAIL = "thumbnail"
+
+
+class RenderOptions(NamedTuple):
+    max_sizes: dict[ImageVariant, int]
+    image_format: str
+    quality: int
+    max_pixels: int
+
+    @classmethod
+    def from_settings(cls) -> "RenderOptions":
+        return cls(
+            max_sizes={
+                ImageVariant.PREVIEW: settings.IMAGE_PREVIEW_MAX_SIZE,
+                ImageVariant.THUMBNAIL: settings.IMAGE_THUMBNAIL_MAX_SIZE,
+            },
+            image_format=settings.IMAGE_FORMAT,
+            quality=settings.IMAGE_QUALITY,
+            max_pixels=settings.IMAGE_MAX_PIXELS,
+        )
+
+
+def _image_dir() -> str:
+    return settings.S3_IMAGE_PREFIX.rstrip("/")
+
+
+def image_key(s3_key: str) -> str:
+    """Where an image with variants is stored instead of s3_key, in the image
+    directory next to it. Moving it keeps it there, e.g. from the temp to the
+    permanent prefix."""
+    head, name = posixpath.split(s3_key)
+    return posixpath.join(head, _image_dir(), name)
+
+
+def has_variants(s3_key: str) -> bool:
+    return posixpath.basename(posixpath.dirname(s3_key)) == _image_dir()
+
+
+def variant_key(s3_key: str, variant: ImageVariant) -> str:
+    """The key of a variant of an image. Images stored before variants existed,
+    and images Pillow could not read, only have their original."""
+    if variant == ImageVariant.ORIGINAL or not has_variants(s3_key):
+        return s3_key
+    head, name = posixpath.split(s3_key)
+    return posixpath.join(head, variant.value, name)
+
+
+def variant_keys(s3_key: str) -> list[str]:
+    """The keys of the variants rendered for an image, without the original."""
+    if not has_variants(s3_key):
+        return []
+    return [
+        variant_key(s3_key, variant)
+        for variant in ImageVariant
+        if variant != ImageVariant.ORIGINAL
+    ]
+
+
+def with_variants(s3_keys: list[str]) -> list[str]:
+    return [key for s3_key in s3_keys for key in (s3_key, *variant_keys(s3_key))]
+
+
+def variant_content_type() -> str:
+    return f"image/{settings.IMAGE_FORMAT.lower()}"
+
+
+def render_variants(
+    data: bytes, options: RenderOptions
+) -> dict[ImageVariant, bytes] | None:
+    """Downscales an image to the max size of every variant and re-encodes it.
+    Returns None when Pillow cannot read the data as an image or it has more
+    than max_pixels pixels. Runs in the ImageProcessor's worker processes."""
+    try:
+        with Image.open(io.BytesIO(data)) as opened:
+            # only the header is read yet
+            if opened.width * opened.height > options.max_pixels:
+                return None
+            largest = max(options.max_sizes.values())
+            # JPEGs are decoded at a fraction of their size where that suffices
+            opened.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(opened)
+            has_alpha = image.has_transparency_data
+            if options.image_format == "JPEG" or not has_alpha:
+                image = image.convert("RGB")
+            else:
+                image = image.convert("RGBA")
+
+            variants = {}
+            # each variant is scaled down from the previous, larger one
+            for variant, max_size in sorted(
+                options.max_sizes.items(), key=lambda item: -item[1]
+            ):
+                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, format=options.image_format, quality=options.quality)
+                variants[variant] = buffer.getvalue()
+            return variants
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class ImageProcessor:
+    """Renders image variants in a pool of IMAGE_PROCESS_WORKERS processes.
+
+    Decoding and resampling an image takes tens to hundreds of milliseconds of
+    CPU, in the app process it would hold up every other request. The workers
+    are spawned rather than forked, the app process runs threads.
+    """
+
+    _shared: "ImageProcessor | None" = None
+
+    def __init__(self, max_workers: int | None = None):
+        max_workers = max_workers or settings.IMAGE_PROCESS_WORKERS
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        # an image per worker, the others wait without being read
+        self._slots = asyncio.Semaphore(max_workers)
+
+    @classmethod
+    def shared(cls) -> "ImageProcessor":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def close_shared(cls) -> None:
+        if cls._shared is not None:
+            processor, cls._shared = cls._shared, None
+            processor.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, data: bytes) -> dict[ImageVariant, bytes] | None:
+        async with self._slots:
+            return await self._render(data)
+
+    async def render_read(
+        self, size: int, read: Callable[[], Awaitable[bytes]]
+    ) -> dict[ImageVariant, bytes] | None:
+        """Renders the image of size bytes that read returns. It is read once a
+        worker is free, so that only the images being rendered are held in
+        memory, and not at all when larger than IMAGE_MAX_BYTES."""
+        if size > settings.IMAGE_MAX_BYTES:
+            return None
+        async with self._slots:
+            return await self._render(await read())
+
+    async def _render(self, data: bytes) -> dict[ImageVariant, bytes] | None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, render_variants, data, RenderOptions.from_settings()
+        )
+
+
+async def upload_variants(
+    storage: AsyncS3Storage, s3_key: str, variants: dict[ImageVariant, bytes]
+) -> None:
+    await asyncio.gather(
+        *(
+            storage.upload_file(
+                data,
+                variant_key(s3_key, variant),
+                content_type=variant_content_type(),
+            )
+            for variant, data in variants.items()
+        )
+    )
@@ -0,0 +1,41 @@
+from pynamodb.attributes import NumberAttribute, TTLAttribute, UnicodeAttribute
+from pynamodb.models import Model
+
+from gptbundle.common.config import settings
+
+
+class PendingUpload(Model):
+    """An uploaded object, or one a browser was allowed to upload, that no
+    message refers to yet. Deleted when a message attaches the object, objects
+    whose record outlives S3_PENDING_UPLOAD_TTL are deleted by the sweeper."""
+
+    class Meta:
+        table_name = "PendingUpload"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    s3_key = UnicodeAttribute(hash_key=True)
+    user_email = UnicodeAttribute()
+    uploaded_at = NumberAttribute()
+    # set by the sweeper that is deleting the object
+    sweeping_at = NumberAttribute(null=True)
+    # backstop only, DynamoDB drops the record but not the object
+    expires_at = TTLAttribute(null=True)
+
+
+class ContentObject(Model):
+    """A content addressed object and how many message attachments refer to
+    it. Objects without references are handed to the pending upload sweeper
+    instead of being deleted right away."""
+
+    class Meta:
+        table_name = "ContentObject"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    s3_key = UnicodeAttribute(hash_key=True)
+    refs = NumberAttribute(default=0)
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from pynamodb.connection import Connection
+from pynamodb.exceptions import (
+    DeleteError,
+    PutError,
+    TransactWriteError,
+    UpdateError,
+)
+from pynamodb.transactions import TransactWrite
+
+from gptbundle.common.config import settings
+
+from .exceptions import PendingUploadError
+from .images import variant_keys, with_variants
+from .models import ContentObject, PendingUpload
+from .storage import DELETE_BATCH_SIZE, AsyncS3Storage
+
+logger = logging.getLogger(__name__)
+
+# one DeleteObjects request per sweep
+SWEEP_BATCH_SIZE = DELETE_BATCH_SIZE
+
+_connection = Connection(
+    region=settings.AWS_REGION, host=settings.AWS_ENDPOINT_URL_DYNAMODB
+)
+
+
+def record_pending_uploads(
+    user_email: str, keys: list[str], uploaded_at: float | None = None
+) -> None:
+    uploaded_at = time.time() if uploaded_at is None else uploaded_at
+    with PendingUpload.batch_write() as batch:
+        for key in keys:
+            batch.save(
+                PendingUpload(
+                    key,
+                    user_email=user_email,
+                    uploaded_at=uploaded_at,
+                    expires_at=timedelta(seconds=2 * settings.S3_PENDING_UPLOAD_TTL),
+                )
+            )
+
+
+def renew_pending_uploads(user_email: str, keys: list[str]) -> list[str]:
+    """Records uploads of existing keys as pending, like record_pending_uploads,
+    except for the records a sweeper claimed: their objects are being deleted,
+    a fresh record would be deleted along with them. Returns those keys."""
+    now = time.time()
+    # the claims of a sweeper that died can be taken over, see _claim_expired
+    not_swept = PendingUpload.sweeping_at.does_not_exist() | (
+        PendingUpload.sweeping_at < now - settings.S3_PENDING_SWEEP_INTERVAL
+    )
+    swept = []
+    for key in keys:
+        try:
+            PendingUpload(
+                key,
+                user_email=user_email,
+                uploaded_at=now,
+                expires_at=timedelta(seconds=2 * settings.S3_PENDING_UPLOAD_TTL),
+            ).save(condition=not_swept)
+        except PutError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            swept.append(key)
+    return swept
+
+
+def pending_uploads_of(user_email: str, keys: list[str]) -> set[str]:
+    """The keys that are pending uploads of the user no sweeper claimed."""
+    return {
+        pending.s3_key
+        for pending in PendingUpload.batch_get(set(keys))
+        if pending.user_email == user_email and pending.sweeping_at is None
+    }
+
+
+def mark_uploaded(user_email: str, keys: list[str]) -> list[str]:
+    """Restarts the TTL of pending uploads of the user once their objects
+    arrived, returns the keys that are not pending uploads of the user."""
+    now = time.time()
+    rejected = []
+    for key in keys:
+        try:
+            PendingUpload(key).update(
+                actions=[PendingUpload.uploaded_at.set(now)],
+                condition=(PendingUpload.user_email == user_email)
+                & PendingUpload.sweeping_at.does_not_exist(),
+            )
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            rejected.append(key)
+    return rejected
+
+
+def confirm_pending_uploads(user_email: str, keys: list[str]) -> None:
+    """Takes the pending uploads of the user off the sweeper's list, all of
+    them or, raising PendingUploadError, none."""
+    if not keys:
+        return
+    try:
+        with TransactWrite(connection=_connection) as transaction:
+            for key in keys:
+                transaction.delete(
+                    PendingUpload(key),
+                    condition=(PendingUpload.user_email == user_email)
+                    & PendingUpload.sweeping_at.does_not_exist(),
+                )
+    except TransactWriteError as e:
+        rejected = [
+            key
+            for key, reason in zip(keys, e.cancellation_reasons or [], strict=False)
+            if reason and reason.code == "ConditionalCheckFailed"
+        ]
+        if rejected:
+            raise PendingUploadError(rejected) from e
+        raise
+
+
+class PendingUploadSweeper:
+    """Deletes direct uploads that no message attached in time.
+
+    An expired record is claimed first, with a conditional update that a
+    concurrent confirm_pending_uploads cannot pass, then the object and the
+    record are deleted. Claims of a sweeper that died in between expire after
+    one sweep interval and are picked up again, so every app process can run
+    a sweeper.
+    """
+
+    def __init__(
+        self,
+        storage: AsyncS3Storage | None = None,
+        ttl: int | None = None,
+        interval: float | None = None,
+    ):
+        self.storage = storage or AsyncS3Storage.shared()
+        self.ttl = settings.S3_PENDING_UPLOAD_TTL if ttl is None else ttl
+        self.interval = interval or settings.S3_PENDING_SWEEP_INTERVAL
+        self._task: asyncio.Task | None = None
+        self._stop = asyncio.Event()
+
+        self.swept_objects = 0
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                while await self.sweep() == SWEEP_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception("Sweeping pending uploads failed")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except TimeoutError:
+                pass
+
+    async def sweep(self) -> int:
+        """Deletes a batch of expired pending uploads, returns how many were
+        claimed."""
+        keys = await asyncio.to_thread(self._claim_expired, time.time())
+        if not keys:
+            return 0
+        # content addressed objects may have been attached with another upload
+        referenced = await asyncio.to_thread(self._referenced, keys)
+        failed = await self.storage.delete_objects(
+            with_variants([k for k in keys if k not in referenced])
+        )
+        # the claims of the failed ones expire and they are tried again
+        swept = [k for k in keys if not any(v in failed for v in (k, *variant_keys(k)))]
+        await asyncio.to_thread(self._delete_records, swept)
+        self.swept_objects += len(swept)
+        logger.info(f"Deleted {len(swept)} uploads that were never attached")
+        return len(keys)
+
+    def _claim_expired(self, now: float) -> list[str]:
+        claimable = (PendingUpload.uploaded_at < now - self.ttl) & (
+            PendingUpload.sweeping_at.does_not_exist()
+            | (PendingUpload.sweeping_at < now - self.interval)
+        )
+        keys = []
+        for pending in PendingUpload.scan(claimable):
+            try:
+                pending.update(
+                    actions=[PendingUpload.sweeping_at.set(now)],
+                    condition=claimable,
+                )
+            except UpdateError as e:
+                # attached or claimed by another sweeper in the meantime
+                if e.cause_response_code == "ConditionalCheckFailedException":
+                    continue
+                raise
+            keys.append(pending.s3_key)
+            if len(keys) == SWEEP_BATCH_SIZE:
+                break
+        return keys
+
+    def _referenced(self, keys: list[str]) -> set[str]:
+        return {
+            content.s3_key
+            for content in ContentObject.batch_get(keys)
+            if content.refs > 0
+        }
+
+    def _delete_records(self, keys: list[str]) -> None:
+        with PendingUpload.batch_write() as batch:
+            for key in keys:
+                batch.delete(PendingUpload(key))
+        for content in ContentObject.batch_get(keys):
+            try:
+                content.delete(condition=ContentObject.refs <= 0)
+            except DeleteError as e:
+                # attached again in the meantime
+                if e.cause_response_code != "ConditionalCheckFailedException":
+                    raise
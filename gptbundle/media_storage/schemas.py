@@ -0,0 +1,33 @@
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class UploadPolicyFile(BaseModel):
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+
+
+class UploadPoliciesRequest(BaseModel):
+    files: list[UploadPolicyFile] = Field(min_length=1)
+
+
+class UploadPolicy(BaseModel):
+    key: str
+    # POST the fields and then the file as multipart/form-data to the url
+    url: str
+    fields: dict[str, Any]
+
+
+class UploadPoliciesResponse(BaseModel):
+    policies: list[UploadPolicy]
+    expires_in: int
+
+
+class ConfirmUploadsRequest(BaseModel):
+    keys: list[str] = Field(min_length=1, max_length=100)
+
+
+class ConfirmUploadsResponse(BaseModel):
+    keys: list[str]
@@ -1,89 +1,378 @@
+import asyncio
+import functools
 import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, TypeVar
 
 # We are not using aioboto for now because it is
 # still not officially supported by AWS. And I had
 # bad experiences with it when I used it with DynamoDB
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 from gptbundle.common.config import settings
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-def get_s3_client():
+PRESIGNED_URL_EXPIRATION = 3600
+# most keys S3 deletes with one DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+def create_transfer_config() -> TransferConfig:
+    # the parts of a file are sent one after another, so an upload holds one
+    # chunk in memory, concurrency comes from uploading files in parallel
+    return TransferConfig(
+        multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+        use_threads=False,
+    )
+
+
+def create_s3_client():
     return boto3.client(
         "s3",
         endpoint_url=settings.S3_ENDPOINT_URL,
         aws_access_key_id=settings.S3_ACCESS_KEY_ID,
         aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
         region_name=settings.S3_REGION,
+        config=Config(max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS),
     )
 
 
-def upload_file(file_data: bytes, key: str):
-    client = get_s3_client()
-    try:
-        client.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=file_data)
-        logger.info(f"Successfully uploaded file to {key}")
-    except ClientError as e:
-        logger.error(f"Failed to upload file to {key}: {e}")
-        raise e
-    except Exception as e:
-        logger.error(f"Unknown error while uploading file to {key}: {e}")
-        raise e
-
-
-def generate_presigned_url(key: str, expiration=3600):
-    client = get_s3_client()
-    try:
-        url = client.generate_presigned_url(
+class PresignedUrlCache:
+    """LRU cache of presigned GET URLs by S3 key and lifetime.
+
+    A URL is handed out again as long as it stays valid for at least
+    min_ttl seconds, or half its lifetime when that is shorter, so whoever
+    gets it has time to use it. Thread-safe, S3Storage is used from worker
+    threads.
+    """
+
+    def __init__(self, max_entries: int | None = None, min_ttl: int | None = None):
+        self.max_entries = max_entries or settings.S3_PRESIGNED_URL_CACHE_SIZE
+        self.min_ttl = settings.S3_PRESIGNED_URL_MIN_TTL if min_ttl is None else min_ttl
+        # (key, expiration) -> (expires_at, url)
+        self._urls: OrderedDict[tuple[str, int], tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_sign(self, key: str, expiration: int, sign: Callable[[], str]) -> str:
+        cache_key = (key, expiration)
+        now = time.time()
+        with self._lock:
+            entry = self._urls.get(cache_key)
+            if entry is not None and entry[0] - now >= self.min_valid_seconds(
+                expiration
+            ):
+                self._urls.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        url = sign()
+        with self._lock:
+            self._urls[cache_key] = (now + expiration, url)
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url
+
+    def min_valid_seconds(self, expiration: int) -> int:
+        """How long a URL handed out by the cache stays valid at least."""
+        return min(self.min_ttl, expiration // 2)
+
+    def discard(self, keys: list[str]) -> None:
+        # the objects are gone, their URLs are of no use anymore
+        removed = set(keys)
+        with self._lock:
+            for cache_key in [k for k in self._urls if k[0] in removed]:
+                del self._urls[cache_key]
+
+
+class S3Storage:
+    """Blocking S3 operations on one long-lived client.
+
+    Building a client takes tens of milliseconds and every client has its own
+    connection pool, so one client is shared by all calls of the process.
+    boto3 clients are thread-safe, up to max_pool_connections requests run at
+    once.
+    """
+
+    _shared: "S3Storage | None" = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, client=None):
+        self.client = client or create_s3_client()
+        self.presigned_urls = PresignedUrlCache()
+        self.transfer_config = create_transfer_config()
+
+    @classmethod
+    def shared(cls) -> "S3Storage":
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def upload_file(self, file_data: bytes, key: str, content_type: str | None = None):
+        try:
+            extra_args = {"ContentType": content_type} if content_type else {}
+            self.client.put_object(
+                Bucket=settings.S3_BUCKET_NAME, Key=key, Body=file_data, **extra_args
+            )
+            logger.info(f"Successfully uploaded file to {key}")
+        except ClientError as e:
+            logger.error(f"Failed to upload file to {key}: {e}")
+            raise e
+        except Exception as e:
+            logger.error(f"Unknown error while uploading file to {key}: {e}")
+            raise e
+
+    def upload_fileobj(self, fileobj: BinaryIO, key: str):
+        """Streams a file to S3, as a multipart upload when it is larger than
+        S3_MULTIPART_THRESHOLD. Reads the file in chunks, it is never held in
+        memory as a whole."""
+        try:
+            self.client.upload_fileobj(
+                fileobj, settings.S3_BUCKET_NAME, key, Config=self.transfer_config
+            )
+            logger.info(f"Successfully uploaded file to {key}")
+        except ClientError as e:
+            logger.error(f"Failed to upload file to {key}: {e}")
+            raise e
+        except Exception as e:
+            logger.error(f"Unknown error while uploading file to {key}: {e}")
+            raise e
+
+    def generate_presigned_url(self, key: str, expiration=PRESIGNED_URL_EXPIRATION):
+        try:
+            return self.presigned_urls.get_or_sign(
+                key, expiration, lambda: self._sign(key, expiration)
+            )
+        except ClientError as e:
+            logger.error(f"Failed to generate presigned URL for {key}: {e}")
+            raise e
+        except Exception as e:
+            logger.error(f"Unknown error while generating presigned URL for {key}: {e}")
+            raise e
+
+    def generate_presigned_post(
+        self, key: str, content_type: str, max_size: int, expiration: int
+    ) -> dict[str, Any]:
+        """Returns the url and form fields of a POST that uploads one object
+        of content_type and at most max_size bytes to key, straight to S3."""
+        try:
+            return self.client.generate_presigned_post(
+                settings.S3_BUCKET_NAME,
+                key,
+                Fields={"Content-Type": content_type},
+                Conditions=[
+                    {"Content-Type": content_type},
+                    ["content-length-range", 1, max_size],
+                ],
+                ExpiresIn=expiration,
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate presigned POST for {key}: {e}")
+            raise e
+
+    def download_file(self, key: str) -> bytes:
+        try:
+            response = self.client.get_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+            return response["Body"].read()
+        except ClientError as e:
+            logger.error(f"Failed to download file from {key}: {e}")
+            raise e
+
+    def head_object(self, key: str) -> dict[str, Any] | None:
+        """Returns the metadata of an object, None when it does not exist."""
+        try:
+            return self.client.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            logger.error(f"Failed to get metadata of {key}: {e}")
+            raise e
+
+    def _sign(self, key: str, expiration: int) -> str:
+        url = self.client.generate_presigned_url(
             "get_object",
             Params={"Bucket": settings.S3_BUCKET_NAME, "Key": key},
             ExpiresIn=expiration,
         )
         logger.info(f"Successfully generated presigned URL for {key}")
         return url
-    except ClientError as e:
-        logger.error(f"Failed to generate presigned URL for {key}: {e}")
-        raise e
-    except Exception as e:
-        logger.error(f"Unknown error while generating presigned URL for {key}: {e}")
-        raise e
 
+    def move_file(self, source_key: str, target_key: str):
+        try:
+            copy_source = {"Bucket": settings.S3_BUCKET_NAME, "Key": source_key}
+            self.client.copy_object(
+                CopySource=copy_source, Bucket=settings.S3_BUCKET_NAME, Key=target_key
+            )
+            self.client.delete_object(Bucket=settings.S3_BUCKET_NAME, Key=source_key)
+            self.presigned_urls.discard([source_key])
+            logger.info(f"Successfully moved file from {source_key} to {target_key}")
+        except ClientError as e:
+            logger.error(f"Failed to move file from {source_key} to {target_key}: {e}")
+            raise e
+        except Exception as e:
+            logger.error(
+                f"Unknown error while moving file from {source_key} to "
+                f"{target_key}: {e}"
+            )
+            raise e
 
-def move_file(source_key: str, target_key: str):
-    client = get_s3_client()
-    try:
-        copy_source = {"Bucket": settings.S3_BUCKET_NAME, "Key": source_key}
-        client.copy_object(
-            CopySource=copy_source, Bucket=settings.S3_BUCKET_NAME, Key=target_key
+    def delete_objects(self, keys: list[str]) -> dict[str, str]:
+        """Deletes the objects in batches of DELETE_BATCH_SIZE, returns the keys
+        S3 could not delete with their error."""
+        failed: dict[str, str] = {}
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            failed |= self.delete_batch(keys[i : i + DELETE_BATCH_SIZE])
+        return failed
+
+    def delete_batch(self, keys: list[str]) -> dict[str, str]:
+        """Deletes at most DELETE_BATCH_SIZE objects with one request, returns
+        the keys S3 could not delete with their error."""
+        if not keys:
+            return {}
+        try:
+            delete_list = [{"Key": key} for key in keys]
+            response = self.client.delete_objects(
+                Bucket=settings.S3_BUCKET_NAME,
+                # only errors are reported back
+                Delete={"Objects": delete_list, "Quiet": True},
+            )
+        except ClientError as e:
+            logger.error(f"Failed to delete objects from S3: {e}")
+            raise e
+        except Exception as e:
+            logger.error(f"Unknown error while deleting objects from S3: {e}")
+            raise e
+        failed = {
+            error["Key"]: f"{error.get('Code')}: {error.get('Message')}"
+            for error in response.get("Errors", [])
+        }
+        self.presigned_urls.discard([key for key in keys if key not in failed])
+        if failed:
+            logger.error(f"Failed to delete {len(failed)} objects from S3: {failed}")
+        logger.info(f"Successfully deleted {len(keys) - len(failed)} objects from S3")
+        return failed
+
+
+class AsyncS3Storage:
+    """Async facade of S3Storage.
+
+    The blocking calls run on an executor of their own, bounded by
+    S3_EXECUTOR_WORKERS, so slow S3 requests cannot take all threads of the
+    default executor that asyncio.to_thread shares with the DynamoDB
+    repository. Presigning is local computation and stays synchronous.
+    """
+
+    _shared: "AsyncS3Storage | None" = None
+
+    def __init__(
+        self, storage: S3Storage | None = None, max_workers: int | None = None
+    ):
+        self._storage = storage
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.S3_EXECUTOR_WORKERS,
+            thread_name_prefix="s3",
         )
-        client.delete_object(Bucket=settings.S3_BUCKET_NAME, Key=source_key)
-        logger.info(f"Successfully moved file from {source_key} to {target_key}")
-    except ClientError as e:
-        logger.error(f"Failed to move file from {source_key} to {target_key}: {e}")
-        raise e
-    except Exception as e:
-        logger.error(
-            f"Unknown error while moving file from {source_key} to {target_key}: {e}"
+
+    @classmethod
+    def shared(cls) -> "AsyncS3Storage":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def close_shared(cls) -> None:
+        if cls._shared is not None:
+            storage, cls._shared = cls._shared, None
+            storage.close()
+
+    @property
+    def storage(self) -> S3Storage:
+        return self._storage or S3Storage.shared()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
         )
-        raise e
 
+    async def upload_file(
+        self, file_data: bytes, key: str, content_type: str | None = None
+    ) -> None:
+        await self._run(self.storage.upload_file, file_data, key, content_type)
+
+    async def download_file(self, key: str) -> bytes:
+        return await self._run(self.storage.download_file, key)
+
+    async def upload_fileobj(self, fileobj: BinaryIO, key: str) -> None:
+        await self._run(self.storage.upload_fileobj, fileobj, key)
+
+    async def head_object(self, key: str) -> dict[str, Any] | None:
+        return await self._run(self.storage.head_object, key)
+
+    async def move_file(self, source_key: str, target_key: str) -> None:
+        await self._run(self.storage.move_file, source_key, target_key)
 
-def delete_objects(keys: list[str]):
-    if not keys:
-        return
-    client = get_s3_client()
-    try:
-        delete_list = [{"Key": key} for key in keys]
-        client.delete_objects(
-            Bucket=settings.S3_BUCKET_NAME, Delete={"Objects": delete_list}
+    async def delete_objects(self, keys: list[str]) -> dict[str, str]:
+        """Deletes the objects in batches of DELETE_BATCH_SIZE that run
+        concurrently on the executor. Returns the keys that could not be
+        deleted with their error, a batch whose request failed as a whole
+        reports all of its keys, so that callers can retry them."""
+        batches = [
+            keys[i : i + DELETE_BATCH_SIZE]
+            for i in range(0, len(keys), DELETE_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(
+            *(self._run(self.storage.delete_batch, batch) for batch in batches),
+            return_exceptions=True,
         )
-        logger.info(f"Successfully deleted {len(keys)} objects from S3")
-    except ClientError as e:
-        logger.error(f"Failed to delete objects from S3: {e}")
-        raise e
-    except Exception as e:
-        logger.error(f"Unknown error while deleting objects from S3: {e}")
-        raise e
+        failed: dict[str, str] = {}
+        for batch, result in zip(batches, results, strict=True):
+            if isinstance(result, BaseException):
+                failed |= dict.fromkeys(batch, str(result))
+            else:
+                failed |= result
+        return failed
+
+    def generate_presigned_url(
+        self, key: str, expiration=PRESIGNED_URL_EXPIRATION
+    ) -> str:
+        return self.storage.generate_presigned_url(key, expiration)
+
+
+def get_s3_client():
+    return S3Storage.shared().client
+
+
+def upload_file(file_data: bytes, key: str):
+    S3Storage.shared().upload_file(file_data, key)
+
+
+def generate_presigned_url(key: str, expiration=PRESIGNED_URL_EXPIRATION):
+    return S3Storage.shared().generate_presigned_url(key, expiration)
+
+
+def move_file(source_key: str, target_key: str):
+    S3Storage.shared().move_file(source_key, target_key)
+
+
+def delete_objects(keys: list[str]) -> dict[str, str]:
+    return S3Storage.shared().delete_objects(keys)
@@ -4,10 +4,36 @@ import os
 import uuid
 from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile
 
 from gptbundle.common.config import settings
-from gptbundle.media_storage.storage import upload_file
+from gptbundle.media_storage.content import (
+    content_key,
+    file_digest,
+    user_content_prefix,
+)
+from gptbundle.media_storage.images import (
+    ImageProcessor,
+    ImageVariant,
+    has_variants,
+    image_key,
+    upload_variants,
+    with_variants,
+)
+from gptbundle.media_storage.pending import (
+    mark_uploaded,
+    pending_uploads_of,
+    record_pending_uploads,
+    renew_pending_uploads,
+)
+from gptbundle.media_storage.schemas import (
+    ConfirmUploadsRequest,
+    ConfirmUploadsResponse,
+    UploadPoliciesRequest,
+    UploadPoliciesResponse,
+    UploadPolicy,
+)
+from gptbundle.media_storage.storage import AsyncS3Storage
 from gptbundle.security.service import get_current_user
 
 logger = logging.getLogger(__name__)
@@ -17,35 +43,274 @@ router = APIRouter()
 UserEmailDep = Annotated[str, Depends(get_current_user)]
 
 
+def _is_image(content_type: str | None) -> bool:
+    return (content_type or "").startswith("image/")
+
+
+async def _render_variants(file: UploadFile) -> dict[ImageVariant, bytes] | None:
+    if not _is_image(file.content_type):
+        return None
+
+    async def read() -> bytes:
+        data = await file.read()
+        await file.seek(0)
+        return data
+
+    return await ImageProcessor.shared().render_read(_file_size(file), read)
+
+
+def _file_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+
 @router.post(
     "/upload_media",
     responses={
         401: {"description": "User not authenticated"},
+        409: {"description": "A file stored before is being deleted, retry later"},
+        413: {"description": "Too many files or a file too large"},
         500: {"description": "Internal server error"},
     },
 )
 async def upload_media(
     user_email: UserEmailDep,
     files: list[UploadFile],
+    direct: bool = Query(
+        False,
+        description="Upload to content addressed permanent keys right away "
+        "instead of the temp prefix. Files the user stored before are not "
+        "uploaded again.",
+    ),
 ) -> Any:
     if not user_email:
         raise HTTPException(status_code=401, detail="User not authenticated")
+    if len(files) > settings.S3_UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.S3_UPLOAD_MAX_FILES} files per upload",
+        )
+    for file in files:
+        if _file_size(file) > settings.S3_UPLOAD_MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{file.filename} is larger than "
+                f"{settings.S3_UPLOAD_MAX_FILE_SIZE} bytes",
+            )
+
+    # images get their variants rendered before the keys are chosen, those
+    # that Pillow cannot read are stored as they are
+    variants = await asyncio.gather(*(_render_variants(file) for file in files))
 
     generated_keys = []
-    try:
-        for file in files:
-            # TODO: do a better verification of file extension and types,
-            # do not rely on file extension only
-            file_ext = os.path.splitext(file.filename or "")[1]
+    for file, file_variants in zip(files, variants, strict=True):
+        # TODO: do a better verification of file extension and types,
+        # do not rely on file extension only
+        file_ext = os.path.splitext(file.filename or "")[1]
+        if direct:
+            digest = await asyncio.to_thread(file_digest, file.file)
+            key = content_key(user_email, digest, file_ext)
+        else:
             unique_id = str(uuid.uuid4())
             key = f"{settings.S3_TEMP_PREFIX}{unique_id}{file_ext}"
-            file_content = await file.read()
-            await asyncio.to_thread(upload_file, file_content, key)
+        generated_keys.append(image_key(key) if file_variants else key)
 
-            generated_keys.append(key)
+    storage = AsyncS3Storage.shared()
+    semaphore = asyncio.Semaphore(settings.S3_UPLOAD_CONCURRENCY)
+
+    async def _upload(
+        file: UploadFile, key: str, file_variants: dict[ImageVariant, bytes] | None
+    ) -> None:
+        async with semaphore:
+            # checked after the record was renewed, the object of a record the
+            # sweeper removed before may be gone
+            if direct and await storage.head_object(key) is not None:
+                # stored before, the upload only renews the pending record
+                return
+            await asyncio.gather(
+                # streamed from the spooled request file, chunk by chunk
+                storage.upload_fileobj(file.file, key),
+                upload_variants(storage, key, file_variants or {}),
+            )
+
+    try:
+        # recorded first, so that the sweeper knows of every object
+        if direct:
+            swept = await asyncio.to_thread(
+                renew_pending_uploads, user_email, generated_keys
+            )
+            if swept:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A file you stored before is being deleted, "
+                    "please try again later.",
+                )
+        else:
+            await asyncio.to_thread(record_pending_uploads, user_email, generated_keys)
+        # the same file twice in one request is uploaded once
+        uploads = dict(
+            zip(generated_keys, zip(files, variants, strict=True), strict=True)
+        )
+        results = await asyncio.gather(
+            *(
+                _upload(file, key, file_variants)
+                for key, (file, file_variants) in uploads.items()
+            ),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # content addressed objects may be attached elsewhere already,
+            # the sweeper deletes the ones that are not
+            if not direct:
+                await storage.delete_objects(with_variants(generated_keys))
+            raise errors[0]
 
         return {"keys": generated_keys}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error while uploading media for user {user_email}: {e}")
         raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+def _policy_max_size(content_type: str) -> int:
+    # images uploaded with a policy are only attachable with their variants
+    if _is_image(content_type):
+        return min(settings.S3_UPLOAD_MAX_FILE_SIZE, settings.IMAGE_MAX_BYTES)
+    return settings.S3_UPLOAD_MAX_FILE_SIZE
+
+
+@router.post(
+    "/upload_policies",
+    response_model=UploadPoliciesResponse,
+    responses={
+        401: {"description": "User not authenticated"},
+        413: {"description": "Too many files or a file too large"},
+        415: {"description": "Content type not allowed"},
+    },
+)
+async def create_upload_policies(
+    user_email: UserEmailDep, policies_in: UploadPoliciesRequest
+) -> Any:
+    """Presigned POST policies that let the browser upload the files to temp
+    keys straight to S3. Each policy only accepts its content type and at most
+    S3_UPLOAD_MAX_FILE_SIZE bytes, IMAGE_MAX_BYTES for images. Confirm the
+    uploads once they are done."""
+    if not user_email:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    files = policies_in.files
+    if len(files) > settings.S3_UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.S3_UPLOAD_MAX_FILES} files per upload",
+        )
+    for file in files:
+        max_size = _policy_max_size(file.content_type)
+        if file.size > max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{file.filename} is larger than {max_size} bytes",
+            )
+        if file.content_type not in settings.S3_UPLOAD_CONTENT_TYPES:
+            raise HTTPException(
+                status_code=415,
+                detail=f"{file.content_type} uploads are not allowed",
+            )
+
+    keys = []
+    for file in files:
+        file_ext = os.path.splitext(file.filename)[1]
+        key = f"{settings.S3_TEMP_PREFIX}{uuid.uuid4()}{file_ext}"
+        # the variants are rendered when the upload is confirmed
+        keys.append(image_key(key) if _is_image(file.content_type) else key)
+    # a policy may be used without ever being confirmed, the sweeper has to
+    # know of the object either way
+    await asyncio.to_thread(record_pending_uploads, user_email, keys)
+    storage = AsyncS3Storage.shared().storage
+    policies = []
+    for file, key in zip(files, keys, strict=True):
+        # signing is local computation
+        post = storage.generate_presigned_post(
+            key,
+            file.content_type,
+            _policy_max_size(file.content_type),
+            settings.S3_UPLOAD_POLICY_EXPIRATION,
+        )
+        policies.append(UploadPolicy(key=key, url=post["url"], fields=post["fields"]))
+    return UploadPoliciesResponse(
+        policies=policies, expires_in=settings.S3_UPLOAD_POLICY_EXPIRATION
+    )
+
+
+async def _render_uploaded_variants(
+    storage: AsyncS3Storage, key: str, head: dict[str, Any]
+) -> bool:
+    """Renders the variants of an image uploaded with a policy, False when
+    the object is not an image that can be rendered."""
+    if not has_variants(key):
+        return True
+    variants = await ImageProcessor.shared().render_read(
+        head["ContentLength"], lambda: storage.download_file(key)
+    )
+    if variants is None:
+        return False
+    await upload_variants(storage, key, variants)
+    return True
+
+
+@router.post(
+    "/confirm_uploads",
+    response_model=ConfirmUploadsResponse,
+    responses={
+        400: {
+            "description": "Objects missing, not uploaded by the user or "
+            "images that cannot be read"
+        },
+        401: {"description": "User not authenticated"},
+    },
+)
+async def confirm_uploads(
+    user_email: UserEmailDep, confirm_in: ConfirmUploadsRequest
+) -> Any:
+    """Registers uploads made with presigned POST policies for the user, the
+    keys can then be attached to messages."""
+    if not user_email:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    keys = list(dict.fromkeys(confirm_in.keys))
+    # nothing is read from or written to S3 for keys of other users
+    prefixes = (settings.S3_TEMP_PREFIX, user_content_prefix(user_email))
+    pending = await asyncio.to_thread(
+        pending_uploads_of,
+        user_email,
+        [key for key in keys if key.startswith(prefixes)],
+    )
+    rejected = [key for key in keys if key not in pending]
+    owned = [key for key in keys if key in pending]
+
+    storage = AsyncS3Storage.shared()
+    heads = await asyncio.gather(*(storage.head_object(key) for key in owned))
+    uploaded = {key: head for key, head in zip(owned, heads, strict=True) if head}
+    missing = [key for key in owned if key not in uploaded]
+    rendered = await asyncio.gather(
+        *(_render_uploaded_variants(storage, k, head) for k, head in uploaded.items())
+    )
+    invalid = [key for key, ok in zip(uploaded, rendered, strict=True) if not ok]
+    if invalid:
+        # not attachable without their variants, the records are swept
+        await storage.delete_objects(invalid)
+    # a sweeper may have claimed them in the meantime
+    rejected += await asyncio.to_thread(
+        mark_uploaded, user_email, [key for key in uploaded if key not in invalid]
+    )
+    if missing or rejected or invalid:
+        raise HTTPException(
+            status_code=400,
+            detail={"missing": missing, "rejected": rejected, "invalid": invalid},
+        )
+    return ConfirmUploadsResponse(keys=confirm_in.keys)
@@ -0,0 +1,465 @@
+import logging
+from typing import Any
+
+from gptbundle.common.dynamodb import AsyncDynamoDBClient, DynamoDBError
+
+from .exceptions import ChatAlreadyExistsError, ChatVersionConflictError
+from .models import Chat as ChatModel
+from .models import (
+    ChatMessage,
+    ChatPurge,
+    SearchOutboxEvent,
+    message_sort_key_prefix,
+)
+from .outbox import chat_created_event, chat_deleted_event, messages_appended_event
+from .purge import chat_purge, message_s3_keys
+from .repository import (
+    MAX_APPENDED_MESSAGES,
+    ChatWriteState,
+    chat_summary_from_model,
+    chat_write_states,
+    legacy_messages_page,
+    message_from_model,
+    message_to_model,
+)
+from .schemas import Chat, ChatCreate, MessageCreate, chat_title
+
+logger = logging.getLogger(__name__)
+
+CHAT_TABLE = ChatModel.Meta.table_name
+MESSAGE_TABLE = ChatMessage.Meta.table_name
+OUTBOX_TABLE = SearchOutboxEvent.Meta.table_name
+PURGE_TABLE = ChatPurge.Meta.table_name
+
+
+class AsyncChatRepository:
+    """Same interface as ChatRepository, but every method is a coroutine that
+    talks to DynamoDB through the shared AsyncDynamoDBClient instead of
+    occupying a thread of the default executor."""
+
+    def __init__(self, client: AsyncDynamoDBClient | None = None):
+        self.client = client or AsyncDynamoDBClient.shared()
+
+    async def create_chat(self, chat_in: ChatCreate) -> Chat:
+        if len(chat_in.messages) > MAX_APPENDED_MESSAGES:
+            raise ValueError(
+                f"Chats can be created with at most {MAX_APPENDED_MESSAGES} messages"
+            )
+        created_chat = ChatModel(
+            chat_id=chat_in.chat_id,
+            timestamp=chat_in.timestamp,
+            user_email=chat_in.user_email,
+            is_rag=any(msg.pdf_s3_keys for msg in chat_in.messages),
+            message_count=len(chat_in.messages),
+            title=chat_title(chat_in.messages),
+            last_model=chat_in.messages[-1].llm_model if chat_in.messages else None,
+            version=1,
+        )
+        chat = Chat(
+            chat_id=chat_in.chat_id,
+            timestamp=chat_in.timestamp,
+            user_email=chat_in.user_email,
+            is_rag=created_chat.is_rag,
+            messages=chat_in.messages,
+        )
+        transact_items: list[dict[str, Any]] = [
+            {
+                "Put": {
+                    "TableName": CHAT_TABLE,
+                    "Item": created_chat.serialize(),
+                    "ConditionExpression": "attribute_not_exists(chat_id)",
+                }
+            }
+        ]
+        transact_items.extend(
+            {
+                "Put": {
+                    "TableName": MESSAGE_TABLE,
+                    "Item": message_to_model(
+                        chat_in.chat_id,
+                        chat_in.timestamp,
+                        chat_in.user_email,
+                        seq,
+                        msg,
+                    ).serialize(),
+                }
+            }
+            for seq, msg in enumerate(chat_in.messages)
+        )
+        transact_items.append(self._outbox_put(chat_created_event(chat)))
+        try:
+            await self.client.request(
+                "TransactWriteItems", {"TransactItems": transact_items}
+            )
+        except DynamoDBError as e:
+            if "ConditionalCheckFailed" in e.cancellation_reasons:
+                raise ChatAlreadyExistsError(
+                    f"Chat with id {chat_in.chat_id} already exists"
+                ) from e
+            raise
+        chat_write_states.set(
+            chat_in.chat_id,
+            chat_in.timestamp,
+            created_chat.version,
+            created_chat.message_count,
+        )
+
+        logger.debug(
+            f"Created chat for user: {chat_in.user_email} "
+            f"with chat_id: {chat_in.chat_id} and "
+            f"timestamp: {chat_in.timestamp}"
+        )
+        return chat
+
+    async def get_chat(
+        self, chat_id: str, timestamp: float, user_email: str
+    ) -> Chat | None:
+        chat_model = await self._get_chat_model(chat_id, timestamp)
+        if chat_model is None:
+            return None
+        if chat_model.user_email != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized "
+                f"to retrieve chat: {chat_id} and "
+                f"timestamp: {timestamp}"
+            )
+            return None
+        chat_write_states.set(
+            chat_id, timestamp, chat_model.version, chat_model.message_count
+        )
+        logger.debug(
+            f"Retrieved chat for user: {user_email} "
+            f"with chat_id: {chat_id} and "
+            f"timestamp: {timestamp}"
+        )
+        return await self.chat_from_model(chat_model)
+
+    async def get_messages_paginated(
+        self,
+        chat_id: str,
+        timestamp: float,
+        user_email: str,
+        limit: int | None = None,
+        last_evaluated_key: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | None:
+        chat_model = await self._get_chat_model(chat_id, timestamp)
+        if chat_model is None:
+            return None
+        if chat_model.user_email != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized "
+                f"to retrieve messages of chat: {chat_id} and "
+                f"timestamp: {timestamp}"
+            )
+            return None
+
+        page = legacy_messages_page(chat_model, limit, last_evaluated_key)
+        if page.last_eval_key is not None:
+            return {"items": page.items, "last_eval_key": page.last_eval_key}
+
+        response = await self.client.request(
+            "Query",
+            self._messages_query(chat_id, timestamp, page.limit, page.query_key),
+        )
+        items = page.items + [
+            message_from_model(ChatMessage.from_raw_data(item))
+            for item in response.get("Items", [])
+        ]
+
+        logger.debug(f"Retrieved paginated messages for chat: {chat_id}")
+        return {
+            "items": items,
+            "last_eval_key": response.get("LastEvaluatedKey"),
+        }
+
+    async def get_chats_by_user_email(self, user_email: str) -> list[Chat]:
+        chats = []
+        query: dict[str, Any] = {
+            "TableName": CHAT_TABLE,
+            "IndexName": ChatModel.user_email_index.Meta.index_name,
+            "KeyConditionExpression": "user_email = :user_email",
+            "ExpressionAttributeValues": {":user_email": {"S": user_email}},
+        }
+        while True:
+            response = await self.client.request("Query", query)
+            for item in response.get("Items", []):
+                chats.append(await self.chat_from_model(ChatModel.from_raw_data(item)))
+            if "LastEvaluatedKey" not in response:
+                break
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        logger.debug(f"Retrieved chats for user: {user_email}")
+        return chats
+
+    async def get_chats_by_user_email_paginated(
+        self,
+        user_email: str,
+        limit: int | None = None,
+        last_evaluated_key: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        query: dict[str, Any] = {
+            "TableName": CHAT_TABLE,
+            "IndexName": ChatModel.summary_index.Meta.index_name,
+            "KeyConditionExpression": "user_email = :user_email",
+            "ExpressionAttributeValues": {":user_email": {"S": user_email}},
+            "ScanIndexForward": False,
+        }
+        if limit:
+            query["Limit"] = limit
+        if last_evaluated_key:
+            query["ExclusiveStartKey"] = last_evaluated_key
+
+        response = await self.client.request("Query", query)
+        items = [
+            chat_summary_from_model(ChatModel.from_raw_data(item))
+            for item in response.get("Items", [])
+        ]
+
+        logger.debug(f"Retrieved paginated chats for user: {user_email}")
+        return {
+            "items": items,
+            "last_eval_key": response.get("LastEvaluatedKey"),
+        }
+
+    async def append_messages(
+        self,
+        chat_id: str,
+        timestamp: float,
+        messages: list[MessageCreate],
+        user_email: str,
+    ) -> bool:
+        if len(messages) > MAX_APPENDED_MESSAGES:
+            raise ValueError(
+                f"At most {MAX_APPENDED_MESSAGES} messages can be appended at once"
+            )
+        state = chat_write_states.get(chat_id, timestamp)
+        if state is None:
+            state = await self._read_write_state(chat_id, timestamp, user_email)
+            if state is None:
+                return False
+
+        update_expression = ["ADD message_count :count, version :one"]
+        set_actions = []
+        values: dict[str, Any] = {
+            ":count": {"N": str(len(messages))},
+            ":one": {"N": "1"},
+            ":user_email": {"S": user_email},
+        }
+        if state.version is None:
+            condition = "user_email = :user_email AND attribute_not_exists(version)"
+        else:
+            condition = "user_email = :user_email AND version = :version"
+            values[":version"] = {"N": str(state.version)}
+        if messages:
+            set_actions.extend(
+                [
+                    "title = if_not_exists(title, :title)",
+                    "last_model = :last_model",
+                ]
+            )
+            values[":title"] = {"S": chat_title(messages)}
+            values[":last_model"] = {"S": messages[-1].llm_model}
+        if any(msg.pdf_s3_keys for msg in messages):
+            set_actions.append("is_rag = :is_rag")
+            values[":is_rag"] = {"BOOL": True}
+        if set_actions:
+            update_expression.append("SET " + ", ".join(set_actions))
+
+        transact_items: list[dict[str, Any]] = [
+            {
+                "Update": {
+                    "TableName": CHAT_TABLE,
+                    "Key": self._chat_key(chat_id, timestamp),
+                    "UpdateExpression": " ".join(update_expression),
+                    "ConditionExpression": condition,
+                    "ExpressionAttributeValues": values,
+                }
+            }
+        ]
+        transact_items.extend(
+            {
+                "Put": {
+                    "TableName": MESSAGE_TABLE,
+                    "Item": message_to_model(
+                        chat_id, timestamp, user_email, seq, msg
+                    ).serialize(),
+                }
+            }
+            for seq, msg in enumerate(messages, start=state.message_count)
+        )
+        transact_items.append(
+            self._outbox_put(
+                messages_appended_event(
+                    chat_id, timestamp, user_email, messages, state.message_count
+                )
+            )
+        )
+        try:
+            await self.client.request(
+                "TransactWriteItems", {"TransactItems": transact_items}
+            )
+        except DynamoDBError as e:
+            chat_write_states.invalidate(chat_id, timestamp)
+            if "ConditionalCheckFailed" not in e.cancellation_reasons:
+                raise
+            if await self._read_write_state(chat_id, timestamp, user_email) is None:
+                return False
+            raise ChatVersionConflictError(
+                f"Chat {chat_id} was modified concurrently"
+            ) from e
+
+        chat_write_states.set(
+            chat_id,
+            timestamp,
+            (state.version or 0) + 1,
+            state.message_count + len(messages),
+        )
+        logger.debug(f"Appended messages to chat: {chat_id} and timestamp: {timestamp}")
+        return True
+
+    async def delete_chat(
+        self, chat_id: str, timestamp: float, user_email: str
+    ) -> bool:
+        """Deletes the chat header, the rest is left to the ChatPurgeWorker."""
+        chat_model = await self._get_chat_model(chat_id, timestamp)
+        if chat_model is None:
+            return False
+        if chat_model.user_email != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized to "
+                f"delete chat: {chat_id} and "
+                f"timestamp: {timestamp}"
+            )
+            return False
+        try:
+            await self.client.request(
+                "TransactWriteItems",
+                {
+                    "TransactItems": [
+                        {
+                            "Delete": {
+                                "TableName": CHAT_TABLE,
+                                "Key": self._chat_key(chat_id, timestamp),
+                                "ConditionExpression": "attribute_exists(chat_id)",
+                            }
+                        },
+                        self._outbox_put(
+                            chat_deleted_event(chat_id, timestamp, user_email)
+                        ),
+                        {
+                            "Put": {
+                                "TableName": PURGE_TABLE,
+                                "Item": chat_purge(
+                                    chat_id,
+                                    timestamp,
+                                    user_email,
+                                    message_s3_keys(chat_model.messages or []),
+                                ).serialize(),
+                            }
+                        },
+                    ]
+                },
+            )
+        except DynamoDBError as e:
+            if "ConditionalCheckFailed" in e.cancellation_reasons:
+                return False
+            raise
+        chat_write_states.invalidate(chat_id, timestamp)
+        logger.debug(f"Deleted chat: {chat_id} and timestamp: {timestamp}")
+        return True
+
+    async def _get_chat_model(self, chat_id: str, timestamp: float) -> ChatModel | None:
+        response = await self.client.request(
+            "GetItem",
+            {"TableName": CHAT_TABLE, "Key": self._chat_key(chat_id, timestamp)},
+        )
+        if "Item" not in response:
+            return None
+        return ChatModel.from_raw_data(response["Item"])
+
+    async def _read_write_state(
+        self, chat_id: str, timestamp: float, user_email: str
+    ) -> ChatWriteState | None:
+        response = await self.client.request(
+            "GetItem",
+            {
+                "TableName": CHAT_TABLE,
+                "Key": self._chat_key(chat_id, timestamp),
+                "ProjectionExpression": "user_email, version, message_count",
+            },
+        )
+        item = response.get("Item")
+        if item is None or item["user_email"]["S"] != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized to "
+                f"append messages to chat: {chat_id} and "
+                f"timestamp: {timestamp} or the chat does not exist"
+            )
+            return None
+        state = ChatWriteState(
+            int(item["version"]["N"]) if "version" in item else None,
+            int(item["message_count"]["N"]) if "message_count" in item else 0,
+        )
+        chat_write_states.set(chat_id, timestamp, *state)
+        return state
+
+    async def _query_all_messages(
+        self, chat_id: str, timestamp: float, **extra_args: Any
+    ) -> list[dict[str, Any]]:
+        items = []
+        query = {**self._messages_query(chat_id, timestamp), **extra_args}
+        while True:
+            response = await self.client.request("Query", query)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def chat_from_model(self, chat_model: ChatModel) -> Chat:
+        messages = [message_from_model(msg) for msg in chat_model.messages or []]
+        messages.extend(
+            message_from_model(ChatMessage.from_raw_data(item))
+            for item in await self._query_all_messages(
+                chat_model.chat_id, chat_model.timestamp
+            )
+        )
+        return Chat(
+            chat_id=chat_model.chat_id,
+            timestamp=chat_model.timestamp,
+            user_email=chat_model.user_email,
+            is_rag=chat_model.is_rag,
+            messages=messages,
+        )
+
+    def _messages_query(
+        self,
+        chat_id: str,
+        timestamp: float,
+        limit: int | None = None,
+        last_evaluated_key: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        query: dict[str, Any] = {
+            "TableName": MESSAGE_TABLE,
+            "KeyConditionExpression": (
+                "chat_id = :chat_id AND begins_with(sort_key, :prefix)"
+            ),
+            "ExpressionAttributeValues": {
+                ":chat_id": {"S": chat_id},
+                ":prefix": {"S": message_sort_key_prefix(timestamp)},
+            },
+        }
+        if limit:
+            query["Limit"] = limit
+        if last_evaluated_key:
+            query["ExclusiveStartKey"] = last_evaluated_key
+        return query
+
+    def _outbox_put(self, event: SearchOutboxEvent) -> dict[str, Any]:
+        return {
+            "Put": {"TableName": OUTBOX_TABLE, "Item": event.serialize()},
+        }
+
+    def _chat_key(self, chat_id: str, timestamp: float) -> dict[str, Any]:
+        return {
+            "chat_id": {"S": chat_id},
+            "timestamp": {"N": ChatModel.timestamp.serialize(timestamp)},
+        }
@@ -0,0 +1,68 @@
+import asyncio
+import itertools
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from gptbundle.common.config import settings
+
+T = TypeVar("T")
+
+
+class AutocompleteCoalescer:
+    """Debounces and coalesces the autocomplete queries of a session.
+
+    A query waits debounce_seconds before it runs. When a newer query of the
+    same session arrives in the meantime, e.g. the next keystroke, the older
+    one is dropped without searching. A query that is identical to one of the
+    session already in flight waits for that search instead of starting its
+    own.
+    """
+
+    _shared: "AutocompleteCoalescer | None" = None
+
+    def __init__(self, debounce_seconds: float | None = None):
+        self.debounce_seconds = (
+            settings.SEARCH_AUTOCOMPLETE_DEBOUNCE
+            if debounce_seconds is None
+            else debounce_seconds
+        )
+        self._tickets = itertools.count()
+        # session -> ticket of its newest query
+        self._latest: dict[str, int] = {}
+        self._in_flight: dict[tuple[str, str], asyncio.Future] = {}
+
+        self.superseded = 0
+        self.coalesced = 0
+
+    @classmethod
+    def shared(cls) -> "AutocompleteCoalescer":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    async def run(
+        self, session: str, query: str, search: Callable[[], Awaitable[T]]
+    ) -> T | None:
+        """Returns the result of search, or None when a newer query of the
+        session replaced this one."""
+        ticket = next(self._tickets)
+        self._latest[session] = ticket
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            if self._latest.get(session) != ticket:
+                self.superseded += 1
+                return None
+
+            key = (session, query)
+            future = self._in_flight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(search())
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            else:
+                self.coalesced += 1
+            # a client that goes away must not cancel the search of the others
+            return await asyncio.shield(future)
+        finally:
+            if self._latest.get(session) == ticket:
+                del self._latest[session]
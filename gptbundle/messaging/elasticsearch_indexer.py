@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+
+from gptbundle.common.config import settings
+
+from .exceptions import SearchIndexingError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BulkOperation:
+    action: dict[str, Any]
+    body: dict[str, Any] | None = None
+    wait_for_refresh: bool = False
+    future: asyncio.Future | None = None
+
+    @property
+    def waiting(self) -> bool:
+        # the caller may have been cancelled, e.g. by a websocket disconnect
+        return self.future is not None and not self.future.done()
+
+
+def bulk_operations(batch: list[BulkOperation]) -> list[dict[str, Any]]:
+    operations = []
+    for op in batch:
+        operations.append(op.action)
+        if op.body is not None:
+            operations.append(op.body)
+    return operations
+
+
+def bulk_item_result(item: dict[str, Any]) -> dict[str, Any]:
+    """Returns the result of one item of a bulk response, raises
+    SearchIndexingError when that item failed."""
+    result = next(iter(item.values()))
+    if result.get("error") or result.get("status", 200) >= 300:
+        raise SearchIndexingError(result.get("status", 500), result.get("error"))
+    return result
+
+
+class ElasticsearchBulkIndexer:
+    """Buffers index, update and delete operations and sends them with the bulk
+    API once max_actions are queued or flush_interval seconds passed.
+
+    Operations whose caller waits for the outcome (wait_for_result) are
+    flushed right away, with refresh=wait_for if the caller also needs to read
+    its write (wait_for_refresh). Everything else is fire and forget and
+    becomes searchable with the next periodic refresh.
+    """
+
+    def __init__(
+        self,
+        client: AsyncElasticsearch,
+        max_actions: int | None = None,
+        flush_interval: float | None = None,
+        max_queue_size: int | None = None,
+    ):
+        self.client = client
+        self.max_actions = max_actions or settings.ELASTICSEARCH_BULK_MAX_ACTIONS
+        self.flush_interval = (
+            flush_interval or settings.ELASTICSEARCH_BULK_FLUSH_INTERVAL
+        )
+        # a full queue makes submit wait, which pushes back on the writers
+        # None is queued by stop() to wake the flush loop up
+        self._queue: asyncio.Queue[BulkOperation | None] = asyncio.Queue(
+            max_queue_size or settings.ELASTICSEARCH_BULK_MAX_QUEUE_SIZE
+        )
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+        self.flushes = 0
+        self.flushed_actions = 0
+        self.failed_actions = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "flushes": self.flushes,
+            "flushed_actions": self.flushed_actions,
+            "failed_actions": self.failed_actions,
+            "last_flush_latency_ms": self.last_flush_latency * 1000,
+            "avg_flush_latency_ms": (
+                self._total_flush_latency / self.flushes * 1000 if self.flushes else 0
+            ),
+            "max_flush_latency_ms": self.max_flush_latency * 1000,
+        }
+
+    def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flushes everything still queued and stops the background task."""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def submit(
+        self,
+        action: dict[str, Any],
+        body: dict[str, Any] | None = None,
+        wait_for_refresh: bool = False,
+        wait_for_result: bool = False,
+    ) -> dict[str, Any] | None:
+        """Queues one bulk operation. When waiting, the call returns the item
+        result once the operation was applied (and is searchable with
+        wait_for_refresh) or raises SearchIndexingError, otherwise it returns
+        as soon as the operation is queued."""
+        future = (
+            asyncio.get_running_loop().create_future()
+            if wait_for_refresh or wait_for_result
+            else None
+        )
+        await self._queue.put(BulkOperation(action, body, wait_for_refresh, future))
+        if future is None:
+            return None
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            elif self._stopping:
+                return
+
+    async def _next_batch(self) -> list[BulkOperation]:
+        batch: list[BulkOperation] = []
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while len(batch) < self.max_actions:
+            # callers are waiting, take what is queued and go
+            if self._stopping or any(op.future is not None for op in batch):
+                if self._queue.empty():
+                    break
+                op = self._queue.get_nowait()
+            else:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    op = await asyncio.wait_for(self._queue.get(), timeout)
+                except TimeoutError:
+                    break
+            if op is None:
+                self._stopping = True
+                continue
+            batch.append(op)
+            if deadline is None:
+                deadline = loop.time() + self.flush_interval
+        return batch
+
+    async def _flush(self, batch: list[BulkOperation]) -> None:
+        refresh = "wait_for" if any(op.wait_for_refresh for op in batch) else False
+        start = time.perf_counter()
+        try:
+            response = await self.client.bulk(
+                operations=bulk_operations(batch), refresh=refresh
+            )
+        except Exception as e:
+            logger.exception(f"Bulk request with {len(batch)} operations failed")
+            self.failed_actions += len(batch)
+            for op in batch:
+                if op.waiting:
+                    op.future.set_exception(e)
+            return
+        latency = time.perf_counter() - start
+        self.flushes += 1
+        self.flushed_actions += len(batch)
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self._total_flush_latency += latency
+        logger.debug(
+            f"Flushed {len(batch)} operations to ES in {latency * 1000:.1f}ms, "
+            f"{self.queue_depth} still queued"
+        )
+
+        for op, item in zip(batch, response["items"], strict=True):
+            try:
+                result = bulk_item_result(item)
+            except SearchIndexingError as e:
+                self.failed_actions += 1
+                if op.waiting:
+                    op.future.set_exception(e)
+                elif not (e.status == 404 and "delete" in op.action):
+                    logger.warning(f"Bulk operation {op.action} failed: {e}")
+                continue
+            if op.waiting:
+                op.future.set_result(result)
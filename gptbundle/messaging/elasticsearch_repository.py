@@ -1,17 +1,292 @@
+import asyncio
 import logging
+from datetime import UTC, datetime
+from typing import Any
 
-from elasticsearch import AsyncElasticsearch, ConflictError
+from elasticsearch import AsyncElasticsearch, ConnectionTimeout
 
 from gptbundle.common.config import settings
-from gptbundle.messaging.exceptions import ChatAlreadyExistsError
-from gptbundle.messaging.schemas import Chat
+from gptbundle.messaging.exceptions import ChatAlreadyExistsError, SearchIndexingError
+from gptbundle.messaging.schemas import (
+    CHAT_TITLE_MAX_LENGTH,
+    AutocompleteResponse,
+    AutocompleteSuggestion,
+    BulkIndexerMetrics,
+    Chat,
+    ChatSearchHit,
+    MessageCreate,
+    MessageSearchHit,
+    MessageSearchResponse,
+    MessageSearchSort,
+)
+
+from .elasticsearch_indexer import (
+    BulkOperation,
+    ElasticsearchBulkIndexer,
+    bulk_item_result,
+    bulk_operations,
+)
+from .models import SearchOutboxEvent
+from .outbox import SearchEventType, search_document
 
 logger = logging.getLogger(__name__)
 
+CHATS_ALIAS = "chats"
+# One document per message, searched with highlighting. Messages are only ever
+# added, so this index rolls over to a new one by age and size (ILM) while the
+# alias keeps covering all of them.
+MESSAGES_ALIAS = "chat_messages"
+INDEX_ALIASES = (CHATS_ALIAS, MESSAGES_ALIAS)
+ROLLOVER_ALIASES = (MESSAGES_ALIAS,)
+
+
+def index_body(alias: str) -> dict[str, Any]:
+    """Settings and mappings of the indices behind an alias. Documents are
+    routed by user_email, a search only touches the shard of its user."""
+    settings_: dict[str, Any] = {
+        "number_of_shards": settings.ELASTICSEARCH_NUMBER_OF_SHARDS,
+        "number_of_replicas": settings.ELASTICSEARCH_NUMBER_OF_REPLICAS,
+    }
+    if alias == CHATS_ALIAS:
+        return {
+            "settings": settings_,
+            "mappings": {
+                "_routing": {"required": True},
+                "properties": {
+                    "user_email": {"type": "keyword"},
+                    "title": {
+                        "type": "text",
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 256},
+                            "suggest": {"type": "search_as_you_type"},
+                        },
+                    },
+                },
+            },
+        }
+    return {
+        "settings": {
+            **settings_,
+            # the "recent" sort can stop early instead of sorting all hits
+            "sort.field": ["chat_timestamp", "chat_id", "seq"],
+            "sort.order": ["desc", "desc", "desc"],
+        },
+        "mappings": {
+            "_routing": {"required": True},
+            "properties": {
+                "chat_id": {"type": "keyword"},
+                "chat_timestamp": {"type": "double"},
+                "user_email": {"type": "keyword"},
+                "seq": {"type": "long"},
+                "role": {"type": "keyword"},
+                "message_type": {"type": "keyword"},
+                "llm_model": {"type": "keyword"},
+                # offsets let the highlighter skip re-analyzing the content,
+                # suggest holds the shingles and edge n-grams for autocomplete
+                "content": {
+                    "type": "text",
+                    "index_options": "offsets",
+                    "fields": {"suggest": {"type": "search_as_you_type"}},
+                },
+            },
+        },
+    }
+
+
+def alias_settings(alias: str) -> dict[str, Any]:
+    # rollover writes to the newest index only
+    return {"is_write_index": True} if alias in ROLLOVER_ALIASES else {}
+
+
+async def put_index_templates(client: AsyncElasticsearch) -> None:
+    """Makes the indices created by a rollover look like the first one."""
+    rollover = {
+        "max_age": settings.ELASTICSEARCH_MESSAGES_ROLLOVER_MAX_AGE,
+        "max_primary_shard_size": (
+            settings.ELASTICSEARCH_MESSAGES_ROLLOVER_MAX_PRIMARY_SHARD_SIZE
+        ),
+    }
+    for alias in ROLLOVER_ALIASES:
+        await client.ilm.put_lifecycle(
+            name=alias,
+            policy={"phases": {"hot": {"actions": {"rollover": rollover}}}},
+        )
+        body = index_body(alias)
+        await client.indices.put_index_template(
+            name=alias,
+            index_patterns=[f"{alias}-*"],
+            template={
+                "settings": {
+                    **body["settings"],
+                    "index.lifecycle.name": alias,
+                    "index.lifecycle.rollover_alias": alias,
+                },
+                "mappings": body["mappings"],
+            },
+        )
+
+
+MESSAGE_SEARCH_SORTS = {
+    MessageSearchSort.RELEVANCE: [
+        {"_score": "desc"},
+        {"chat_id": "asc"},
+        {"seq": "asc"},
+    ],
+    MessageSearchSort.RECENT: [
+        {"chat_timestamp": "desc"},
+        {"chat_id": "desc"},
+        {"seq": "desc"},
+    ],
+}
+
+
+def bool_prefix_query(field: str, prefix: str) -> dict[str, Any]:
+    # the last word of the prefix is matched as the start of a term
+    return {
+        "multi_match": {
+            "query": prefix,
+            "type": "bool_prefix",
+            "fields": [field, f"{field}._2gram", f"{field}._3gram"],
+        }
+    }
+
+
+def versioned_index_name(alias: str) -> str:
+    name = f"{alias}-{datetime.now(UTC):%Y%m%d%H%M%S%f}"
+    # a rollover increments the trailing number
+    return f"{name}-000001" if alias in ROLLOVER_ALIASES else name
+
+
+# Appends only the new messages to the stored document, the cost of an append
+# does not depend on how long the chat already is. next_seq is the sequence
+# number of the next message the document expects, an append that was already
+# applied is skipped so that outbox events can be replayed.
+APPEND_MESSAGES_SCRIPT = """
+if (params.first_seq != null && ctx._source.next_seq != null
+        && params.first_seq < ctx._source.next_seq) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.messages.addAll(params.messages);
+    if (params.first_seq != null) {
+        ctx._source.next_seq = params.first_seq + params.messages.size();
+    }
+    if (params.is_rag) {
+        ctx._source.is_rag = true;
+    }
+    if (ctx._source.title == null) {
+        ctx._source.title = params.title;
+    }
+}
+"""
+
+
+def index_chat_operation(
+    document: dict[str, Any], op_type: str = "index", index: str = CHATS_ALIAS
+) -> BulkOperation:
+    return BulkOperation(
+        {
+            op_type: {
+                "_index": index,
+                "_id": document["chat_id"],
+                "routing": document["user_email"],
+            }
+        },
+        document,
+    )
+
+
+def append_messages_operation(
+    chat_id: str,
+    user_email: str,
+    messages: list[dict[str, Any]],
+    first_seq: int | None = None,
+) -> BulkOperation:
+    script = {
+        "source": APPEND_MESSAGES_SCRIPT,
+        "lang": "painless",
+        "params": {
+            "messages": messages,
+            "first_seq": first_seq,
+            "is_rag": any(msg.get("pdf_s3_keys") for msg in messages),
+            "title": messages[0]["content"][:CHAT_TITLE_MAX_LENGTH]
+            if messages
+            else None,
+        },
+    }
+    return BulkOperation(
+        {
+            "update": {
+                "_index": CHATS_ALIAS,
+                "_id": chat_id,
+                "routing": user_email,
+                "retry_on_conflict": 3,
+            }
+        },
+        {"script": script},
+    )
+
+
+def delete_chat_operation(chat_id: str, user_email: str) -> BulkOperation:
+    return BulkOperation(
+        {"delete": {"_index": CHATS_ALIAS, "_id": chat_id, "routing": user_email}}
+    )
+
+
+def index_messages_operations(
+    chat_id: str,
+    chat_timestamp: float,
+    user_email: str,
+    messages: list[dict[str, Any]],
+    first_seq: int,
+    index: str = MESSAGES_ALIAS,
+) -> list[BulkOperation]:
+    """Operations indexing every message as a document of its own. The id is
+    derived from chat_id and seq, indexing a message again overwrites it
+    unless the index rolled over in between."""
+    return [
+        BulkOperation(
+            {
+                "index": {
+                    "_index": index,
+                    "_id": f"{chat_id}#{seq}",
+                    "routing": user_email,
+                }
+            },
+            {
+                "chat_id": chat_id,
+                "chat_timestamp": chat_timestamp,
+                "user_email": user_email,
+                "seq": seq,
+                "role": msg["role"],
+                "message_type": msg.get("message_type"),
+                "llm_model": msg.get("llm_model"),
+                "content": msg["content"],
+            },
+        )
+        for seq, msg in enumerate(messages, start=first_seq)
+    ]
+
+
+def document_messages_operations(
+    document: dict[str, Any], index: str = MESSAGES_ALIAS
+) -> list[BulkOperation]:
+    # Messages still stored in the legacy layout come first and get negative
+    # sequence numbers, appends are numbered from 0 after them.
+    messages = document["messages"]
+    return index_messages_operations(
+        document["chat_id"],
+        document["timestamp"],
+        document["user_email"],
+        messages,
+        document["next_seq"] - len(messages),
+        index,
+    )
+
 
 class ElasticsearchRepository:
     _index_initialized = False
     _client: AsyncElasticsearch | None = None
+    _indexer: ElasticsearchBulkIndexer | None = None
 
     def __init__(self):
         if (
@@ -20,6 +295,25 @@ class ElasticsearchRepository:
             ElasticsearchRepository._client = self._create_client()
         self.client = ElasticsearchRepository._client
 
+    @classmethod
+    def start_bulk_indexer(cls) -> None:
+        """Routes all writes of the process through a shared bulk indexer,
+        called from the app lifespan."""
+        cls._indexer = ElasticsearchBulkIndexer(cls().client)
+        cls._indexer.start()
+
+    @classmethod
+    async def stop_bulk_indexer(cls) -> None:
+        if cls._indexer is not None:
+            indexer, cls._indexer = cls._indexer, None
+            await indexer.stop()
+
+    @classmethod
+    def bulk_indexer_metrics(cls) -> BulkIndexerMetrics:
+        if cls._indexer is None:
+            return BulkIndexerMetrics(running=False)
+        return BulkIndexerMetrics(**cls._indexer.metrics())
+
     def _create_client(self) -> AsyncElasticsearch:
         return AsyncElasticsearch(
             hosts=settings.ELASTICSEARCH_HOST,
@@ -27,61 +321,397 @@ class ElasticsearchRepository:
         )
 
     async def create_index_if_not_exists(self) -> None:
-        if not await self.client.indices.exists(index="chats"):
-            body = {
-                "settings": {"number_of_shards": 1, "number_of_replicas": 1},
-                "mappings": {"properties": {"user_email": {"type": "keyword"}}},
-            }
-            await self.client.indices.create(index="chats", body=body)
+        # the indices are used through aliases, reindex-search builds new ones
+        # and swaps them
+        await put_index_templates(self.client)
+        for alias in INDEX_ALIASES:
+            if not await self.client.indices.exists(index=alias):
+                await self.client.indices.create(
+                    index=versioned_index_name(alias),
+                    body={
+                        **index_body(alias),
+                        "aliases": {alias: alias_settings(alias)},
+                    },
+                )
+
+    async def store_chat(self, chat: Chat, wait_for_refresh: bool = False) -> None:
+        try:
+            await self._write(
+                index_chat_operation(search_document(chat), op_type="create"),
+                wait_for_refresh,
+            )
+            logger.debug(f"Chat with id {chat.chat_id} stored successfully in ES")
+        except SearchIndexingError as e:
+            if e.status == 409:
+                raise ChatAlreadyExistsError(
+                    f"Chat with id {chat.chat_id} already exists"
+                ) from e
+            raise
+
+    async def update_chat(self, chat: Chat, wait_for_refresh: bool = False) -> None:
+        await self._write(index_chat_operation(search_document(chat)), wait_for_refresh)
+
+    async def append_messages(
+        self,
+        chat_id: str,
+        user_email: str,
+        messages: list[MessageCreate],
+        first_seq: int | None = None,
+        wait_for_refresh: bool = False,
+    ) -> bool:
+        """Appends messages to an indexed chat with a scripted partial update.
+        Returns False when the chat is known not to be indexed."""
+        operation = append_messages_operation(
+            chat_id,
+            user_email,
+            [
+                # presigned urls expire, they are never worth indexing
+                msg.model_dump(
+                    mode="json", exclude={"img_presigned_urls", "pdf_presigned_urls"}
+                )
+                for msg in messages
+            ],
+            first_seq,
+        )
+        try:
+            await self._write(operation, wait_for_refresh)
+        except SearchIndexingError as e:
+            if e.status == 404:
+                logger.warning(f"Chat with id {chat_id} is not indexed in ES")
+                return False
+            raise
+        return True
 
-    async def store_chat(self, chat: Chat) -> None:
+    async def delete_chat(
+        self, chat_id: str, user_email: str, wait_for_refresh: bool = False
+    ) -> None:
+        try:
+            await self._write(
+                delete_chat_operation(chat_id, user_email), wait_for_refresh
+            )
+        except SearchIndexingError as e:
+            if e.status != 404:
+                raise
+
+    async def delete_chat_messages(self, chat_id: str, user_email: str) -> None:
+        """Deletes the message documents of a chat, whatever their sequence
+        numbers are and whichever index they rolled into."""
+        await self.client.delete_by_query(
+            index=MESSAGES_ALIAS,
+            query={"term": {"chat_id": chat_id}},
+            routing=user_email,
+            conflicts="proceed",
+        )
+
+    async def apply_events(
+        self, events: list[SearchOutboxEvent]
+    ) -> list[SearchIndexingError | None]:
+        """Applies search outbox events in one bulk request, returns one error
+        per event. A 404 is only returned when it is the event's only kind of
+        error, it is the one the outbox consumer can resolve."""
+        operations = [self._event_operations(event) for event in events]
+        errors = await self.apply_operations(
+            [op for event_operations in operations for op in event_operations]
+        )
+        event_errors = []
+        start = 0
+        for event_operations in operations:
+            end = start + len(event_operations)
+            failed = sorted(
+                (e for e in errors[start:end] if e is not None),
+                key=lambda e: e.status == 404,
+            )
+            event_errors.append(failed[0] if failed else None)
+            start = end
+
+        # The message documents of a deleted chat are removed by query, after
+        # everything else of the batch. Nothing is written to a chat after it
+        # was deleted, so any message a replay put back is removed as well.
+        for event in events:
+            if event.event_type == SearchEventType.CHAT_DELETED:
+                await self.delete_chat_messages(event.chat_id, event.user_email)
+        return event_errors
+
+    async def index_document(self, document: dict[str, Any]) -> None:
+        """Indexes a whole chat document, replacing what is indexed."""
+        errors = await self.apply_operations([index_chat_operation(document)])
+        if errors[0] is not None:
+            raise errors[0]
+
+    async def apply_operations(
+        self, operations: list[BulkOperation]
+    ) -> list[SearchIndexingError | None]:
+        """Applies the operations and waits for their outcome, without forcing a
+        refresh. Returns the error of every operation, None where it succeeded.
+        Any other failure, e.g. Elasticsearch being unreachable, is raised."""
         if not ElasticsearchRepository._index_initialized:
             await self.create_index_if_not_exists()
             ElasticsearchRepository._index_initialized = True
-        try:
-            await self.client.index(
-                index="chats",
-                document=chat.dict(),
-                id=chat.chat_id,
-                op_type="create",
-                refresh=True,
+        indexer = ElasticsearchRepository._indexer
+        if indexer is not None and indexer.running:
+            results = await asyncio.gather(
+                *(
+                    indexer.submit(op.action, op.body, wait_for_result=True)
+                    for op in operations
+                ),
+                return_exceptions=True,
             )
-            logger.debug(f"Chat with id {chat.chat_id} stored successfully in ES")
-        except ConflictError as e:
-            raise ChatAlreadyExistsError(
-                f"Chat with id {chat.chat_id} already exists"
-            ) from e
+        else:
+            response = await self.client.bulk(operations=bulk_operations(operations))
+            results = []
+            for item in response["items"]:
+                try:
+                    results.append(bulk_item_result(item))
+                except SearchIndexingError as e:
+                    results.append(e)
+        errors: list[SearchIndexingError | None] = []
+        for result in results:
+            if isinstance(result, SearchIndexingError):
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                errors.append(None)
+        return errors
 
-    async def update_chat(self, chat: Chat) -> None:
+    def _event_operations(self, event: SearchOutboxEvent) -> list[BulkOperation]:
+        payload: dict[str, Any] = event.payload or {}
+        if event.event_type == SearchEventType.CHAT_CREATED:
+            return [
+                index_chat_operation(payload["document"]),
+                *document_messages_operations(payload["document"]),
+            ]
+        if event.event_type == SearchEventType.MESSAGES_APPENDED:
+            return [
+                append_messages_operation(
+                    event.chat_id,
+                    event.user_email,
+                    payload["messages"],
+                    payload["first_seq"],
+                ),
+                *index_messages_operations(
+                    event.chat_id,
+                    event.chat_timestamp,
+                    event.user_email,
+                    payload["messages"],
+                    payload["first_seq"],
+                ),
+            ]
+        return [delete_chat_operation(event.chat_id, event.user_email)]
+
+    async def _write(self, operation: BulkOperation, wait_for_refresh: bool) -> None:
         if not ElasticsearchRepository._index_initialized:
             await self.create_index_if_not_exists()
             ElasticsearchRepository._index_initialized = True
-        await self.client.index(
-            index="chats", document=chat.dict(), id=chat.chat_id, refresh=True
+        indexer = ElasticsearchRepository._indexer
+        if indexer is not None and indexer.running:
+            await indexer.submit(operation.action, operation.body, wait_for_refresh)
+            return
+        # no indexer outside of the app (cli, tests), write right away
+        response = await self.client.bulk(
+            operations=bulk_operations([operation]), refresh=True
         )
+        bulk_item_result(response["items"][0])
 
-    async def delete_chat(self, chat_id: str) -> None:
+    async def search_chats(
+        self, user_email: str, query: str, size: int = 20
+    ) -> list[Chat]:
+        """Searches the chats of a user, returning them whole. Prefer
+        search_chat_hits, the response of this one grows with the chats."""
         if not ElasticsearchRepository._index_initialized:
             await self.create_index_if_not_exists()
             ElasticsearchRepository._index_initialized = True
-        await self.client.delete(index="chats", id=chat_id, refresh=True)
+        search_query = {
+            "size": size,
+            "query": self._chats_query(user_email, query),
+            "_source": {"excludes": ["next_seq", "title"]},
+        }
+        response = await self.client.search(
+            index=CHATS_ALIAS, body=search_query, routing=user_email
+        )
+        found_matches = [Chat(**hit["_source"]) for hit in response["hits"]["hits"]]
+        return sorted(found_matches, key=lambda x: x.timestamp, reverse=True)
 
-    async def search_chats(self, user_email: str, query: str) -> list[Chat]:
+    async def search_chat_hits(
+        self, user_email: str, query: str, size: int = 20
+    ) -> list[ChatSearchHit]:
+        """Searches the chats of a user, returning the best matching snippet
+        instead of the messages. The response size does not depend on how long
+        the chats are."""
         if not ElasticsearchRepository._index_initialized:
             await self.create_index_if_not_exists()
             ElasticsearchRepository._index_initialized = True
         search_query = {
+            "size": size,
+            "query": self._chats_query(user_email, query),
+            "_source": {"includes": ["chat_id", "timestamp", "title", "is_rag"]},
+            "highlight": {
+                "fields": {
+                    "messages.content": {
+                        "fragment_size": 150,
+                        "number_of_fragments": 1,
+                    }
+                }
+            },
+        }
+        response = await self.client.search(
+            index=CHATS_ALIAS, body=search_query, routing=user_email
+        )
+        return [
+            ChatSearchHit(
+                **hit["_source"],
+                snippet=next(
+                    iter(hit.get("highlight", {}).get("messages.content", [])), None
+                ),
+                score=hit["_score"],
+            )
+            for hit in response["hits"]["hits"]
+        ]
+
+    def _chats_query(self, user_email: str, query: str) -> dict[str, Any]:
+        return {
+            "bool": {
+                "must": [
+                    {"match": {"messages.content": query}},
+                ],
+                "filter": [
+                    {"term": {"user_email": user_email}},
+                ],
+            }
+        }
+
+    async def search_messages(
+        self,
+        user_email: str,
+        query: str,
+        size: int = 20,
+        search_after: list[Any] | None = None,
+        sort: MessageSearchSort = MessageSearchSort.RELEVANCE,
+    ) -> MessageSearchResponse:
+        """Searches the messages of a user, returning highlighted snippets
+        instead of whole chats. Pass search_after of a response to get the
+        next page."""
+        if not ElasticsearchRepository._index_initialized:
+            await self.create_index_if_not_exists()
+            ElasticsearchRepository._index_initialized = True
+        body: dict[str, Any] = {
+            "size": size,
             "query": {
                 "bool": {
-                    "must": [
-                        {"match": {"messages.content": query}},
-                    ],
-                    "filter": [
-                        {"term": {"user_email": user_email}},
-                    ],
+                    "must": [{"match": {"content": query}}],
+                    "filter": [{"term": {"user_email": user_email}}],
                 }
-            }
+            },
+            "sort": MESSAGE_SEARCH_SORTS[sort],
+            "_source": ["chat_id", "chat_timestamp", "seq", "role"],
+            "highlight": {
+                "fields": {"content": {"fragment_size": 150, "number_of_fragments": 3}}
+            },
+            # counting every match is what makes deep result sets expensive
+            "track_total_hits": False,
         }
-        response = await self.client.search(index="chats", body=search_query)
-        found_matches = [Chat(**hit["_source"]) for hit in response["hits"]["hits"]]
-        return sorted(found_matches, key=lambda x: x.timestamp, reverse=True)
+        if search_after:
+            body["search_after"] = search_after
+        response = await self.client.search(
+            index=MESSAGES_ALIAS, body=body, routing=user_email
+        )
+        hits = response["hits"]["hits"]
+        return MessageSearchResponse(
+            items=[
+                MessageSearchHit(
+                    **hit["_source"],
+                    snippets=hit.get("highlight", {}).get("content", []),
+                    score=hit.get("_score"),
+                )
+                for hit in hits
+            ],
+            search_after=hits[-1]["sort"] if len(hits) == size else None,
+        )
+
+    async def autocomplete(
+        self,
+        user_email: str,
+        prefix: str,
+        size: int = 8,
+        timeout: float | None = None,
+    ) -> AutocompleteResponse:
+        """Chats whose title or messages contain words starting with the
+        words typed so far. Titles and messages are searched in one msearch
+        round trip, within the latency budget of timeout seconds."""
+        if not ElasticsearchRepository._index_initialized:
+            await self.create_index_if_not_exists()
+            ElasticsearchRepository._index_initialized = True
+        timeout = timeout or settings.SEARCH_AUTOCOMPLETE_TIMEOUT
+        user_filter = {"term": {"user_email": user_email}}
+        common = {
+            "size": size,
+            "timeout": f"{int(timeout * 1000)}ms",
+            "track_total_hits": False,
+        }
+        searches = [
+            {"index": CHATS_ALIAS, "routing": user_email},
+            {
+                **common,
+                "query": {
+                    "bool": {
+                        "must": [bool_prefix_query("title.suggest", prefix)],
+                        "filter": [user_filter],
+                    }
+                },
+                "_source": ["chat_id", "timestamp", "title"],
+            },
+            {"index": MESSAGES_ALIAS, "routing": user_email},
+            {
+                **common,
+                "query": {
+                    "bool": {
+                        "must": [bool_prefix_query("content.suggest", prefix)],
+                        "filter": [user_filter],
+                    }
+                },
+                # the best matching message of every chat
+                "collapse": {"field": "chat_id"},
+                "_source": ["chat_id", "chat_timestamp", "seq"],
+                "highlight": {
+                    "fields": {
+                        "content.suggest": {
+                            "fragment_size": 80,
+                            "number_of_fragments": 1,
+                        }
+                    }
+                },
+            },
+        ]
+        try:
+            response = await self.client.options(request_timeout=timeout).msearch(
+                searches=searches
+            )
+        except ConnectionTimeout:
+            logger.warning(f"Autocomplete for {user_email} ran out of time")
+            return AutocompleteResponse(items=[], timed_out=True)
+
+        titles, messages = response["responses"]
+        items: dict[str, AutocompleteSuggestion] = {}
+        for hit in titles.get("hits", {}).get("hits", []):
+            source = hit["_source"]
+            items[source["chat_id"]] = AutocompleteSuggestion(
+                chat_id=source["chat_id"],
+                chat_timestamp=source["timestamp"],
+                title=source.get("title"),
+            )
+        for hit in messages.get("hits", {}).get("hits", []):
+            source = hit["_source"]
+            if source["chat_id"] in items or len(items) >= size:
+                continue
+            items[source["chat_id"]] = AutocompleteSuggestion(
+                **source,
+                snippet=next(
+                    iter(hit.get("highlight", {}).get("content.suggest", [])), None
+                ),
+            )
+        return AutocompleteResponse(
+            items=list(items.values()),
+            timed_out=any(
+                r.get("timed_out", False) or "error" in r for r in (titles, messages)
+            ),
+        )
@@ -2,3 +2,37 @@ class ChatAlreadyExistsError(Exception):
     """Exception raised when a chat already exists."""
 
     pass
+
+
+class ChatVersionConflictError(Exception):
+    """Exception raised when a chat was modified concurrently between reading
+    its version and writing to it."""
+
+    pass
+
+
+class AttachmentAccessError(Exception):
+    """Exception raised when S3 keys are requested that are not attachments of
+    the chat."""
+
+    def __init__(self, keys: list[str]):
+        super().__init__(f"Not attachments of the chat: {keys}")
+        self.keys = keys
+
+
+class AttachmentPromotionError(Exception):
+    """Exception raised when attachments could not be moved out of the temp
+    prefix. The moves that succeeded have been undone."""
+
+    def __init__(self, failed: dict[str, BaseException]):
+        super().__init__(f"Could not promote attachments: {list(failed)}")
+        self.failed = failed
+
+
+class SearchIndexingError(Exception):
+    """Exception raised when Elasticsearch rejects a write operation."""
+
+    def __init__(self, status: int, error: dict | None = None):
+        super().__init__(f"Indexing failed with status {status}: {error}")
+        self.status = status
+        self.error = error
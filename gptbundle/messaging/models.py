@@ -1,11 +1,14 @@
 from pynamodb.attributes import (
     BooleanAttribute,
+    JSONAttribute,
     ListAttribute,
     MapAttribute,
     NumberAttribute,
+    TTLAttribute,
     UnicodeAttribute,
+    VersionAttribute,
 )
-from pynamodb.indexes import AllProjection, GlobalSecondaryIndex
+from pynamodb.indexes import AllProjection, GlobalSecondaryIndex, IncludeProjection
 from pynamodb.models import Model
 
 from gptbundle.common.config import settings
@@ -22,6 +25,22 @@ class UserEmailIndex(GlobalSecondaryIndex):
     timestamp = NumberAttribute(range_key=True)
 
 
+class ChatSummaryIndex(GlobalSecondaryIndex):
+    """Only projects what the chat listing needs, so listing chats never reads
+    more than the chat keys and a few small attributes."""
+
+    class Meta:
+        index_name = "user_email-summary-index"
+        projection = IncludeProjection(
+            ["title", "message_count", "is_rag", "last_model"]
+        )
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    user_email = UnicodeAttribute(hash_key=True)
+    timestamp = NumberAttribute(range_key=True)
+
+
 class MessageItem(MapAttribute):
     content = UnicodeAttribute()
     role = UnicodeAttribute()
@@ -46,6 +65,108 @@ class Chat(Model):
     timestamp = NumberAttribute(range_key=True)
     user_email = UnicodeAttribute()
     is_rag = BooleanAttribute(default=False)
-    messages = ListAttribute(of=MessageItem)
+    message_count = NumberAttribute(default=0)
+    title = UnicodeAttribute(null=True)
+    last_model = UnicodeAttribute(null=True)
+    # bumped by every write, appends are conditioned on it
+    version = VersionAttribute()
+    # legacy layout, only present on chats not yet moved to ChatMessage items
+    messages = ListAttribute(of=MessageItem, null=True)
 
     user_email_index = UserEmailIndex()
+    summary_index = ChatSummaryIndex()
+
+
+def message_sort_key_prefix(chat_timestamp: float) -> str:
+    return f"{chat_timestamp:017.6f}#"
+
+
+def message_sort_key(chat_timestamp: float, seq: int) -> str:
+    # zero padded so that lexicographic order equals numeric order
+    return f"{message_sort_key_prefix(chat_timestamp)}{seq:010d}"
+
+
+class ChatMessage(Model):
+    """A single message of a chat, stored as its own item under the chat_id
+    partition so that appending does not rewrite the whole conversation."""
+
+    class Meta:
+        table_name = "ChatMessage"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    chat_id = UnicodeAttribute(hash_key=True)
+    sort_key = UnicodeAttribute(range_key=True)
+    seq = NumberAttribute()
+    user_email = UnicodeAttribute()
+    content = UnicodeAttribute()
+    role = UnicodeAttribute()
+    message_type = UnicodeAttribute()
+    img_s3_keys = ListAttribute(of=UnicodeAttribute, null=True)
+    pdf_s3_keys = ListAttribute(of=UnicodeAttribute, null=True)
+    llm_model = UnicodeAttribute()
+    reasoning_effort = UnicodeAttribute(null=True)
+
+
+class SearchOutboxEvent(Model):
+    """A change of a chat that still has to be applied to the search index.
+    Written in the same transaction as the change itself."""
+
+    class Meta:
+        table_name = "SearchOutbox"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    shard = NumberAttribute(hash_key=True)
+    # nanosecond timestamp prefix, events of a shard sort in write order
+    event_id = UnicodeAttribute(range_key=True)
+    event_type = UnicodeAttribute()
+    chat_id = UnicodeAttribute()
+    chat_timestamp = NumberAttribute()
+    user_email = UnicodeAttribute()
+    payload = JSONAttribute(null=True)
+    expires_at = TTLAttribute(null=True)
+
+
+class SearchOutboxCheckpoint(Model):
+    """Last applied event of an outbox shard and the consumer leasing it."""
+
+    class Meta:
+        table_name = "SearchOutboxCheckpoint"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    shard = NumberAttribute(hash_key=True)
+    event_id = UnicodeAttribute(null=True)
+    owner = UnicodeAttribute(null=True)
+    lease_expires_at = NumberAttribute(null=True)
+
+
+class ChatPurge(Model):
+    """A deleted chat whose messages, attachments, vector store and LLM history
+    are still to be removed. Written in the same transaction that deletes the
+    chat header, see ChatPurgeWorker."""
+
+    class Meta:
+        table_name = "ChatPurge"
+        region = settings.AWS_REGION
+        host = settings.AWS_ENDPOINT_URL_DYNAMODB
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    chat_id = UnicodeAttribute(hash_key=True)
+    timestamp = NumberAttribute(range_key=True)
+    user_email = UnicodeAttribute()
+    requested_at = NumberAttribute()
+    # attachments found so far, the legacy messages die with the chat header
+    s3_keys = ListAttribute(of=UnicodeAttribute, null=True)
+    attempts = NumberAttribute(default=0)
+    # also the lease of the worker that claimed the purge
+    next_attempt_at = NumberAttribute()
+    last_error = UnicodeAttribute(null=True)
@@ -0,0 +1,104 @@
+import time
+import uuid
+import zlib
+from datetime import timedelta
+from enum import StrEnum
+from typing import Any
+
+from gptbundle.common.config import settings
+
+from .models import SearchOutboxEvent
+from .schemas import Chat, MessageCreate, chat_title
+
+
+class SearchEventType(StrEnum):
+    CHAT_CREATED = "chat_created"
+    MESSAGES_APPENDED = "messages_appended"
+    CHAT_DELETED = "chat_deleted"
+
+
+def outbox_shard(chat_id: str) -> int:
+    # all events of a chat land in the same shard and keep their order
+    return zlib.crc32(chat_id.encode()) % settings.SEARCH_OUTBOX_SHARDS
+
+
+def outbox_event_id() -> str:
+    return f"{time.time_ns():020d}#{uuid.uuid4().hex[:8]}"
+
+
+def event_id_time(event_id: str) -> float:
+    return int(event_id.split("#")[0]) / 1e9
+
+
+def search_document(chat: Chat, next_seq: int | None = None) -> dict[str, Any]:
+    """The document of a chat in the search index. next_seq is the message_count
+    of the chat header, it only differs from the number of messages for chats
+    still (partly) stored in the legacy layout."""
+    document = chat.model_dump(
+        mode="json",
+        exclude={"messages": {"__all__": {"img_presigned_urls", "pdf_presigned_urls"}}},
+    )
+    # makes replaying appends idempotent, see APPEND_MESSAGES_SCRIPT
+    document["next_seq"] = len(chat.messages) if next_seq is None else next_seq
+    # lets search return hits without the messages
+    document["title"] = chat_title(chat.messages)
+    return document
+
+
+def _event(
+    event_type: SearchEventType,
+    chat_id: str,
+    chat_timestamp: float,
+    user_email: str,
+    payload: dict[str, Any] | None = None,
+) -> SearchOutboxEvent:
+    return SearchOutboxEvent(
+        shard=outbox_shard(chat_id),
+        event_id=outbox_event_id(),
+        event_type=event_type.value,
+        chat_id=chat_id,
+        chat_timestamp=chat_timestamp,
+        user_email=user_email,
+        payload=payload,
+        expires_at=timedelta(days=settings.SEARCH_OUTBOX_RETENTION_DAYS),
+    )
+
+
+def chat_created_event(chat: Chat) -> SearchOutboxEvent:
+    return _event(
+        SearchEventType.CHAT_CREATED,
+        chat.chat_id,
+        chat.timestamp,
+        chat.user_email,
+        {"document": search_document(chat)},
+    )
+
+
+def messages_appended_event(
+    chat_id: str,
+    chat_timestamp: float,
+    user_email: str,
+    messages: list[MessageCreate],
+    first_seq: int,
+) -> SearchOutboxEvent:
+    return _event(
+        SearchEventType.MESSAGES_APPENDED,
+        chat_id,
+        chat_timestamp,
+        user_email,
+        {
+            "messages": [
+                msg.model_dump(
+                    mode="json", exclude={"img_presigned_urls", "pdf_presigned_urls"}
+                )
+                for msg in messages
+            ],
+            "first_seq": first_seq,
+        },
+    )
+
+
+def chat_deleted_event(
+    chat_id: str, chat_timestamp: float, user_email: str
+) -> SearchOutboxEvent:
+    return _event(SearchEventType.CHAT_DELETED, chat_id, chat_timestamp, user_email)
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any
+
+from pynamodb.exceptions import UpdateError
+
+from gptbundle.common.config import settings
+
+from .exceptions import SearchIndexingError
+from .models import Chat as ChatModel
+from .models import SearchOutboxCheckpoint, SearchOutboxEvent
+from .outbox import SearchEventType, event_id_time, search_document
+from .repository import ChatRepository
+from .search_cache import SearchResultCache
+from .search_service import SearchBackendType, get_search_backend
+
+logger = logging.getLogger(__name__)
+
+# worth retrying, anything else in the 4xx range will fail again the same way
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 30.0
+# a held lease is renewed once less than this share of it is left
+LEASE_RENEW_MARGIN = 1 / 3
+
+
+class SearchOutboxConsumer:
+    """Applies the events of the search outbox to the search backend.
+
+    Each shard is leased by one consumer at a time and its checkpoint holds the
+    last applied event, so every app process can run a consumer and a restart
+    resumes where the previous owner stopped. Held leases are kept in memory
+    and only renewed when they near their expiry, the shards of other
+    consumers are tried once per lease interval. While the search backend is
+    unavailable the checkpoints simply do not move and chat writes are not
+    affected at all.
+    """
+
+    def __init__(
+        self,
+        search_backend: SearchBackendType | None = None,
+        search_cache: SearchResultCache | None = None,
+        chat_repo: ChatRepository | None = None,
+        shards: int | None = None,
+        batch_size: int | None = None,
+        poll_interval: float | None = None,
+        read_delay: float | None = None,
+    ):
+        self.search_backend = search_backend or get_search_backend()
+        self.search_cache = search_cache or SearchResultCache.shared()
+        self.chat_repo = chat_repo or ChatRepository()
+        self.shards = shards or settings.SEARCH_OUTBOX_SHARDS
+        self.batch_size = batch_size or settings.SEARCH_OUTBOX_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.SEARCH_OUTBOX_POLL_INTERVAL
+        self.read_delay = (
+            settings.SEARCH_OUTBOX_READ_DELAY if read_delay is None else read_delay
+        )
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._task: asyncio.Task | None = None
+        self._stop = asyncio.Event()
+        self._leases: dict[int, SearchOutboxCheckpoint] = {}
+        self._next_acquire_at: dict[int, float] = {}
+
+        self.applied_events = 0
+        self.skipped_events = 0
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        backoff = self.poll_interval
+        while not self._stop.is_set():
+            try:
+                applied = 0
+                for shard in range(self.shards):
+                    applied += await self.process_shard(shard)
+                backoff = self.poll_interval
+            except Exception:
+                logger.exception(
+                    f"Applying search outbox events failed, retrying in {backoff}s"
+                )
+                applied = 0
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            if not applied:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), backoff)
+                except TimeoutError:
+                    pass
+
+    async def process_shard(self, shard: int) -> int:
+        """Applies the next batch of events of a shard, returns how many events
+        were applied. Returns 0 when another consumer holds the shard."""
+        checkpoint = await self._lease(shard)
+        if checkpoint is None:
+            return 0
+        events = await asyncio.to_thread(
+            self._pending_events, shard, checkpoint.event_id
+        )
+        if not events:
+            return 0
+
+        await self._apply(events)
+        if await asyncio.to_thread(self._save_checkpoint, shard, events[-1].event_id):
+            checkpoint.event_id = events[-1].event_id
+        else:
+            # the lease expired while applying, the new owner applies them again
+            self._leases.pop(shard, None)
+        # what the searches of these users return has changed now
+        for user_email in {event.user_email for event in events}:
+            await self.search_cache.invalidate(user_email)
+        self.applied_events += len(events)
+        lag = time.time() - event_id_time(events[-1].event_id)
+        logger.debug(
+            f"Applied {len(events)} search outbox events of shard {shard}, "
+            f"lag {lag:.2f}s"
+        )
+        return len(events)
+
+    async def _apply(self, events: list[SearchOutboxEvent]) -> None:
+        # Events are applied in order. From the first event that failed on,
+        # everything is sent again, replaying the events that did succeed is
+        # harmless and keeps the events of a chat in order.
+        pending = list(events)
+        attempt = 1
+        while pending:
+            errors = await self.search_backend.apply_events(pending)
+            failed_at = None
+            for i, (event, error) in enumerate(zip(pending, errors, strict=True)):
+                if error is None or await self._handle_error(event, error):
+                    continue
+                failed_at = i
+                break
+            if failed_at is None:
+                return
+
+            event, error = pending[failed_at], errors[failed_at]
+            if attempt < settings.SEARCH_OUTBOX_MAX_ATTEMPTS:
+                pending = pending[failed_at:]
+                await asyncio.sleep(0.1 * 2**attempt)
+                attempt += 1
+                continue
+            if error.status in RETRYABLE_STATUSES:
+                # keep the checkpoint where it is, the loop backs off
+                raise error
+            self.skipped_events += 1
+            logger.error(
+                f"Skipping search outbox event {event.event_id} of chat "
+                f"{event.chat_id} after {attempt} attempts: {error}"
+            )
+            pending = pending[failed_at + 1 :]
+            attempt = 1
+
+    async def _handle_error(
+        self, event: SearchOutboxEvent, error: SearchIndexingError
+    ) -> bool:
+        """Resolves errors that are expected, returns True when resolved."""
+        if error.status != 404:
+            return False
+        if event.event_type == SearchEventType.CHAT_DELETED:
+            return True
+        # appending to a chat that never made it into the index, index it whole
+        document = await asyncio.to_thread(
+            self._current_document, event.chat_id, event.chat_timestamp
+        )
+        if document is None:
+            return True
+        try:
+            await self.search_backend.index_document(document)
+        except SearchIndexingError:
+            return False
+        return True
+
+    def _current_document(
+        self, chat_id: str, chat_timestamp: float
+    ) -> dict[str, Any] | None:
+        try:
+            chat_model = ChatModel.get(chat_id, chat_timestamp)
+        except ChatModel.DoesNotExist:
+            return None
+        return search_document(
+            self.chat_repo.chat_from_model(chat_model), chat_model.message_count
+        )
+
+    async def _lease(self, shard: int) -> SearchOutboxCheckpoint | None:
+        """The checkpoint of a shard leased to the consumer, None when another
+        consumer holds the shard."""
+        now = time.time()
+        lease_seconds = settings.SEARCH_OUTBOX_LEASE_SECONDS
+        checkpoint = self._leases.get(shard)
+        if checkpoint is not None:
+            if checkpoint.lease_expires_at - now > lease_seconds * LEASE_RENEW_MARGIN:
+                return checkpoint
+        elif now < self._next_acquire_at.get(shard, 0):
+            return None
+        checkpoint = await asyncio.to_thread(self._acquire_lease, shard)
+        if checkpoint is None:
+            self._leases.pop(shard, None)
+            self._next_acquire_at[shard] = now + lease_seconds
+        else:
+            self._leases[shard] = checkpoint
+        return checkpoint
+
+    def _acquire_lease(self, shard: int) -> SearchOutboxCheckpoint | None:
+        now = time.time()
+        checkpoint = SearchOutboxCheckpoint(shard)
+        try:
+            checkpoint.update(
+                actions=[
+                    SearchOutboxCheckpoint.owner.set(self.owner),
+                    SearchOutboxCheckpoint.lease_expires_at.set(
+                        now + settings.SEARCH_OUTBOX_LEASE_SECONDS
+                    ),
+                ],
+                condition=(
+                    SearchOutboxCheckpoint.owner.does_not_exist()
+                    | (SearchOutboxCheckpoint.owner == self.owner)
+                    | (SearchOutboxCheckpoint.lease_expires_at < now)
+                ),
+            )
+        except UpdateError as e:
+            if e.cause_response_code == "ConditionalCheckFailedException":
+                return None
+            raise
+        return checkpoint
+
+    def _pending_events(
+        self, shard: int, after_event_id: str | None
+    ) -> list[SearchOutboxEvent]:
+        cutoff = time.time() - self.read_delay
+        range_key_condition = (
+            SearchOutboxEvent.event_id > after_event_id if after_event_id else None
+        )
+        events = []
+        for event in SearchOutboxEvent.query(
+            shard, range_key_condition, limit=self.batch_size
+        ):
+            if event_id_time(event.event_id) > cutoff:
+                break
+            events.append(event)
+        return events
+
+    def _save_checkpoint(self, shard: int, event_id: str) -> bool:
+        """Moves the checkpoint, False when the lease was taken over."""
+        # only the lease owner may move the checkpoint
+        try:
+            SearchOutboxCheckpoint(shard).update(
+                actions=[SearchOutboxCheckpoint.event_id.set(event_id)],
+                condition=SearchOutboxCheckpoint.owner == self.owner,
+            )
+        except UpdateError as e:
+            if e.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
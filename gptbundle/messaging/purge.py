@@ -0,0 +1,28 @@
+import time
+from collections.abc import Iterable
+
+from .models import ChatMessage, ChatPurge, MessageItem
+
+
+def message_s3_keys(messages: Iterable[ChatMessage | MessageItem]) -> list[str]:
+    s3_keys = []
+    for message in messages:
+        s3_keys.extend(message.img_s3_keys or [])
+        s3_keys.extend(message.pdf_s3_keys or [])
+    return s3_keys
+
+
+def chat_purge(
+    chat_id: str, timestamp: float, user_email: str, s3_keys: list[str]
+) -> ChatPurge:
+    """The purge of a chat that is deleted. s3_keys are the attachments of its
+    legacy messages, which are gone together with the chat header."""
+    now = time.time()
+    return ChatPurge(
+        chat_id,
+        timestamp,
+        user_email=user_email,
+        requested_at=now,
+        s3_keys=s3_keys or None,
+        next_attempt_at=now,
+    )
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+
+from pynamodb.connection import Connection
+from pynamodb.exceptions import TransactWriteError, UpdateError
+from pynamodb.transactions import TransactWrite
+
+from gptbundle.common.config import settings
+from gptbundle.llm.chat_message_history_wrapper import get_chat_history
+from gptbundle.llm.rag_chain import delete_vector_store
+from gptbundle.media_storage.content import (
+    is_content_key,
+    release_references,
+    release_unreferenced,
+)
+from gptbundle.media_storage.images import variant_keys, with_variants
+from gptbundle.media_storage.pending import record_pending_uploads
+from gptbundle.media_storage.storage import AsyncS3Storage
+
+from .models import ChatMessage, ChatPurge, message_sort_key_prefix
+from .purge import message_s3_keys
+
+logger = logging.getLogger(__name__)
+
+_connection = Connection(
+    region=settings.AWS_REGION, host=settings.AWS_ENDPOINT_URL_DYNAMODB
+)
+
+
+def retry_delay(attempts: int) -> float:
+    return min(
+        settings.CHAT_PURGE_RETRY_DELAY * 2 ** max(attempts - 1, 0),
+        settings.CHAT_PURGE_MAX_RETRY_DELAY,
+    )
+
+
+class ChatPurgeWorker:
+    """Removes what is left of deleted chats: the message items, the
+    attachments, the vector store collection and the LLM history. The search
+    index document is deleted by the SearchOutboxConsumer, from the event
+    written together with the purge.
+
+    A purge is claimed by moving its next_attempt_at past a lease, so that the
+    purges of a worker that died are picked up by another one once the lease
+    ran out, and every app process can run a worker. Each step can run again,
+    a failed purge is retried later with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        storage: AsyncS3Storage | None = None,
+        interval: float | None = None,
+        batch_size: int | None = None,
+    ):
+        self.storage = storage or AsyncS3Storage.shared()
+        self.interval = interval or settings.CHAT_PURGE_INTERVAL
+        self.batch_size = batch_size or settings.CHAT_PURGE_BATCH_SIZE
+        self._task: asyncio.Task | None = None
+        self._stop = asyncio.Event()
+
+        self.purged_chats = 0
+        self.failed_purges = 0
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                while await self.purge_due() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Purging deleted chats failed")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except TimeoutError:
+                pass
+
+    async def purge_due(self) -> int:
+        """Purges a batch of deleted chats that are due, returns how many were
+        claimed."""
+        purges = await asyncio.to_thread(self._claim_due, time.time())
+        for purge in purges:
+            try:
+                await self.purge(purge)
+            except Exception as e:
+                self.failed_purges += 1
+                logger.exception(
+                    f"Purging chat {purge.chat_id} failed, attempt {purge.attempts}"
+                )
+                await asyncio.to_thread(self._retry_later, purge, e)
+        return len(purges)
+
+    async def purge(self, purge: ChatPurge) -> None:
+        chat_id = purge.chat_id
+        messages = await asyncio.to_thread(
+            self._query_messages, chat_id, purge.timestamp
+        )
+        # once the messages are gone only the purge knows their attachments
+        s3_keys = await asyncio.to_thread(self._record_s3_keys, purge, messages)
+
+        own_keys = [key for key in s3_keys if not is_content_key(key)]
+        failed = await self.storage.delete_objects(with_variants(own_keys))
+        # an image is retried together with its variants
+        failed_keys = [
+            key
+            for key in own_keys
+            if any(k in failed for k in (key, *variant_keys(key)))
+        ]
+        if failed_keys:
+            # retried by the pending upload sweeper on its next run
+            logger.warning(
+                f"Could not delete {len(failed_keys)} attachments of chat "
+                f"{chat_id}, leaving them to the pending upload sweeper"
+            )
+            expired = time.time() - settings.S3_PENDING_UPLOAD_TTL
+            await asyncio.to_thread(
+                record_pending_uploads, purge.user_email, failed_keys, expired
+            )
+        await asyncio.to_thread(self._delete_messages, messages)
+        # content addressed attachments may be shared with other chats, they
+        # are deleted by the pending upload sweeper once unreferenced
+        await asyncio.to_thread(release_unreferenced, purge.user_email, s3_keys)
+
+        await asyncio.to_thread(delete_vector_store, chat_id)
+        await asyncio.to_thread(get_chat_history(chat_id).clear)
+
+        await asyncio.to_thread(purge.delete)
+        self.purged_chats += 1
+        logger.debug(f"Purged chat: {chat_id} and timestamp: {purge.timestamp}")
+
+    def _claim_due(self, now: float) -> list[ChatPurge]:
+        due = ChatPurge.next_attempt_at <= now
+        purges = []
+        for purge in ChatPurge.scan(due):
+            try:
+                purge.update(
+                    actions=[
+                        ChatPurge.next_attempt_at.set(
+                            now + settings.CHAT_PURGE_LEASE_SECONDS
+                        ),
+                        ChatPurge.attempts.add(1),
+                    ],
+                    condition=due,
+                )
+            except UpdateError as e:
+                # claimed by another worker in the meantime
+                if e.cause_response_code == "ConditionalCheckFailedException":
+                    continue
+                raise
+            purges.append(purge)
+            if len(purges) == self.batch_size:
+                break
+        return purges
+
+    def _retry_later(self, purge: ChatPurge, error: Exception) -> None:
+        purge.update(
+            actions=[
+                ChatPurge.next_attempt_at.set(
+                    time.time() + retry_delay(purge.attempts)
+                ),
+                ChatPurge.last_error.set(f"{type(error).__name__}: {error}"[:1000]),
+            ]
+        )
+
+    def _query_messages(self, chat_id: str, timestamp: float) -> list[ChatMessage]:
+        return list(
+            ChatMessage.query(
+                chat_id,
+                ChatMessage.sort_key.startswith(message_sort_key_prefix(timestamp)),
+                attributes_to_get=["chat_id", "sort_key", "img_s3_keys", "pdf_s3_keys"],
+            )
+        )
+
+    def _record_s3_keys(
+        self, purge: ChatPurge, messages: list[ChatMessage]
+    ) -> list[str]:
+        s3_keys = set(purge.s3_keys or [])
+        found = set(message_s3_keys(messages)) - s3_keys
+        if found:
+            purge.update(actions=[ChatPurge.s3_keys.set(sorted(s3_keys | found))])
+        return sorted(s3_keys | found)
+
+    def _delete_messages(self, messages: list[ChatMessage]) -> None:
+        without_content = []
+        for message in messages:
+            content_keys = [
+                key for key in message_s3_keys([message]) if is_content_key(key)
+            ]
+            if not content_keys:
+                without_content.append(message)
+                continue
+            try:
+                with TransactWrite(connection=_connection) as transaction:
+                    transaction.delete(message, condition=ChatMessage.chat_id.exists())
+                    release_references(transaction, content_keys)
+            except TransactWriteError as e:
+                # deleted by an earlier attempt, its references are released
+                if not any(
+                    reason and reason.code == "ConditionalCheckFailed"
+                    for reason in e.cancellation_reasons or []
+                ):
+                    raise
+        with ChatMessage.batch_write() as batch:
+            for message in without_content:
+                batch.delete(message)
@@ -1,38 +1,224 @@
 import logging
-from typing import Any
+import threading
+from collections import OrderedDict
+from typing import Any, NamedTuple
 
-from pynamodb.exceptions import DeleteError, PutError
+from pynamodb.connection import Connection
+from pynamodb.exceptions import DeleteError, TransactWriteError
+from pynamodb.transactions import TransactWrite
 
-from .exceptions import ChatAlreadyExistsError
+from gptbundle.common.config import settings
+
+from .exceptions import ChatAlreadyExistsError, ChatVersionConflictError
 from .models import Chat as ChatModel
-from .schemas import Chat, ChatCreate, MessageCreate
+from .models import (
+    ChatMessage,
+    MessageItem,
+    message_sort_key,
+    message_sort_key_prefix,
+)
+from .outbox import chat_created_event, chat_deleted_event, messages_appended_event
+from .purge import chat_purge, message_s3_keys
+from .schemas import Chat, ChatCreate, ChatSummary, MessageCreate, chat_title
 
 logger = logging.getLogger(__name__)
 
+CHAT_WRITE_STATE_CACHE_SIZE = 10_000
+# DynamoDB transactions are limited to 100 items, the chat header and the
+# search outbox event take two of them. Chats are created with at most as many
+# messages as well.
+MAX_APPENDED_MESSAGES = 98
+
+
+def message_from_model(message: ChatMessage | MessageItem) -> MessageCreate:
+    return MessageCreate(
+        content=message.content,
+        role=message.role,
+        message_type=message.message_type,
+        img_s3_keys=message.img_s3_keys,
+        pdf_s3_keys=message.pdf_s3_keys,
+        llm_model=message.llm_model,
+        reasoning_effort=message.reasoning_effort,
+    )
+
+
+def message_to_model(
+    chat_id: str, timestamp: float, user_email: str, seq: int, msg: MessageCreate
+) -> ChatMessage:
+    return ChatMessage(
+        chat_id=chat_id,
+        sort_key=message_sort_key(timestamp, seq),
+        seq=seq,
+        user_email=user_email,
+        **msg.model_dump(exclude={"img_presigned_urls", "pdf_presigned_urls"}),
+    )
+
+
+def chat_summary_from_model(chat_model: ChatModel) -> ChatSummary:
+    return ChatSummary(
+        chat_id=chat_model.chat_id,
+        timestamp=chat_model.timestamp,
+        user_email=chat_model.user_email,
+        title=chat_model.title,
+        message_count=chat_model.message_count,
+        is_rag=chat_model.is_rag,
+        last_model=chat_model.last_model,
+    )
+
+
+# the pagination key of a page of the messages of a chat still stored in the
+# legacy layout, which come before its ChatMessage items
+LEGACY_PAGE_KEY = "legacy_offset"
+
+
+class LegacyMessagesPage(NamedTuple):
+    items: list[MessageCreate]
+    # set when the page is full before the ChatMessage items are reached
+    last_eval_key: dict[str, Any] | None
+    # what is left of the page for the ChatMessage items and where they start
+    limit: int | None
+    query_key: dict[str, Any] | None
+
+
+def legacy_messages_page(
+    chat_model: ChatModel,
+    limit: int | None = None,
+    last_evaluated_key: dict[str, Any] | None = None,
+) -> LegacyMessagesPage:
+    """Takes the legacy messages that belong on a page of the messages of a
+    chat, so chats that were not migrated page back with their history."""
+    if last_evaluated_key and LEGACY_PAGE_KEY not in last_evaluated_key:
+        return LegacyMessagesPage([], None, limit, last_evaluated_key)
+    offset = (
+        max(int(last_evaluated_key[LEGACY_PAGE_KEY]), 0) if last_evaluated_key else 0
+    )
+    legacy_messages = chat_model.messages or []
+    end = min(offset + limit, len(legacy_messages)) if limit else len(legacy_messages)
+    items = [message_from_model(msg) for msg in legacy_messages[offset:end]]
+    remaining = limit - len(items) if limit else None
+    if end < len(legacy_messages) or remaining == 0:
+        return LegacyMessagesPage(items, {LEGACY_PAGE_KEY: end}, 0, None)
+    return LegacyMessagesPage(items, None, remaining, None)
+
+
+def _condition_failed(e: TransactWriteError) -> bool:
+    return any(
+        reason and reason.code == "ConditionalCheckFailed"
+        for reason in e.cancellation_reasons
+    )
+
+
+class ChatWriteState(NamedTuple):
+    version: int | None
+    message_count: int
+
+
+class ChatWriteStateCache:
+    """Process wide LRU of the version and message_count last seen per chat.
+
+    Knowing both up front turns an append into one conditional transaction.
+    A stale entry is harmless: the version condition fails and the caller
+    gets a ChatVersionConflictError after the entry has been refreshed.
+    """
+
+    def __init__(self, max_size: int = CHAT_WRITE_STATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._states: OrderedDict[tuple[str, float], ChatWriteState] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: str, timestamp: float) -> ChatWriteState | None:
+        with self._lock:
+            state = self._states.get((chat_id, timestamp))
+            if state is not None:
+                self._states.move_to_end((chat_id, timestamp))
+            return state
+
+    def set(
+        self,
+        chat_id: str,
+        timestamp: float,
+        version: int | None,
+        message_count: int | None,
+    ) -> None:
+        with self._lock:
+            self._states[(chat_id, timestamp)] = ChatWriteState(
+                version, message_count or 0
+            )
+            self._states.move_to_end((chat_id, timestamp))
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+
+    def invalidate(self, chat_id: str, timestamp: float) -> None:
+        with self._lock:
+            self._states.pop((chat_id, timestamp), None)
+
+
+chat_write_states = ChatWriteStateCache()
+
 
 class ChatRepository:
+    _connection = Connection(
+        region=settings.AWS_REGION, host=settings.AWS_ENDPOINT_URL_DYNAMODB
+    )
+
     def create_chat(self, chat_in: ChatCreate) -> Chat:
-        messages_data = [msg.model_dump() for msg in chat_in.messages]
+        """Writes the chat header, its messages and the search outbox event as
+        one transaction."""
+        if len(chat_in.messages) > MAX_APPENDED_MESSAGES:
+            raise ValueError(
+                f"Chats can be created with at most {MAX_APPENDED_MESSAGES} messages"
+            )
         created_chat = ChatModel(
             chat_id=chat_in.chat_id,
             timestamp=chat_in.timestamp,
             user_email=chat_in.user_email,
             is_rag=any(msg.pdf_s3_keys for msg in chat_in.messages),
-            messages=messages_data,
+            message_count=len(chat_in.messages),
+            title=chat_title(chat_in.messages),
+            last_model=chat_in.messages[-1].llm_model if chat_in.messages else None,
+        )
+        chat = Chat(
+            chat_id=chat_in.chat_id,
+            timestamp=chat_in.timestamp,
+            user_email=chat_in.user_email,
+            is_rag=created_chat.is_rag,
+            messages=chat_in.messages,
         )
         try:
-            created_chat.save(condition=ChatModel.chat_id.does_not_exist())
-        except PutError as e:
-            raise ChatAlreadyExistsError(
-                f"Chat with id {chat_in.chat_id} already exists"
-            ) from e
+            with TransactWrite(connection=self._connection) as transaction:
+                transaction.save(
+                    created_chat, condition=ChatModel.chat_id.does_not_exist()
+                )
+                for seq, msg in enumerate(chat_in.messages):
+                    transaction.save(
+                        message_to_model(
+                            chat_in.chat_id,
+                            chat_in.timestamp,
+                            chat_in.user_email,
+                            seq,
+                            msg,
+                        )
+                    )
+                transaction.save(chat_created_event(chat))
+        except TransactWriteError as e:
+            if _condition_failed(e):
+                raise ChatAlreadyExistsError(
+                    f"Chat with id {chat_in.chat_id} already exists"
+                ) from e
+            raise
+        chat_write_states.set(
+            chat_in.chat_id,
+            chat_in.timestamp,
+            created_chat.version,
+            created_chat.message_count,
+        )
 
         logger.debug(
             f"Created chat for user: {chat_in.user_email} "
             f"with chat_id: {chat_in.chat_id} and "
             f"timestamp: {chat_in.timestamp}"
         )
-        return Chat.model_validate(created_chat)
+        return chat
 
     def get_chat(self, chat_id: str, timestamp: float, user_email: str) -> Chat | None:
         try:
@@ -44,19 +230,60 @@ class ChatRepository:
                     f"timestamp: {timestamp}"
                 )
                 return None
+            chat_write_states.set(
+                chat_id, timestamp, chat_model.version, chat_model.message_count
+            )
             logger.debug(
                 f"Retrieved chat for user: {user_email} "
                 f"with chat_id: {chat_id} and "
                 f"timestamp: {timestamp}"
             )
-            return self._create_chat_from_model(chat_model)
+            return self.chat_from_model(chat_model)
+        except ChatModel.DoesNotExist:
+            return None
+
+    def get_messages_paginated(
+        self,
+        chat_id: str,
+        timestamp: float,
+        user_email: str,
+        limit: int | None = None,
+        last_evaluated_key: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | None:
+        try:
+            chat_model = ChatModel.get(chat_id, timestamp)
         except ChatModel.DoesNotExist:
             return None
+        if chat_model.user_email != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized "
+                f"to retrieve messages of chat: {chat_id} and "
+                f"timestamp: {timestamp}"
+            )
+            return None
+
+        page = legacy_messages_page(chat_model, limit, last_evaluated_key)
+        if page.last_eval_key is not None:
+            return {"items": page.items, "last_eval_key": page.last_eval_key}
+
+        query_args: dict[str, Any] = {}
+        if page.limit:
+            query_args["limit"] = page.limit
+        if page.query_key:
+            query_args["last_evaluated_key"] = page.query_key
+        messages_iterator = self._query_messages(chat_id, timestamp, **query_args)
+        items = page.items + [message_from_model(msg) for msg in messages_iterator]
+
+        logger.debug(f"Retrieved paginated messages for chat: {chat_id}")
+        return {
+            "items": items,
+            "last_eval_key": messages_iterator.last_evaluated_key,
+        }
 
     def get_chats_by_user_email(self, user_email: str) -> list[Chat]:
         chats = ChatModel.user_email_index.query(user_email)
         logger.debug(f"Retrieved chats for user: {user_email}")
-        return [self._create_chat_from_model(chat) for chat in chats]
+        return [self.chat_from_model(chat) for chat in chats]
 
     def get_chats_by_user_email_paginated(
         self,
@@ -70,8 +297,8 @@ class ChatRepository:
         if last_evaluated_key:
             query_args["last_evaluated_key"] = last_evaluated_key
 
-        chats_iterator = ChatModel.user_email_index.query(user_email, **query_args)
-        items = [self._create_chat_from_model(chat) for chat in chats_iterator]
+        chats_iterator = ChatModel.summary_index.query(user_email, **query_args)
+        items = [chat_summary_from_model(chat) for chat in chats_iterator]
 
         logger.debug(f"Retrieved paginated chats for user: {user_email}")
         return {
@@ -86,27 +313,74 @@ class ChatRepository:
         messages: list[MessageCreate],
         user_email: str,
     ) -> bool:
+        """Writes the messages and the chat header update as one transaction,
+        conditioned on the owner and on the chat version. Raises
+        ChatVersionConflictError when the chat changed since its version was
+        read, the caller may simply retry."""
+        if len(messages) > MAX_APPENDED_MESSAGES:
+            raise ValueError(
+                f"At most {MAX_APPENDED_MESSAGES} messages can be appended at once"
+            )
+        state = chat_write_states.get(chat_id, timestamp)
+        if state is None:
+            state = self._read_write_state(chat_id, timestamp, user_email)
+            if state is None:
+                return False
+
+        chat_model = ChatModel(chat_id, timestamp)
+        # without a version, written before chats had one, the update is
+        # conditioned on the version not existing yet and sets it to 1
+        if state.version is not None:
+            chat_model.version = state.version
+        actions = [ChatModel.message_count.add(len(messages))]
+        if messages:
+            # the title is the preview of the very first message of the chat
+            actions.extend(
+                [
+                    ChatModel.title.set(ChatModel.title | chat_title(messages)),
+                    ChatModel.last_model.set(messages[-1].llm_model),
+                ]
+            )
+        if any(msg.pdf_s3_keys for msg in messages):
+            actions.append(ChatModel.is_rag.set(True))
         try:
-            chat_model = ChatModel.get(chat_id, timestamp)
-            if chat_model.user_email != user_email:
-                logger.info(
-                    f"User: {user_email} is not authorized to "
-                    f"append messages to chat: {chat_id} and "
-                    f"timestamp: {timestamp}"
+            with TransactWrite(connection=self._connection) as transaction:
+                transaction.update(
+                    chat_model,
+                    actions=actions,
+                    condition=ChatModel.user_email == user_email,
+                )
+                for seq, msg in enumerate(messages, start=state.message_count):
+                    transaction.save(
+                        message_to_model(chat_id, timestamp, user_email, seq, msg)
+                    )
+                transaction.save(
+                    messages_appended_event(
+                        chat_id, timestamp, user_email, messages, state.message_count
+                    )
                 )
+        except TransactWriteError as e:
+            chat_write_states.invalidate(chat_id, timestamp)
+            if not _condition_failed(e):
+                raise
+            if self._read_write_state(chat_id, timestamp, user_email) is None:
                 return False
-            chat_model.messages.extend([msg.model_dump() for msg in messages])
-            if any(msg.pdf_s3_keys for msg in messages):
-                chat_model.is_rag = True
-            chat_model.save()
-            logger.debug(
-                f"Appended messages to chat: {chat_id} and timestamp: {timestamp}"
-            )
-            return True
-        except ChatModel.DoesNotExist:
-            return False
+            raise ChatVersionConflictError(
+                f"Chat {chat_id} was modified concurrently"
+            ) from e
+
+        chat_write_states.set(
+            chat_id,
+            timestamp,
+            chat_model.version,
+            state.message_count + len(messages),
+        )
+        logger.debug(f"Appended messages to chat: {chat_id} and timestamp: {timestamp}")
+        return True
 
     def delete_chat(self, chat_id: str, timestamp: float, user_email: str) -> bool:
+        """Deletes the chat header, which makes the chat disappear, and leaves
+        the messages and everything else to the ChatPurgeWorker."""
         try:
             chat_model = ChatModel.get(chat_id, timestamp)
             if chat_model.user_email != user_email:
@@ -116,28 +390,127 @@ class ChatRepository:
                     f"timestamp: {timestamp}"
                 )
                 return False
-            chat_model.delete()
+            with TransactWrite(connection=self._connection) as transaction:
+                transaction.delete(
+                    chat_model,
+                    condition=ChatModel.chat_id.exists(),
+                    add_version_condition=False,
+                )
+                transaction.save(chat_deleted_event(chat_id, timestamp, user_email))
+                transaction.save(
+                    chat_purge(
+                        chat_id,
+                        timestamp,
+                        user_email,
+                        message_s3_keys(chat_model.messages or []),
+                    )
+                )
+            chat_write_states.invalidate(chat_id, timestamp)
             logger.debug(f"Deleted chat: {chat_id} and timestamp: {timestamp}")
             return True
-        except (ChatModel.DoesNotExist, DeleteError):
+        except (ChatModel.DoesNotExist, DeleteError, TransactWriteError):
             return False
 
-    def _create_chat_from_model(self, chat_model: ChatModel) -> Chat:
+    def migrate_legacy_chat(self, chat_model: ChatModel) -> int:
+        """Moves the messages of a chat stored in the legacy single item layout
+        into ChatMessage items. Returns the number of migrated messages."""
+        legacy_messages = chat_model.messages or []
+        # Messages appended after the deploy already live in their own items,
+        # starting at seq 0. Rewriting everything as legacy + appended with fresh
+        # sequence numbers overwrites every one of those keys.
+        appended_messages = [
+            message_from_model(msg)
+            for msg in self._query_messages(chat_model.chat_id, chat_model.timestamp)
+        ]
+        messages = [
+            message_from_model(msg) for msg in legacy_messages
+        ] + appended_messages
+        self._write_messages(
+            chat_model.chat_id,
+            chat_model.timestamp,
+            chat_model.user_email,
+            messages,
+            first_seq=0,
+        )
+        actions = [
+            ChatModel.message_count.set(len(messages)),
+            ChatModel.messages.remove(),
+        ]
+        if messages:
+            actions.extend(
+                [
+                    ChatModel.title.set(chat_title(messages)),
+                    ChatModel.last_model.set(messages[-1].llm_model),
+                ]
+            )
+        chat_model.update(
+            actions=actions,
+            condition=(
+                ChatModel.message_count.does_not_exist()
+                | (ChatModel.message_count == len(appended_messages))
+            ),
+        )
+        chat_write_states.invalidate(chat_model.chat_id, chat_model.timestamp)
+        logger.debug(
+            f"Migrated {len(legacy_messages)} legacy messages of chat: "
+            f"{chat_model.chat_id} and timestamp: {chat_model.timestamp}"
+        )
+        return len(legacy_messages)
+
+    def _read_write_state(
+        self, chat_id: str, timestamp: float, user_email: str
+    ) -> ChatWriteState | None:
+        try:
+            chat_model = ChatModel.get(
+                chat_id,
+                timestamp,
+                attributes_to_get=["user_email", "version", "message_count"],
+            )
+        except ChatModel.DoesNotExist:
+            chat_model = None
+        if chat_model is None or chat_model.user_email != user_email:
+            logger.info(
+                f"User: {user_email} is not authorized to "
+                f"append messages to chat: {chat_id} and "
+                f"timestamp: {timestamp} or the chat does not exist"
+            )
+            return None
+        chat_write_states.set(
+            chat_id, timestamp, chat_model.version, chat_model.message_count
+        )
+        return ChatWriteState(chat_model.version, chat_model.message_count or 0)
+
+    def _query_messages(self, chat_id: str, timestamp: float, **query_args: Any):
+        return ChatMessage.query(
+            chat_id,
+            ChatMessage.sort_key.startswith(message_sort_key_prefix(timestamp)),
+            **query_args,
+        )
+
+    def _write_messages(
+        self,
+        chat_id: str,
+        timestamp: float,
+        user_email: str,
+        messages: list[MessageCreate],
+        first_seq: int,
+    ) -> None:
+        if not messages:
+            return
+        with ChatMessage.batch_write() as batch:
+            for seq, msg in enumerate(messages, start=first_seq):
+                batch.save(message_to_model(chat_id, timestamp, user_email, seq, msg))
+
+    def chat_from_model(self, chat_model: ChatModel) -> Chat:
+        messages = [message_from_model(msg) for msg in chat_model.messages or []]
+        messages.extend(
+            message_from_model(msg)
+            for msg in self._query_messages(chat_model.chat_id, chat_model.timestamp)
+        )
         return Chat(
             chat_id=chat_model.chat_id,
             timestamp=chat_model.timestamp,
             user_email=chat_model.user_email,
             is_rag=chat_model.is_rag,
-            messages=[
-                MessageCreate(
-                    content=msg.content,
-                    role=msg.role,
-                    message_type=msg.message_type,
-                    img_s3_keys=msg.img_s3_keys,
-                    pdf_s3_keys=msg.pdf_s3_keys,
-                    llm_model=msg.llm_model,
-                    reasoning_effort=msg.reasoning_effort,
-                )
-                for msg in chat_model.messages
-            ],
+            messages=messages,
         )
@@ -5,31 +5,57 @@ from typing import Annotated, Any
 from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket
 from starlette.websockets import WebSocketDisconnect
 
+from gptbundle.common.config import settings
 from gptbundle.llm.chat_factory import msg_schema_to_lc_base_message
 from gptbundle.llm.chat_message_history_wrapper import get_chat_history
 from gptbundle.llm.service import generate_image_response
-from gptbundle.security.service import get_current_user
+from gptbundle.security.service import get_current_user, is_admin
 
+from .async_repository import AsyncChatRepository
 from .elasticsearch_repository import ElasticsearchRepository
-from .exceptions import ChatAlreadyExistsError
+from .exceptions import (
+    AttachmentAccessError,
+    AttachmentPromotionError,
+    ChatAlreadyExistsError,
+)
 from .repository import ChatRepository
 from .schemas import (
+    AutocompleteResponse,
+    BulkIndexerMetrics,
     Chat,
     ChatCreate,
-    ChatPaginatedResponse,
+    ChatSearchHit,
+    ChatSummaryPaginatedResponse,
     MessageCreate,
+    MessagePaginatedResponse,
+    MessageSearchResponse,
+    MessageSearchSort,
+    PresignedUrlsRequest,
+    PresignedUrlsResponse,
+    SearchCacheMetrics,
     WebSocketMessage,
     WebSocketMessageType,
 )
-from .search_service import search_chats_by_keyword
+from .search_cache import SearchResultCache
+from .search_service import (
+    SearchBackendType,
+    autocomplete_chats,
+    get_search_backend,
+    search_chats_by_keyword,
+    search_messages_by_keyword,
+)
 from .service import (
+    ChatRepositoryType,
     append_messages,
     create_chat,
     delete_chat,
     get_chat,
     get_chats_by_user_email_paginated,
+    get_messages_paginated,
+    presign_chat_attachments,
 )
 from .websocket_service import (
+    finish_attachments,
     process_attachments,
     save_user_message,
     stream_ai_response,
@@ -40,10 +66,15 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-ChatRepositoryDep = Annotated[ChatRepository, Depends(ChatRepository)]
-ElasticsearchRepositoryDep = Annotated[
-    ElasticsearchRepository, Depends(ElasticsearchRepository)
-]
+
+def get_chat_repository() -> ChatRepositoryType:
+    if settings.DYNAMODB_ASYNC_CLIENT:
+        return AsyncChatRepository()
+    return ChatRepository()
+
+
+ChatRepositoryDep = Annotated[ChatRepositoryType, Depends(get_chat_repository)]
+SearchBackendDep = Annotated[SearchBackendType, Depends(get_search_backend)]
 UserEmailDep = Annotated[str, Depends(get_current_user)]
 
 
@@ -60,6 +91,11 @@ async def retrieve_chat(
     chat_id: str,
     timestamp: float,
     user_email: UserEmailDep,
+    presign: bool = Query(
+        True,
+        description="Presign the image URLs, false returns the S3 keys only. "
+        "URLs can be fetched later with POST .../presigned_urls",
+    ),
 ) -> Any:
     logger.info(f"Received GET Request for chat: {chat_id} and timestamp: {timestamp}")
     if not user_email:
@@ -68,7 +104,11 @@ async def retrieve_chat(
             detail="User not authenticated",
         )
     chat = await get_chat(
-        chat_repo=chat_repo, chat_id=chat_id, timestamp=timestamp, user_email=user_email
+        chat_repo=chat_repo,
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        presign=presign,
     )
     if not chat:
         raise HTTPException(
@@ -84,9 +124,112 @@ async def retrieve_chat(
     return chat
 
 
+@router.get(
+    "/chat/{chat_id}/{timestamp}/messages",
+    response_model=MessagePaginatedResponse,
+    responses={
+        404: {"description": "Chat not found"},
+        401: {"description": "User not authenticated"},
+    },
+)
+async def retrieve_chat_messages(
+    chat_repo: ChatRepositoryDep,
+    chat_id: str,
+    timestamp: float,
+    user_email: UserEmailDep,
+    limit: int | None = Query(
+        None, description="Limit the number of messages returned"
+    ),
+    last_eval_key: str | None = Query(
+        None, description="The last evaluated key for pagination (JSON string)"
+    ),
+    presign: bool = Query(
+        True, description="Presign the image URLs, false returns the S3 keys only"
+    ),
+) -> Any:
+    logger.info(
+        f"Received GET Request for messages of chat: {chat_id} "
+        f"and timestamp: {timestamp}"
+    )
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+
+    evaluated_key = None
+    if last_eval_key:
+        try:
+            evaluated_key = json.loads(last_eval_key)
+        except json.JSONDecodeError as e:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid last_eval_key format. Expected JSON string.",
+            ) from e
+
+    messages_response = await get_messages_paginated(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        chat_repo=chat_repo,
+        user_email=user_email,
+        limit=limit,
+        last_evaluated_key=evaluated_key,
+        presign=presign,
+    )
+    if messages_response is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Chat not found",
+        )
+    return messages_response
+
+
+@router.post(
+    "/chat/{chat_id}/{timestamp}/presigned_urls",
+    response_model=PresignedUrlsResponse,
+    responses={
+        403: {"description": "Keys are not attachments of the chat"},
+        404: {"description": "Chat not found"},
+        401: {"description": "User not authenticated"},
+    },
+)
+async def presign_attachments(
+    chat_repo: ChatRepositoryDep,
+    chat_id: str,
+    timestamp: float,
+    request: PresignedUrlsRequest,
+    user_email: UserEmailDep,
+) -> Any:
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+    try:
+        presigned = await presign_chat_attachments(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            keys=request.keys,
+            chat_repo=chat_repo,
+            user_email=user_email,
+            variant=request.variant,
+        )
+    except AttachmentAccessError as e:
+        raise HTTPException(
+            status_code=403,
+            detail="Keys are not attachments of the chat",
+        ) from e
+    if presigned is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Chat not found",
+        )
+    return presigned
+
+
 @router.get(
     "/chats",
-    response_model=ChatPaginatedResponse,
+    response_model=ChatSummaryPaginatedResponse,
     responses={
         404: {"description": "Chats not found"},
         401: {"description": "User not authenticated"},
@@ -140,7 +283,6 @@ async def retrieve_chats(
 )
 async def remove_chat(
     chat_repo: ChatRepositoryDep,
-    es_repo: ElasticsearchRepositoryDep,
     chat_id: str,
     timestamp: float,
     user_email: UserEmailDep,
@@ -158,7 +300,6 @@ async def remove_chat(
         chat_id=chat_id,
         timestamp=timestamp,
         user_email=user_email,
-        es_repo=es_repo,
     )
     if not deleted:
         raise HTTPException(
@@ -169,16 +310,20 @@ async def remove_chat(
 
 @router.get(
     "/search_chats",
-    response_model=list[Chat],
+    response_model=list[Chat] | list[ChatSearchHit],
     responses={
         404: {"description": "Chats not found"},
         401: {"description": "User not authenticated"},
     },
 )
 async def search_chats(
-    es_repo: ElasticsearchRepositoryDep,
+    search_backend: SearchBackendDep,
     user_email: UserEmailDep,
     search_term: str,
+    size: int = Query(20, ge=1, le=100, description="Number of chats returned"),
+    hydrate: bool = Query(
+        False, description="Return whole chats instead of compact hits"
+    ),
 ) -> Any:
     logger.info(
         f"Received GET Request for search_chats for user: {user_email} "
@@ -191,7 +336,11 @@ async def search_chats(
         )
 
     chats = await search_chats_by_keyword(
-        es_repo=es_repo, user_email=user_email, search_term=search_term
+        search_backend=search_backend,
+        user_email=user_email,
+        search_term=search_term,
+        size=size,
+        hydrate=hydrate,
     )
     if not chats:
         raise HTTPException(
@@ -201,6 +350,124 @@ async def search_chats(
     return chats
 
 
+@router.get(
+    "/search_messages",
+    response_model=MessageSearchResponse,
+    responses={
+        400: {"description": "Invalid search_after"},
+        401: {"description": "User not authenticated"},
+    },
+)
+async def search_messages(
+    search_backend: SearchBackendDep,
+    user_email: UserEmailDep,
+    search_term: str,
+    sort: MessageSearchSort = MessageSearchSort.RELEVANCE,
+    size: int = Query(20, ge=1, le=100, description="Number of hits per page"),
+    search_after: str | None = Query(
+        None, description="search_after of the previous page (JSON string)"
+    ),
+) -> Any:
+    logger.info(
+        f"Received GET Request for search_messages for user: {user_email} "
+        f"and search_term: {search_term}"
+    )
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+
+    after = None
+    if search_after:
+        try:
+            after = json.loads(search_after)
+        except json.JSONDecodeError as e:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid search_after format. Expected JSON string.",
+            ) from e
+        if not isinstance(after, list):
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid search_after format. Expected JSON list.",
+            )
+
+    return await search_messages_by_keyword(
+        search_backend=search_backend,
+        user_email=user_email,
+        search_term=search_term,
+        size=size,
+        search_after=after,
+        sort=sort,
+    )
+
+
+@router.get(
+    "/autocomplete",
+    response_model=AutocompleteResponse,
+    response_model_exclude_defaults=True,
+    responses={401: {"description": "User not authenticated"}},
+)
+async def autocomplete(
+    search_backend: SearchBackendDep,
+    user_email: UserEmailDep,
+    prefix: str = Query(..., min_length=1, max_length=100),
+    size: int = Query(8, ge=1, le=20, description="Number of suggestions"),
+) -> Any:
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+    return await autocomplete_chats(
+        search_backend=search_backend,
+        user_email=user_email,
+        prefix=prefix,
+        size=size,
+    )
+
+
+@router.get(
+    "/search_indexer_metrics",
+    response_model=BulkIndexerMetrics,
+    responses={
+        401: {"description": "User not authenticated"},
+        403: {"description": "User is not an admin"},
+    },
+)
+async def search_indexer_metrics(user_email: UserEmailDep) -> Any:
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+    # process wide, they tell about the load of every user
+    if not is_admin(user_email):
+        raise HTTPException(status_code=403, detail="Admins only")
+    return ElasticsearchRepository.bulk_indexer_metrics()
+
+
+@router.get(
+    "/search_cache_metrics",
+    response_model=SearchCacheMetrics,
+    responses={
+        401: {"description": "User not authenticated"},
+        403: {"description": "User is not an admin"},
+    },
+)
+async def search_cache_metrics(user_email: UserEmailDep) -> Any:
+    if not user_email:
+        raise HTTPException(
+            status_code=401,
+            detail="User not authenticated",
+        )
+    # process wide, they tell about the load of every user
+    if not is_admin(user_email):
+        raise HTTPException(status_code=403, detail="Admins only")
+    return SearchResultCache.shared().metrics()
+
+
 @router.post(
     "/image_generation",
     response_model=MessageCreate,
@@ -214,7 +481,6 @@ async def generate_image(
     user_email: UserEmailDep,
     user_message: MessageCreate,
     chat_repo: ChatRepositoryDep,
-    es_repo: ElasticsearchRepositoryDep,
 ) -> Any:
     logger.info(
         f"Received POST Request for image generation for "
@@ -236,7 +502,6 @@ async def generate_image(
                 timestamp=chat_timestamp,
             ),
             chat_repo=chat_repo,
-            es_repo=es_repo,
         )
         await append_messages(
             chat_id=chat.chat_id,
@@ -244,7 +509,6 @@ async def generate_image(
             messages=[response_message],
             chat_repo=chat_repo,
             user_email=user_email,
-            es_repo=es_repo,
         )
     except ChatAlreadyExistsError as e:
         logger.debug(f"Chat existed already: {e}")
@@ -254,7 +518,6 @@ async def generate_image(
             messages=[user_message, response_message],
             chat_repo=chat_repo,
             user_email=user_email,
-            es_repo=es_repo,
         )
     except Exception as e:
         logger.error(f"Error creating chat: {e}")
@@ -269,7 +532,6 @@ async def generate_image(
 async def websocket_text_generation_endpoint(
     websocket: WebSocket,
     chat_repo: ChatRepositoryDep,
-    es_repo: ElasticsearchRepositoryDep,
     user_email: UserEmailDep,
 ):
     """This websocket endpoint handles the text generation for a chat."""
@@ -316,7 +578,21 @@ async def websocket_text_generation_endpoint(
                 )
                 continue
 
-            await process_attachments(user_message=user_message, chat_id=active_chat_id)
+            try:
+                await process_attachments(
+                    user_message=user_message,
+                    chat_id=active_chat_id,
+                    user_email=user_email,
+                )
+            except AttachmentPromotionError:
+                await websocket.send_json(
+                    WebSocketMessage(
+                        type=WebSocketMessageType.ERROR,
+                        content="Your attachments could not be saved, "
+                        "please try again.",
+                    ).model_dump()
+                )
+                continue
 
             message_saved = await save_user_message(
                 user_email=user_email,
@@ -324,7 +600,11 @@ async def websocket_text_generation_endpoint(
                 active_chat_id=active_chat_id,
                 active_timestamp=active_timestamp,
                 chat_repo=chat_repo,
-                es_repo=es_repo,
+            )
+            await finish_attachments(
+                user_message=user_message,
+                user_email=user_email,
+                message_saved=message_saved,
             )
 
             if not message_saved:
@@ -348,7 +628,6 @@ async def websocket_text_generation_endpoint(
                 active_timestamp=active_timestamp,
                 user_email=user_email,
                 chat_repo=chat_repo,
-                es_repo=es_repo,
                 is_rag_chat=is_rag,
             )
 
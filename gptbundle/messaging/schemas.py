@@ -1,7 +1,11 @@
-from enum import Enum
+from enum import Enum, StrEnum
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from gptbundle.media_storage.images import ImageVariant
+
+CHAT_TITLE_MAX_LENGTH = 100
+
 
 class MessageRole(str, Enum):
     USER = "user"
@@ -43,11 +47,110 @@ class Chat(ChatCreate):
     model_config = ConfigDict(from_attributes=True)
 
 
-class ChatPaginatedResponse(BaseModel):
-    items: list[Chat]
+def chat_title(messages: list[MessageCreate]) -> str | None:
+    if not messages:
+        return None
+    return messages[0].content[:CHAT_TITLE_MAX_LENGTH]
+
+
+class ChatSummary(BaseModel):
+    chat_id: str
+    timestamp: float
+    user_email: str
+    title: str | None = None
+    message_count: int = 0
+    is_rag: bool = False
+    last_model: str | None = None
+
+
+class ChatSummaryPaginatedResponse(BaseModel):
+    items: list[ChatSummary]
     last_eval_key: dict | None = None
 
 
+class MessagePaginatedResponse(BaseModel):
+    items: list[MessageCreate]
+    last_eval_key: dict | None = None
+
+
+class PresignedUrlsRequest(BaseModel):
+    keys: list[str] = Field(min_length=1, max_length=100)
+    # images stored before variants existed, and PDFs, are always the original
+    variant: ImageVariant = ImageVariant.PREVIEW
+
+
+class PresignedUrlsResponse(BaseModel):
+    urls: dict[str, str]
+    # every URL stays valid at least this long, refresh them before
+    min_valid_seconds: int
+
+
+class BulkIndexerMetrics(BaseModel):
+    running: bool
+    queue_depth: int = 0
+    flushes: int = 0
+    flushed_actions: int = 0
+    failed_actions: int = 0
+    last_flush_latency_ms: float = 0
+    avg_flush_latency_ms: float = 0
+    max_flush_latency_ms: float = 0
+
+
+class AutocompleteSuggestion(BaseModel):
+    chat_id: str
+    chat_timestamp: float
+    title: str | None = None
+    # set when the prefix matched a message rather than the title
+    snippet: str | None = None
+    seq: int | None = None
+
+
+class AutocompleteResponse(BaseModel):
+    items: list[AutocompleteSuggestion]
+    # a newer query of the same user replaced this one before it ran
+    superseded: bool = False
+    # the latency budget ran out, items may be incomplete
+    timed_out: bool = False
+
+
+class SearchCacheMetrics(BaseModel):
+    enabled: bool
+    backend: str
+    entries: int = 0
+    hits: int = 0
+    misses: int = 0
+    hit_ratio: float = 0
+    invalidations: int = 0
+
+
+class ChatSearchHit(BaseModel):
+    chat_id: str
+    timestamp: float
+    title: str | None = None
+    is_rag: bool = False
+    snippet: str | None = None
+    score: float | None = None
+
+
+class MessageSearchSort(StrEnum):
+    RELEVANCE = "relevance"
+    RECENT = "recent"
+
+
+class MessageSearchHit(BaseModel):
+    chat_id: str
+    chat_timestamp: float
+    seq: int
+    role: MessageRole
+    snippets: list[str] = Field(default_factory=list)
+    score: float | None = None
+
+
+class MessageSearchResponse(BaseModel):
+    items: list[MessageSearchHit]
+    search_after: list | None = None
+
+
 class WebSocketMessage(BaseModel):
     type: WebSocketMessageType
     chat_id: str | None = None
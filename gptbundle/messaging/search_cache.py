@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from pydantic import TypeAdapter
+from redis import RedisError
+from redis.asyncio import Redis
+
+from gptbundle.common.config import settings
+
+from .schemas import SearchCacheMetrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+REDIS_PREFIX = "search-cache"
+
+
+def default_settle_seconds() -> float:
+    # the outbox consumer leaves events this young for its next poll, a change
+    # reaches the index only after that, and is searchable after a refresh
+    return (
+        settings.SEARCH_OUTBOX_READ_DELAY
+        + settings.SEARCH_OUTBOX_POLL_INTERVAL
+        + settings.SEARCH_CACHE_SETTLE_SECONDS
+    )
+
+
+class SearchResultCache:
+    """LRU cache of search results, keyed by user, query and page.
+
+    Every user has a generation counter that chat writes and the outbox
+    consumer bump, the generation is part of the key, so results cached before
+    a change are never returned after it. A change only becomes searchable once
+    the index refreshed, results of searches started within settle_seconds of
+    the last change are therefore returned but not cached.
+
+    With a Redis client the generations live in Redis, so a write handled by
+    one process invalidates the caches of all of them, and results are shared
+    through Redis behind the in-process LRU. Redis failures never fail a
+    search, the search backend is asked instead.
+    """
+
+    _shared: "SearchResultCache | None" = None
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl: float | None = None,
+        settle_seconds: float | None = None,
+        redis: Redis | None = None,
+        enabled: bool | None = None,
+    ):
+        self.max_entries = max_entries or settings.SEARCH_CACHE_MAX_ENTRIES
+        self.ttl = ttl or settings.SEARCH_CACHE_TTL
+        self.settle_seconds = (
+            default_settle_seconds() if settle_seconds is None else settle_seconds
+        )
+        self.redis = redis
+        self.enabled = settings.SEARCH_CACHE_ENABLED if enabled is None else enabled
+        # key -> (expires_at, value)
+        self._entries: OrderedDict[tuple[str, int, str], tuple[float, Any]] = (
+            OrderedDict()
+        )
+        # user_email -> (generation, changed_at)
+        self._generations: dict[str, tuple[int, float]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def shared(cls) -> "SearchResultCache":
+        if cls._shared is None:
+            redis = None
+            if settings.SEARCH_CACHE_REDIS:
+                redis = Redis.from_url(settings.REDIS_URL)
+            cls._shared = cls(redis=redis)
+        return cls._shared
+
+    @classmethod
+    async def close_shared(cls) -> None:
+        if cls._shared is not None:
+            cache, cls._shared = cls._shared, None
+            if cache.redis is not None:
+                await cache.redis.aclose()
+
+    def metrics(self) -> SearchCacheMetrics:
+        lookups = self.hits + self.misses
+        return SearchCacheMetrics(
+            enabled=self.enabled,
+            backend="redis" if self.redis is not None else "memory",
+            entries=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hits / lookups if lookups else 0,
+            invalidations=self.invalidations,
+        )
+
+    async def invalidate(self, user_email: str) -> None:
+        """Bumps the generation of a user, called whenever what a search of
+        the user returns may have changed."""
+        if not self.enabled:
+            return
+        self.invalidations += 1
+        now = time.time()
+        generation, _ = self._generations.get(user_email, (0, 0.0))
+        self._generations[user_email] = (generation + 1, now)
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hincrby(self._generation_key(user_email), "generation", 1)
+                pipe.hset(self._generation_key(user_email), "changed_at", now)
+                await pipe.execute()
+        except RedisError:
+            logger.exception(f"Could not invalidate the search cache of {user_email}")
+
+    async def get_or_search(
+        self,
+        user_email: str,
+        key: dict[str, Any],
+        search: Callable[[], Awaitable[T]],
+        adapter: TypeAdapter[T],
+        cacheable: Callable[[T], bool] | None = None,
+    ) -> T:
+        """Returns the cached result for the user and key, or runs search and
+        caches its result unless cacheable rejects it. adapter (de)serializes
+        the result for Redis."""
+        if not self.enabled:
+            return await search()
+        state = await self._generation(user_email)
+        if state is None:
+            return await search()
+        generation, changed_at = state
+        cache_key = (user_email, generation, json.dumps(key, sort_keys=True))
+
+        value = self._get_local(cache_key)
+        if value is None and self.redis is not None:
+            value = await self._get_redis(cache_key, adapter)
+            if value is not None:
+                self._set_local(cache_key, value)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        started_at = time.time()
+        value = await search()
+        if started_at >= changed_at + self.settle_seconds and (
+            cacheable is None or cacheable(value)
+        ):
+            self._set_local(cache_key, value)
+            if self.redis is not None:
+                await self._set_redis(cache_key, value, adapter)
+        return value
+
+    async def _generation(self, user_email: str) -> tuple[int, float] | None:
+        if self.redis is None:
+            return self._generations.get(user_email, (0, 0.0))
+        try:
+            generation, changed_at = await self.redis.hmget(
+                self._generation_key(user_email), ["generation", "changed_at"]
+            )
+        except RedisError:
+            logger.warning("Search cache unavailable, searching without it")
+            return None
+        return int(generation or 0), float(changed_at or 0)
+
+    def _get_local(self, cache_key: tuple[str, int, str]) -> Any:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[cache_key]
+            return None
+        self._entries.move_to_end(cache_key)
+        return value
+
+    def _set_local(self, cache_key: tuple[str, int, str], value: Any) -> None:
+        self._entries[cache_key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_redis(
+        self, cache_key: tuple[str, int, str], adapter: TypeAdapter[T]
+    ) -> T | None:
+        try:
+            data = await self.redis.get(self._result_key(cache_key))
+        except RedisError:
+            logger.warning("Search cache unavailable, searching without it")
+            return None
+        return None if data is None else adapter.validate_json(data)
+
+    async def _set_redis(
+        self, cache_key: tuple[str, int, str], value: T, adapter: TypeAdapter[T]
+    ) -> None:
+        try:
+            await self.redis.set(
+                self._result_key(cache_key),
+                adapter.dump_json(value),
+                px=int(self.ttl * 1000),
+            )
+        except RedisError:
+            logger.warning("Could not store a search result in the search cache")
+
+    def _generation_key(self, user_email: str) -> str:
+        return f"{REDIS_PREFIX}:generation:{user_email}"
+
+    def _result_key(self, cache_key: tuple[str, int, str]) -> str:
+        user_email, generation, key = cache_key
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return f"{REDIS_PREFIX}:result:{user_email}:{generation}:{digest}"
@@ -0,0 +1,347 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from elasticsearch import AsyncElasticsearch
+from pynamodb.exceptions import UpdateError
+
+from gptbundle.common.dynamodb import AsyncDynamoDBClient
+
+from .async_repository import CHAT_TABLE, AsyncChatRepository
+from .elasticsearch_indexer import BulkOperation, bulk_item_result, bulk_operations
+from .elasticsearch_repository import (
+    CHATS_ALIAS,
+    INDEX_ALIASES,
+    MESSAGES_ALIAS,
+    alias_settings,
+    document_messages_operations,
+    index_body,
+    index_chat_operation,
+    put_index_templates,
+    versioned_index_name,
+)
+from .exceptions import SearchIndexingError
+from .models import Chat as ChatModel
+from .models import SearchOutboxCheckpoint
+from .outbox import search_document
+from .outbox_consumer import RETRYABLE_STATUSES
+from .sqlite_search import SQLiteSearchBackend
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_ATTEMPTS = 5
+
+
+@dataclass
+class ReindexResult:
+    # alias -> the index built for it
+    indices: dict[str, str]
+    documents: int = 0
+    failed: int = 0
+    swapped: bool = False
+    previous_indices: list[str] = field(default_factory=list)
+
+
+class _ChatTableReindexer(ABC):
+    """Reads the Chat table with a segmented parallel scan and hands the
+    search documents of its chats to _index_documents, page by page. Writes
+    that happened while the reindex ran are replayed from the search outbox
+    afterwards, the outbox events are idempotent so replaying some twice is
+    harmless.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client: AsyncDynamoDBClient,
+        segments: int = 8,
+        concurrency: int = 4,
+        batch_size: int = 500,
+        on_progress: Callable[[int], None] | None = None,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.chat_repo = AsyncChatRepository(dynamodb_client)
+        self.segments = segments
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+
+    async def estimated_chats(self) -> int:
+        # refreshed by DynamoDB about every six hours, good enough for progress
+        response = await self.dynamodb_client.request(
+            "DescribeTable", {"TableName": CHAT_TABLE}
+        )
+        return response["Table"].get("ItemCount", 0)
+
+    async def _index_chats(self, result: ReindexResult) -> None:
+        pages: asyncio.Queue[list[dict[str, Any]] | None] = asyncio.Queue(
+            maxsize=self.concurrency * 2
+        )
+        async with asyncio.TaskGroup() as tasks:
+            workers = [
+                tasks.create_task(self._index_pages(pages, result))
+                for _ in range(self.concurrency)
+            ]
+            await asyncio.gather(
+                *(
+                    tasks.create_task(self._scan_segment(segment, pages))
+                    for segment in range(self.segments)
+                )
+            )
+            for _ in workers:
+                await pages.put(None)
+
+    async def _scan_segment(
+        self, segment: int, pages: asyncio.Queue[list[dict[str, Any]] | None]
+    ) -> None:
+        scan: dict[str, Any] = {
+            "TableName": CHAT_TABLE,
+            "Segment": segment,
+            "TotalSegments": self.segments,
+            "Limit": self.batch_size,
+        }
+        while True:
+            response = await self.dynamodb_client.request("Scan", scan)
+            if response.get("Items"):
+                # blocks while the index workers are behind
+                await pages.put(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return
+            scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def _index_pages(
+        self,
+        pages: asyncio.Queue[list[dict[str, Any]] | None],
+        result: ReindexResult,
+    ) -> None:
+        while (items := await pages.get()) is not None:
+            documents = await asyncio.gather(
+                *(self._document(ChatModel.from_raw_data(item)) for item in items)
+            )
+            failed = await self._index_documents(documents, result)
+            result.documents += len(documents) - failed
+            result.failed += failed
+            if self.on_progress is not None:
+                self.on_progress(len(documents))
+
+    async def _document(self, chat_model: ChatModel) -> dict[str, Any]:
+        chat = await self.chat_repo.chat_from_model(chat_model)
+        # Appends are numbered by the ChatMessage items only, legacy messages
+        # of the header are not. Counting the items that were read, instead of
+        # taking message_count of the scanned header, also covers messages
+        # appended in between.
+        legacy_messages = len(chat_model.messages or [])
+        return search_document(chat, len(chat.messages) - legacy_messages)
+
+    @abstractmethod
+    async def _index_documents(
+        self, documents: list[dict[str, Any]], result: ReindexResult
+    ) -> int:
+        """Indexes the documents of a page, returns how many failed."""
+
+    def _rewind_outbox(self, started_at: float) -> None:
+        # Everything written after the scan started may be missing from the
+        # new index. Moving the checkpoints back makes the consumers replay
+        # it, the events are idempotent. The owner is cleared so a consumer in
+        # the middle of a batch cannot move its checkpoint past the rewind.
+        rewind_to = f"{int(started_at * 1e9):020d}"
+        for checkpoint in SearchOutboxCheckpoint.scan():
+            try:
+                checkpoint.update(
+                    actions=[
+                        SearchOutboxCheckpoint.event_id.set(rewind_to),
+                        SearchOutboxCheckpoint.owner.remove(),
+                    ],
+                    condition=SearchOutboxCheckpoint.event_id > rewind_to,
+                )
+            except UpdateError as e:
+                if e.cause_response_code != "ConditionalCheckFailedException":
+                    raise
+
+
+class SearchReindexer(_ChatTableReindexer):
+    """Rebuilds the Elasticsearch indices from DynamoDB without downtime.
+
+    The chats and their messages are bulk indexed into fresh indices (no
+    refresh, no replicas while loading) and the aliases are then switched
+    over in one atomic call.
+    """
+
+    def __init__(
+        self,
+        es_client: AsyncElasticsearch,
+        dynamodb_client: AsyncDynamoDBClient,
+        segments: int = 8,
+        concurrency: int = 4,
+        batch_size: int = 500,
+        on_progress: Callable[[int], None] | None = None,
+    ):
+        super().__init__(
+            dynamodb_client,
+            segments=segments,
+            concurrency=concurrency,
+            batch_size=batch_size,
+            on_progress=on_progress,
+        )
+        self.es_client = es_client
+
+    async def run(self) -> ReindexResult:
+        started_at = time.time()
+        result = ReindexResult(
+            indices={alias: versioned_index_name(alias) for alias in INDEX_ALIASES}
+        )
+        await put_index_templates(self.es_client)
+        for alias, index in result.indices.items():
+            await self._create_index(alias, index)
+
+        await self._index_chats(result)
+
+        for alias, index in result.indices.items():
+            await self._finish_index(alias, index)
+        if result.failed:
+            logger.error(
+                f"{result.failed} chats could not be indexed, the aliases were "
+                "left unchanged"
+            )
+            return result
+
+        result.previous_indices = await self._swap_aliases(result.indices)
+        result.swapped = True
+        await asyncio.to_thread(self._rewind_outbox, started_at)
+        return result
+
+    async def _create_index(self, alias: str, index: str) -> None:
+        body = index_body(alias)
+        settings = {
+            **body["settings"],
+            "number_of_replicas": 0,
+            "refresh_interval": "-1",
+        }
+        await self.es_client.indices.create(
+            index=index, body={**body, "settings": settings}
+        )
+
+    async def _finish_index(self, alias: str, index: str) -> None:
+        await self.es_client.indices.put_settings(
+            index=index,
+            settings={
+                "number_of_replicas": index_body(alias)["settings"][
+                    "number_of_replicas"
+                ],
+                "refresh_interval": None,
+            },
+        )
+        await self.es_client.indices.refresh(index=index)
+
+    async def _index_documents(
+        self, documents: list[dict[str, Any]], result: ReindexResult
+    ) -> int:
+        return await self._bulk(
+            [self._operations(document, result.indices) for document in documents]
+        )
+
+    def _operations(
+        self, document: dict[str, Any], indices: dict[str, str]
+    ) -> list[BulkOperation]:
+        return [
+            index_chat_operation(document, index=indices[CHATS_ALIAS]),
+            *document_messages_operations(document, index=indices[MESSAGES_ALIAS]),
+        ]
+
+    async def _bulk(self, chats: list[list[BulkOperation]]) -> int:
+        """Applies the operations of every chat, returns for how many chats
+        an operation failed. Items that were rejected because the cluster is
+        busy are sent again."""
+        failed_chats: set[str] = set()
+        pending = [op for operations in chats for op in operations]
+        for attempt in range(1, BULK_MAX_ATTEMPTS + 1):
+            response = await self.es_client.bulk(operations=bulk_operations(pending))
+            retry = []
+            for op, item in zip(pending, response["items"], strict=True):
+                try:
+                    bulk_item_result(item)
+                except SearchIndexingError as e:
+                    if e.status in RETRYABLE_STATUSES:
+                        retry.append(op)
+                        continue
+                    chat_id = self._chat_id(op)
+                    failed_chats.add(chat_id)
+                    logger.error(f"Could not index chat {chat_id}: {e}")
+            if not retry:
+                return len(failed_chats)
+            pending = retry
+            await asyncio.sleep(0.1 * 2**attempt)
+        logger.error(f"Giving up on {len(pending)} operations after {attempt} attempts")
+        failed_chats.update(self._chat_id(op) for op in pending)
+        return len(failed_chats)
+
+    def _chat_id(self, op: BulkOperation) -> str:
+        return op.body["chat_id"]
+
+    async def _swap_aliases(self, indices: dict[str, str]) -> list[str]:
+        """Points the aliases at the new indices, returns the indices they
+        pointed at before. Those are kept, they can be deleted once the new
+        ones are fine."""
+        actions: list[dict[str, Any]] = []
+        previous: list[str] = []
+        for alias, index in indices.items():
+            actions.append(
+                {"add": {"index": index, "alias": alias, **alias_settings(alias)}}
+            )
+            if await self.es_client.indices.exists_alias(name=alias):
+                old_indices = list(await self.es_client.indices.get_alias(name=alias))
+                actions.extend(
+                    {"remove": {"index": old, "alias": alias}} for old in old_indices
+                )
+                previous.extend(old_indices)
+            elif await self.es_client.indices.exists(index=alias):
+                # a concrete index from before the alias, it has to make room
+                actions.append({"remove_index": {"index": alias}})
+        await self.es_client.indices.update_aliases(actions=actions)
+        logger.info(f"Aliases now point at {indices}, replaced {previous}")
+        return previous
+
+
+class SQLiteSearchReindexer(_ChatTableReindexer):
+    """Fills the SQLite search database from DynamoDB, e.g. with the chats
+    written before SEARCH_BACKEND was switched to sqlite. Chats are indexed in
+    place, a page per transaction, searches keep working meanwhile."""
+
+    def __init__(
+        self,
+        backend: SQLiteSearchBackend,
+        dynamodb_client: AsyncDynamoDBClient,
+        segments: int = 8,
+        concurrency: int = 4,
+        batch_size: int = 500,
+        on_progress: Callable[[int], None] | None = None,
+    ):
+        super().__init__(
+            dynamodb_client,
+            segments=segments,
+            concurrency=concurrency,
+            batch_size=batch_size,
+            on_progress=on_progress,
+        )
+        self.backend = backend
+
+    async def run(self) -> ReindexResult:
+        started_at = time.time()
+        result = ReindexResult(indices={})
+        await self._index_chats(result)
+        await asyncio.to_thread(self._rewind_outbox, started_at)
+        return result
+
+    async def _index_documents(
+        self, documents: list[dict[str, Any]], result: ReindexResult
+    ) -> int:
+        try:
+            await self.backend.index_documents(documents)
+        except sqlite3.Error as e:
+            logger.error(f"Could not index {len(documents)} chats: {e}")
+            return len(documents)
+        return 0
@@ -1,8 +1,107 @@
+from pydantic import TypeAdapter
+
+from gptbundle.common.config import settings
+
+from .autocomplete import AutocompleteCoalescer
 from .elasticsearch_repository import ElasticsearchRepository
-from .schemas import Chat
+from .schemas import (
+    AutocompleteResponse,
+    Chat,
+    ChatSearchHit,
+    MessageSearchResponse,
+    MessageSearchSort,
+)
+from .search_cache import SearchResultCache
+from .sqlite_search import SQLiteSearchBackend
+
+SearchBackendType = ElasticsearchRepository | SQLiteSearchBackend
+
+CHATS_ADAPTER = TypeAdapter(list[Chat])
+CHAT_HITS_ADAPTER = TypeAdapter(list[ChatSearchHit])
+MESSAGES_ADAPTER = TypeAdapter(MessageSearchResponse)
+AUTOCOMPLETE_ADAPTER = TypeAdapter(AutocompleteResponse)
+
+
+def get_search_backend() -> SearchBackendType:
+    if settings.SEARCH_BACKEND == "sqlite":
+        return SQLiteSearchBackend.shared()
+    return ElasticsearchRepository()
 
 
 async def search_chats_by_keyword(
-    es_repo: ElasticsearchRepository, user_email: str, search_term: str
-) -> list[Chat]:
-    return await es_repo.search_chats(user_email, search_term)
+    search_backend: SearchBackendType,
+    user_email: str,
+    search_term: str,
+    size: int = 20,
+    hydrate: bool = False,
+    cache: SearchResultCache | None = None,
+) -> list[ChatSearchHit] | list[Chat]:
+    cache = cache or SearchResultCache.shared()
+    key = {"search": "chats", "query": search_term, "size": size}
+    if hydrate:
+        return await cache.get_or_search(
+            user_email,
+            {**key, "hydrate": True},
+            lambda: search_backend.search_chats(user_email, search_term, size=size),
+            CHATS_ADAPTER,
+        )
+    return await cache.get_or_search(
+        user_email,
+        key,
+        lambda: search_backend.search_chat_hits(user_email, search_term, size=size),
+        CHAT_HITS_ADAPTER,
+    )
+
+
+async def search_messages_by_keyword(
+    search_backend: SearchBackendType,
+    user_email: str,
+    search_term: str,
+    size: int = 20,
+    search_after: list | None = None,
+    sort: MessageSearchSort = MessageSearchSort.RELEVANCE,
+    cache: SearchResultCache | None = None,
+) -> MessageSearchResponse:
+    cache = cache or SearchResultCache.shared()
+    return await cache.get_or_search(
+        user_email,
+        {
+            "search": "messages",
+            "query": search_term,
+            "size": size,
+            "search_after": search_after,
+            "sort": sort,
+        },
+        lambda: search_backend.search_messages(
+            user_email, search_term, size=size, search_after=search_after, sort=sort
+        ),
+        MESSAGES_ADAPTER,
+    )
+
+
+async def autocomplete_chats(
+    search_backend: SearchBackendType,
+    user_email: str,
+    prefix: str,
+    size: int = 8,
+    cache: SearchResultCache | None = None,
+    coalescer: AutocompleteCoalescer | None = None,
+) -> AutocompleteResponse:
+    cache = cache or SearchResultCache.shared()
+    coalescer = coalescer or AutocompleteCoalescer.shared()
+    # every user is one session, whether typing through HTTP or a websocket
+    response = await coalescer.run(
+        user_email,
+        f"{prefix}\0{size}",
+        lambda: cache.get_or_search(
+            user_email,
+            {"search": "autocomplete", "query": prefix, "size": size},
+            lambda: search_backend.autocomplete(user_email, prefix, size=size),
+            AUTOCOMPLETE_ADAPTER,
+            # incomplete results are not worth keeping
+            cacheable=lambda response: not response.timed_out,
+        ),
+    )
+    if response is None:
+        return AutocompleteResponse(items=[], superseded=True)
+    return response
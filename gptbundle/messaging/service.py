@@ -1,46 +1,132 @@
 import asyncio
+import inspect
 import logging
+from collections.abc import Callable
 from typing import Any
 
-from gptbundle.media_storage.storage import delete_objects, generate_presigned_url
+from gptbundle.media_storage.images import ImageVariant, variant_key
+from gptbundle.media_storage.storage import (
+    PRESIGNED_URL_EXPIRATION,
+    S3Storage,
+    generate_presigned_url,
+)
 
-from .elasticsearch_repository import ElasticsearchRepository
+from .async_repository import AsyncChatRepository
+from .exceptions import AttachmentAccessError, ChatVersionConflictError
 from .repository import ChatRepository
 from .schemas import Chat, ChatCreate, MessageCreate
+from .search_cache import SearchResultCache
 
 logger = logging.getLogger(__name__)
 
+ChatRepositoryType = ChatRepository | AsyncChatRepository
 
-async def create_chat(
-    chat_in: ChatCreate,
-    chat_repo: ChatRepository,
-    es_repo: ElasticsearchRepository,
-) -> Chat:  # TODO: this is prone to inconsistencies, decouple into async storage
-    chat = await asyncio.to_thread(chat_repo.create_chat, chat_in)
-    await es_repo.store_chat(chat)
+APPEND_MAX_ATTEMPTS = 3
+
+
+async def _run(method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    # AsyncChatRepository is awaited directly, the PynamoDB based ChatRepository
+    # is blocking and has to go to a worker thread
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
+
+
+async def create_chat(chat_in: ChatCreate, chat_repo: ChatRepositoryType) -> Chat:
+    # the search index is updated from the outbox, see SearchOutboxConsumer
+    chat = await _run(chat_repo.create_chat, chat_in)
+    await SearchResultCache.shared().invalidate(chat_in.user_email)
     return chat
 
 
+def _presign_previews(img_s3_keys: list[str]) -> list[str]:
+    return [
+        generate_presigned_url(variant_key(key, ImageVariant.PREVIEW))
+        for key in img_s3_keys
+    ]
+
+
 async def get_chat(
-    chat_id: str, timestamp: float, chat_repo: ChatRepository, user_email: str
+    chat_id: str,
+    timestamp: float,
+    chat_repo: ChatRepositoryType,
+    user_email: str,
+    presign: bool = True,
 ) -> Chat | None:
-    chat = await asyncio.to_thread(chat_repo.get_chat, chat_id, timestamp, user_email)
-    if chat:
+    chat = await _run(chat_repo.get_chat, chat_id, timestamp, user_email)
+    if chat and presign:
         for message in chat.messages:
             if message.img_s3_keys:
-                message.img_presigned_urls = [
-                    generate_presigned_url(key) for key in message.img_s3_keys
-                ]
+                message.img_presigned_urls = _presign_previews(message.img_s3_keys)
     return chat
 
 
+async def get_messages_paginated(
+    chat_id: str,
+    timestamp: float,
+    chat_repo: ChatRepositoryType,
+    user_email: str,
+    limit: int | None = None,
+    last_evaluated_key: dict[str, Any] | None = None,
+    presign: bool = True,
+) -> dict[str, Any] | None:
+    messages_page = await _run(
+        chat_repo.get_messages_paginated,
+        chat_id,
+        timestamp,
+        user_email,
+        limit=limit,
+        last_evaluated_key=last_evaluated_key,
+    )
+    if messages_page and presign:
+        for message in messages_page["items"]:
+            if message.img_s3_keys:
+                message.img_presigned_urls = _presign_previews(message.img_s3_keys)
+    return messages_page
+
+
+async def presign_chat_attachments(
+    chat_id: str,
+    timestamp: float,
+    keys: list[str],
+    chat_repo: ChatRepositoryType,
+    user_email: str,
+    variant: ImageVariant = ImageVariant.PREVIEW,
+) -> dict[str, Any] | None:
+    """Fresh presigned URLs for attachments of a chat, for clients that fetched
+    the chat without them or whose URLs expired. Images are signed in the
+    requested variant, the URLs are keyed by the attachment keys. Returns None
+    when the chat does not exist for the user, raises AttachmentAccessError
+    for keys that are not attachments of the chat."""
+    chat = await _run(chat_repo.get_chat, chat_id, timestamp, user_email)
+    if not chat:
+        return None
+    attachments = {
+        key
+        for message in chat.messages
+        for key in (*(message.img_s3_keys or []), *(message.pdf_s3_keys or []))
+    }
+    foreign = [key for key in keys if key not in attachments]
+    if foreign:
+        raise AttachmentAccessError(foreign)
+    return {
+        "urls": {
+            key: generate_presigned_url(variant_key(key, variant))
+            for key in dict.fromkeys(keys)
+        },
+        "min_valid_seconds": S3Storage.shared().presigned_urls.min_valid_seconds(
+            PRESIGNED_URL_EXPIRATION
+        ),
+    }
+
+
 async def get_chats_by_user_email_paginated(
     user_email: str,
-    chat_repo: ChatRepository,
+    chat_repo: ChatRepositoryType,
     limit: int | None = None,
     last_evaluated_key: dict[str, Any] | None = None,
 ) -> dict[str, Any]:
-    return await asyncio.to_thread(
+    return await _run(
         chat_repo.get_chats_by_user_email_paginated,
         user_email,
         limit=limit,
@@ -50,55 +136,43 @@ async def get_chats_by_user_email_paginated(
 
 async def get_chats_by_user_email(
     user_email: str,
-    chat_repo: ChatRepository,
+    chat_repo: ChatRepositoryType,
 ) -> list[Chat]:
-    return await asyncio.to_thread(chat_repo.get_chats_by_user_email, user_email)
+    return await _run(chat_repo.get_chats_by_user_email, user_email)
 
 
 async def append_messages(
     chat_id: str,
     timestamp: float,
     messages: list[MessageCreate],
-    chat_repo: ChatRepository,
+    chat_repo: ChatRepositoryType,
     user_email: str,
-    es_repo: ElasticsearchRepository,
-) -> bool:  # TODO: this is prone to inconsistencies, decouple into async storage
-    success = await asyncio.to_thread(
-        chat_repo.append_messages, chat_id, timestamp, messages, user_email
-    )
+) -> bool:
+    for attempt in range(1, APPEND_MAX_ATTEMPTS + 1):
+        try:
+            success = await _run(
+                chat_repo.append_messages, chat_id, timestamp, messages, user_email
+            )
+            break
+        except ChatVersionConflictError:
+            # the repository refreshed the chat version, retrying is enough
+            if attempt == APPEND_MAX_ATTEMPTS:
+                raise
+            logger.debug(f"Version conflict appending to chat: {chat_id}, retrying")
     if success:
-        full_chat = await asyncio.to_thread(
-            chat_repo.get_chat, chat_id, timestamp, user_email
-        )  # TODO: decouple!! too much overhead
-        if full_chat:
-            await es_repo.update_chat(full_chat)
+        await SearchResultCache.shared().invalidate(user_email)
     return success
 
 
 async def delete_chat(
     chat_id: str,
     timestamp: float,
-    chat_repo: ChatRepository,
+    chat_repo: ChatRepositoryType,
     user_email: str,
-    es_repo: ElasticsearchRepository,
 ) -> bool:
-    chat = await asyncio.to_thread(chat_repo.get_chat, chat_id, timestamp, user_email)
-    if not chat:
-        return False
-
-    s3_keys = []
-    for msg in chat.messages:
-        if msg.img_s3_keys:
-            s3_keys.extend(msg.img_s3_keys)
-        if msg.pdf_s3_keys:
-            s3_keys.extend(msg.pdf_s3_keys)
-
-    deleted = await asyncio.to_thread(
-        chat_repo.delete_chat, chat_id, timestamp, user_email
-    )
+    # the messages, attachments, vector store and LLM history of the chat are
+    # removed in the background, see ChatPurgeWorker
+    deleted = await _run(chat_repo.delete_chat, chat_id, timestamp, user_email)
     if deleted:
-        if s3_keys:
-            delete_objects(s3_keys)
-        await es_repo.delete_chat(chat_id)
-
+        await SearchResultCache.shared().invalidate(user_email)
     return deleted
@@ -0,0 +1,479 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+from typing import Any
+
+from gptbundle.common.config import settings
+
+from .exceptions import SearchIndexingError
+from .models import SearchOutboxEvent
+from .outbox import SearchEventType
+from .schemas import (
+    CHAT_TITLE_MAX_LENGTH,
+    AutocompleteResponse,
+    AutocompleteSuggestion,
+    Chat,
+    ChatSearchHit,
+    MessageCreate,
+    MessageSearchHit,
+    MessageSearchResponse,
+    MessageSearchSort,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    user_email TEXT NOT NULL,
+    title TEXT,
+    is_rag INTEGER NOT NULL DEFAULT 0,
+    next_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    chat_timestamp REAL NOT NULL,
+    user_email TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message TEXT NOT NULL,
+    UNIQUE (chat_id, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_user_email ON messages (user_email);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+UPSERT_MESSAGE = """
+INSERT INTO messages
+    (chat_id, chat_timestamp, user_email, seq, role, content, message)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (chat_id, seq) DO UPDATE SET
+    role = excluded.role, content = excluded.content, message = excluded.message
+"""
+
+# the best matching message of every chat
+BEST_CHAT_MATCHES = """
+SELECT chat_id, id, rank FROM (
+    SELECT chat_id, id, rank,
+        row_number() OVER (PARTITION BY chat_id ORDER BY rank) AS chat_rank
+    FROM (
+        SELECT m.chat_id, m.id, bm25(messages_fts) AS rank
+        FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? AND m.user_email = ?
+    )
+)
+WHERE chat_rank = 1
+ORDER BY rank
+LIMIT ?
+"""
+
+MESSAGE_MATCHES = """
+SELECT id, chat_id, chat_timestamp, seq, role, rank FROM (
+    SELECT m.id, m.chat_id, m.chat_timestamp, m.seq, m.role,
+        bm25(messages_fts) AS rank
+    FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+    WHERE messages_fts MATCH ? AND m.user_email = ?
+)
+"""
+
+# where clause continuing after search_after, and the order of each sort
+MESSAGE_SORTS = {
+    MessageSearchSort.RELEVANCE: (
+        "(rank, chat_id, seq) > (?, ?, ?)",
+        "rank, chat_id, seq",
+    ),
+    MessageSearchSort.RECENT: (
+        "(chat_timestamp, chat_id, seq) < (?, ?, ?)",
+        "chat_timestamp DESC, chat_id DESC, seq DESC",
+    ),
+}
+
+
+def fts_query(query: str, prefix: bool = False) -> str | None:
+    """Any of the words, like the match query of Elasticsearch. Every word is
+    quoted so nothing in the input is read as FTS5 syntax. With prefix the
+    last word also matches longer terms, like a bool_prefix query."""
+    words = [f'"{word}"' for word in re.findall(r"\w+", query)]
+    if not words:
+        return None
+    if prefix:
+        words[-1] += "*"
+    return " OR ".join(words)
+
+
+class SQLiteSearchBackend:
+    """Search backend on an embedded SQLite FTS5 database.
+
+    Applies the same search outbox events as the Elasticsearch repository and
+    answers the same searches, for deployments that cannot spare the memory of
+    an Elasticsearch node. BM25 scores are negated so that, like in
+    Elasticsearch, a higher score is a better match.
+    """
+
+    _shared: "SQLiteSearchBackend | None" = None
+
+    def __init__(self, path: str | None = None):
+        self.path = path or settings.SQLITE_SEARCH_PATH
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+
+    @classmethod
+    def shared(cls) -> "SQLiteSearchBackend":
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def close_shared(cls) -> None:
+        if cls._shared is not None:
+            cls._shared.close()
+            cls._shared = None
+
+    def close(self) -> None:
+        self._connection.close()
+
+    async def apply_events(
+        self, events: list[SearchOutboxEvent]
+    ) -> list[SearchIndexingError | None]:
+        """Applies search outbox events in one transaction, returns one error
+        per event. Appending to a chat that is not indexed is a 404, like in
+        Elasticsearch."""
+        return await asyncio.to_thread(self._apply_events, events)
+
+    async def index_document(self, document: dict[str, Any]) -> None:
+        await asyncio.to_thread(self._write, self._index_document, document)
+
+    async def index_documents(self, documents: list[dict[str, Any]]) -> None:
+        """Indexes the documents of several chats in one transaction."""
+        await asyncio.to_thread(self._write, self._index_documents, documents)
+
+    async def search_chats(
+        self, user_email: str, query: str, size: int = 20
+    ) -> list[Chat]:
+        return await asyncio.to_thread(
+            self._locked, self._search_chats, user_email, query, size
+        )
+
+    async def search_chat_hits(
+        self, user_email: str, query: str, size: int = 20
+    ) -> list[ChatSearchHit]:
+        return await asyncio.to_thread(
+            self._locked, self._search_chat_hits, user_email, query, size
+        )
+
+    async def search_messages(
+        self,
+        user_email: str,
+        query: str,
+        size: int = 20,
+        search_after: list[Any] | None = None,
+        sort: MessageSearchSort = MessageSearchSort.RELEVANCE,
+    ) -> MessageSearchResponse:
+        return await asyncio.to_thread(
+            self._locked,
+            self._search_messages,
+            user_email,
+            query,
+            size,
+            search_after,
+            sort,
+        )
+
+    async def autocomplete(
+        self,
+        user_email: str,
+        prefix: str,
+        size: int = 8,
+        timeout: float | None = None,
+    ) -> AutocompleteResponse:
+        """Chats with messages containing words starting with the words typed
+        so far. The title is the first message, it is covered by the messages.
+        A local query needs no latency budget, timeout is ignored."""
+        return await asyncio.to_thread(
+            self._locked, self._autocomplete, user_email, prefix, size
+        )
+
+    def _locked(self, func, *args):
+        with self._lock:
+            return func(*args)
+
+    def _write(self, func, *args):
+        # commits, or rolls back when func raised
+        with self._lock, self._connection:
+            return func(*args)
+
+    def _apply_events(
+        self, events: list[SearchOutboxEvent]
+    ) -> list[SearchIndexingError | None]:
+        errors: list[SearchIndexingError | None] = []
+        with self._lock, self._connection:
+            for event in events:
+                try:
+                    self._apply_event(event)
+                    errors.append(None)
+                except SearchIndexingError as e:
+                    errors.append(e)
+        return errors
+
+    def _apply_event(self, event: SearchOutboxEvent) -> None:
+        payload: dict[str, Any] = event.payload or {}
+        if event.event_type == SearchEventType.CHAT_CREATED:
+            self._index_document(payload["document"])
+        elif event.event_type == SearchEventType.MESSAGES_APPENDED:
+            self._append_messages(
+                event.chat_id,
+                event.chat_timestamp,
+                event.user_email,
+                payload["messages"],
+                payload["first_seq"],
+            )
+        else:
+            self._connection.execute(
+                "DELETE FROM messages WHERE chat_id = ?", (event.chat_id,)
+            )
+            self._connection.execute(
+                "DELETE FROM chats WHERE chat_id = ?", (event.chat_id,)
+            )
+
+    def _index_documents(self, documents: list[dict[str, Any]]) -> None:
+        for document in documents:
+            self._index_document(document)
+
+    def _index_document(self, document: dict[str, Any]) -> None:
+        messages = document["messages"]
+        self._connection.execute(
+            "INSERT OR REPLACE INTO chats "
+            "(chat_id, timestamp, user_email, title, is_rag, next_seq) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                document["chat_id"],
+                document["timestamp"],
+                document["user_email"],
+                document.get("title"),
+                document.get("is_rag", False),
+                document["next_seq"],
+            ),
+        )
+        # legacy messages get negative sequence numbers, as in Elasticsearch
+        self._upsert_messages(
+            document["chat_id"],
+            document["timestamp"],
+            document["user_email"],
+            messages,
+            document["next_seq"] - len(messages),
+        )
+
+    def _append_messages(
+        self,
+        chat_id: str,
+        chat_timestamp: float,
+        user_email: str,
+        messages: list[dict[str, Any]],
+        first_seq: int,
+    ) -> None:
+        row = self._connection.execute(
+            "SELECT next_seq FROM chats WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if row is None:
+            raise SearchIndexingError(404, f"Chat {chat_id} is not indexed")
+        if first_seq < row["next_seq"]:
+            # already applied, the event is replayed
+            return
+        self._upsert_messages(chat_id, chat_timestamp, user_email, messages, first_seq)
+        self._connection.execute(
+            "UPDATE chats SET next_seq = ?, is_rag = is_rag OR ?, "
+            "title = coalesce(title, ?) WHERE chat_id = ?",
+            (
+                first_seq + len(messages),
+                any(msg.get("pdf_s3_keys") for msg in messages),
+                messages[0]["content"][:CHAT_TITLE_MAX_LENGTH] if messages else None,
+                chat_id,
+            ),
+        )
+
+    def _upsert_messages(
+        self,
+        chat_id: str,
+        chat_timestamp: float,
+        user_email: str,
+        messages: list[dict[str, Any]],
+        first_seq: int,
+    ) -> None:
+        self._connection.executemany(
+            UPSERT_MESSAGE,
+            [
+                (
+                    chat_id,
+                    chat_timestamp,
+                    user_email,
+                    seq,
+                    msg["role"],
+                    msg["content"],
+                    json.dumps(msg),
+                )
+                for seq, msg in enumerate(messages, start=first_seq)
+            ],
+        )
+
+    def _best_chat_matches(
+        self, user_email: str, match: str | None, size: int
+    ) -> list[sqlite3.Row]:
+        if match is None:
+            return []
+        return self._connection.execute(
+            BEST_CHAT_MATCHES, (match, user_email, size)
+        ).fetchall()
+
+    def _search_chats(self, user_email: str, query: str, size: int) -> list[Chat]:
+        chat_ids = [
+            row["chat_id"]
+            for row in self._best_chat_matches(user_email, fts_query(query), size)
+        ]
+        chats = []
+        for chat_id in chat_ids:
+            chat = self._connection.execute(
+                "SELECT * FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            messages = self._connection.execute(
+                "SELECT message FROM messages WHERE chat_id = ? ORDER BY seq",
+                (chat_id,),
+            ).fetchall()
+            chats.append(
+                Chat(
+                    chat_id=chat_id,
+                    timestamp=chat["timestamp"],
+                    user_email=chat["user_email"],
+                    is_rag=bool(chat["is_rag"]),
+                    messages=[
+                        MessageCreate(**json.loads(row["message"])) for row in messages
+                    ],
+                )
+            )
+        return sorted(chats, key=lambda x: x.timestamp, reverse=True)
+
+    def _search_chat_hits(
+        self, user_email: str, query: str, size: int
+    ) -> list[ChatSearchHit]:
+        match = fts_query(query)
+        matches = self._best_chat_matches(user_email, match, size)
+        snippets = self._snippets(match, [row["id"] for row in matches])
+        hits = []
+        for row in matches:
+            chat = self._connection.execute(
+                "SELECT timestamp, title, is_rag FROM chats WHERE chat_id = ?",
+                (row["chat_id"],),
+            ).fetchone()
+            hits.append(
+                ChatSearchHit(
+                    chat_id=row["chat_id"],
+                    timestamp=chat["timestamp"],
+                    title=chat["title"],
+                    is_rag=bool(chat["is_rag"]),
+                    snippet=snippets.get(row["id"]),
+                    score=-row["rank"],
+                )
+            )
+        return hits
+
+    def _autocomplete(
+        self, user_email: str, prefix: str, size: int
+    ) -> AutocompleteResponse:
+        match = fts_query(prefix, prefix=True)
+        matches = self._best_chat_matches(user_email, match, size)
+        snippets = self._snippets(match, [row["id"] for row in matches])
+        items = []
+        for row in matches:
+            chat = self._connection.execute(
+                "SELECT c.timestamp, c.title, m.seq FROM chats c "
+                "JOIN messages m ON m.chat_id = c.chat_id WHERE m.id = ?",
+                (row["id"],),
+            ).fetchone()
+            items.append(
+                AutocompleteSuggestion(
+                    chat_id=row["chat_id"],
+                    chat_timestamp=chat["timestamp"],
+                    title=chat["title"],
+                    snippet=snippets.get(row["id"]),
+                    seq=chat["seq"],
+                )
+            )
+        return AutocompleteResponse(items=items)
+
+    def _search_messages(
+        self,
+        user_email: str,
+        query: str,
+        size: int,
+        search_after: list[Any] | None,
+        sort: MessageSearchSort,
+    ) -> MessageSearchResponse:
+        match = fts_query(query)
+        if match is None:
+            return MessageSearchResponse(items=[])
+        after_clause, order = MESSAGE_SORTS[sort]
+        sql = MESSAGE_MATCHES
+        params: list[Any] = [match, user_email]
+        if search_after:
+            sql += f" WHERE {after_clause}"
+            params.extend(search_after)
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(size)
+        rows = self._connection.execute(sql, params).fetchall()
+
+        snippets = self._snippets(match, [row["id"] for row in rows])
+        sort_key = (
+            ("rank", "chat_id", "seq")
+            if sort == MessageSearchSort.RELEVANCE
+            else ("chat_timestamp", "chat_id", "seq")
+        )
+        return MessageSearchResponse(
+            items=[
+                MessageSearchHit(
+                    chat_id=row["chat_id"],
+                    chat_timestamp=row["chat_timestamp"],
+                    seq=row["seq"],
+                    role=row["role"],
+                    snippets=[snippets[row["id"]]] if row["id"] in snippets else [],
+                    score=-row["rank"],
+                )
+                for row in rows
+            ],
+            search_after=[rows[-1][key] for key in sort_key]
+            if len(rows) == size
+            else None,
+        )
+
+    def _snippets(self, match: str, message_ids: list[int]) -> dict[int, str]:
+        # only for the hits of the page, not for every match
+        if not message_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in message_ids)
+        rows = self._connection.execute(
+            "SELECT rowid, snippet(messages_fts, 0, '<em>', '</em>', '...', 24) "
+            f"FROM messages_fts WHERE messages_fts MATCH ? "
+            f"AND rowid IN ({placeholders})",
+            [match, *message_ids],
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
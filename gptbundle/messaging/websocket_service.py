@@ -8,11 +8,16 @@ from gptbundle.llm.chat_factory import msg_schema_to_lc_base_message
 from gptbundle.llm.chat_message_history_wrapper import ChatMessageHistoryWrapper
 from gptbundle.llm.exceptions import ModelDoesNotSupportReasoningEffortError
 from gptbundle.llm.service import generate_text_response
-from gptbundle.media_storage.storage import move_file
+from gptbundle.media_storage.content import add_references
+from gptbundle.media_storage.exceptions import PendingUploadError
+from gptbundle.media_storage.images import variant_keys
+from gptbundle.media_storage.pending import (
+    confirm_pending_uploads,
+    record_pending_uploads,
+)
+from gptbundle.media_storage.storage import AsyncS3Storage
 
-from .elasticsearch_repository import ElasticsearchRepository
-from .exceptions import ChatAlreadyExistsError
-from .repository import ChatRepository
+from .exceptions import AttachmentPromotionError, ChatAlreadyExistsError
 from .schemas import (
     ChatCreate,
     MessageCreate,
@@ -20,32 +25,132 @@ from .schemas import (
     WebSocketMessage,
     WebSocketMessageType,
 )
-from .service import append_messages, create_chat
+from .service import ChatRepositoryType, append_messages, create_chat
 
 logger = logging.getLogger(__name__)
 
 
-async def process_attachments(user_message: MessageCreate, chat_id: str) -> None:
-    if user_message.img_s3_keys:
-        for s3_key in user_message.img_s3_keys:
-            await asyncio.to_thread(
-                move_file,
-                s3_key,
-                s3_key.replace(settings.S3_TEMP_PREFIX, settings.S3_PERMANENT_PREFIX),
-            )
-        user_message.img_s3_keys = [
-            s3_key.replace(settings.S3_TEMP_PREFIX, settings.S3_PERMANENT_PREFIX)
-            for s3_key in user_message.img_s3_keys
-        ]
+def _permanent_key(s3_key: str) -> str:
+    return s3_key.replace(settings.S3_TEMP_PREFIX, settings.S3_PERMANENT_PREFIX)
+
+
+def _document_key(s3_key: str, chat_id: str) -> str:
+    return s3_key.replace(
+        settings.S3_TEMP_PREFIX,
+        f"{settings.S3_PERMANENT_PREFIX}{settings.S3_DOC_PREFIX}{chat_id}/",
+    )
+
+
+async def promote_attachments(moves: dict[str, str]) -> None:
+    """Moves attachments from their temp keys to their permanent keys.
+
+    The moves run concurrently, at most S3_ATTACHMENT_CONCURRENCY at once, so
+    a message with several attachments waits about as long as its slowest
+    move. When a move fails, the moves that succeeded are moved back and the
+    copies a failed move may have left behind are deleted, so the message can
+    be sent again with the same keys.
+    """
+    storage = AsyncS3Storage.shared()
+    semaphore = asyncio.Semaphore(settings.S3_ATTACHMENT_CONCURRENCY)
+
+    async def _move(source_key: str, target_key: str) -> None:
+        async with semaphore:
+            await storage.move_file(source_key, target_key)
+
+    results = await asyncio.gather(
+        *(_move(source, target) for source, target in moves.items()),
+        return_exceptions=True,
+    )
+    failed = {
+        source: result
+        for source, result in zip(moves, results, strict=True)
+        if isinstance(result, BaseException)
+    }
+    if not failed:
+        return
+
+    logger.error(f"Could not promote attachments {list(failed)}, rolling back")
+    rollbacks = await asyncio.gather(
+        *(
+            _move(target, source)
+            for source, target in moves.items()
+            if source not in failed
+        ),
+        storage.delete_objects([moves[source] for source in failed]),
+        return_exceptions=True,
+    )
+    for result in rollbacks:
+        if isinstance(result, BaseException):
+            logger.error(f"Rolling back attachment promotion failed: {result}")
+    raise AttachmentPromotionError(failed)
+
 
+def _is_direct_upload(s3_key: str) -> bool:
+    return s3_key.startswith(settings.S3_PERMANENT_PREFIX)
+
+
+async def process_attachments(
+    user_message: MessageCreate, chat_id: str, user_email: str
+) -> None:
+    """Makes the attachments of a message permanent.
+
+    The attachments have to be pending uploads of the user, they stop being
+    pending. Attachments uploaded to the temp prefix are moved to their
+    permanent keys, direct uploads already are at theirs. Once the message
+    was saved or not, finish_attachments has to be called.
+    """
+    img_keys = {
+        s3_key: s3_key if _is_direct_upload(s3_key) else _permanent_key(s3_key)
+        for s3_key in user_message.img_s3_keys or []
+    }
+    pdf_keys = {
+        s3_key: s3_key if _is_direct_upload(s3_key) else _document_key(s3_key, chat_id)
+        for s3_key in user_message.pdf_s3_keys or []
+    }
+    if not img_keys and not pdf_keys:
+        return
+
+    keys = img_keys | pdf_keys
+    try:
+        await asyncio.to_thread(confirm_pending_uploads, user_email, list(keys))
+    except PendingUploadError as e:
+        raise AttachmentPromotionError(dict.fromkeys(e.keys, e)) from e
+    moves = {source: target for source, target in keys.items() if source != target}
+    # the variants of an image move along with it
+    moves |= {
+        source_variant: target_variant
+        for source, target in img_keys.items()
+        if source != target
+        for source_variant, target_variant in zip(
+            variant_keys(source), variant_keys(target), strict=True
+        )
+    }
+    try:
+        await promote_attachments(moves)
+    except AttachmentPromotionError:
+        # the message is not saved, the uploads are pending again
+        await asyncio.to_thread(record_pending_uploads, user_email, list(keys))
+        raise
+
+    if user_message.img_s3_keys:
+        user_message.img_s3_keys = [img_keys[k] for k in user_message.img_s3_keys]
     if user_message.pdf_s3_keys:
-        for i, s3_key in enumerate(user_message.pdf_s3_keys):
-            new_key = s3_key.replace(
-                settings.S3_TEMP_PREFIX,
-                f"{settings.S3_PERMANENT_PREFIX}{settings.S3_DOC_PREFIX}{chat_id}/",
-            )
-            await asyncio.to_thread(move_file, s3_key, new_key)
-            user_message.pdf_s3_keys[i] = new_key
+        user_message.pdf_s3_keys = [pdf_keys[k] for k in user_message.pdf_s3_keys]
+
+
+async def finish_attachments(
+    user_message: MessageCreate, user_email: str, message_saved: bool
+) -> None:
+    """Counts the references of the attachments of a saved message. The
+    attachments of a message that could not be saved are pending uploads
+    again, which the sweeper deletes unless the message is sent again."""
+    keys = [*(user_message.img_s3_keys or []), *(user_message.pdf_s3_keys or [])]
+    if not keys:
+        return
+    if message_saved:
+        await asyncio.to_thread(add_references, keys)
+    else:
+        await asyncio.to_thread(record_pending_uploads, user_email, keys)
 
 
 async def save_user_message(
@@ -53,8 +158,7 @@ async def save_user_message(
     user_message: MessageCreate,
     active_chat_id: str,
     active_timestamp: float,
-    chat_repo: ChatRepository,
-    es_repo: ElasticsearchRepository,
+    chat_repo: ChatRepositoryType,
 ) -> bool:
     try:
         chat_in = ChatCreate(
@@ -64,7 +168,7 @@ async def save_user_message(
             timestamp=active_timestamp,
         )
         logger.debug(f"Creating new chat for user: {user_email}")
-        await create_chat(chat_repo=chat_repo, chat_in=chat_in, es_repo=es_repo)
+        await create_chat(chat_repo=chat_repo, chat_in=chat_in)
         logger.debug(
             f"Created new chat for user: {user_email} "
             f"with chat_id: {active_chat_id} and "
@@ -79,7 +183,6 @@ async def save_user_message(
             timestamp=active_timestamp,
             messages=[user_message],
             user_email=user_email,
-            es_repo=es_repo,
         )
         return result_of_append
     except Exception as e:
@@ -105,8 +208,7 @@ async def stream_ai_response(
     active_chat_id: str,
     active_timestamp: float,
     user_email: str,
-    chat_repo: ChatRepository,
-    es_repo: ElasticsearchRepository,
+    chat_repo: ChatRepositoryType,
     is_rag_chat: bool,
 ) -> None:
     llm_model = user_message.llm_model
@@ -152,7 +254,6 @@ async def stream_ai_response(
             timestamp=active_timestamp,
             messages=[ai_message],
             user_email=user_email,
-            es_repo=es_repo,
         )
         logger.debug(
             f"Appended AI message to chat: {active_chat_id} "
@@ -21,6 +21,10 @@ def verify_password(password: str, hashed_password: str) -> bool:
     return pwd_context.verify(password, hashed_password)
 
 
+def is_admin(user_email: str | None) -> bool:
+    return user_email is not None and user_email in settings.ADMIN_EMAILS
+
+
 def generate_access_token(subject: str) -> str:
     to_encode = {
         "sub": subject,
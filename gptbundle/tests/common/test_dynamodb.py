@@ -0,0 +1,72 @@
+import json
+
+import httpx
+import pytest
+
+from gptbundle.common.dynamodb import AsyncDynamoDBClient, DynamoDBError
+
+
+def _client(responses: list) -> tuple[AsyncDynamoDBClient, list[dict]]:
+    """A client answered by responses in turn, exceptions are raised."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = AsyncDynamoDBClient(endpoint_url="http://dynamodb.test", max_attempts=3)
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, requests
+
+
+@pytest.mark.asyncio
+async def test_request_retries_transport_and_server_errors():
+    client, requests = _client(
+        [
+            httpx.ConnectError("connection reset"),
+            httpx.Response(503, text="Service Unavailable"),
+            httpx.Response(200, json={}),
+        ]
+    )
+    try:
+        assert await client.request("TransactWriteItems", {"TransactItems": []}) == {}
+    finally:
+        await client.close()
+
+    assert len(requests) == 3
+    # a retried transaction is recognized by DynamoDB if the first went through
+    assert len({request["ClientRequestToken"] for request in requests}) == 1
+
+
+@pytest.mark.asyncio
+async def test_request_gives_up():
+    client, requests = _client([httpx.ReadTimeout("timed out")] * 3)
+    try:
+        with pytest.raises(httpx.ReadTimeout):
+            await client.request("GetItem", {})
+    finally:
+        await client.close()
+    assert len(requests) == 3
+
+    client, requests = _client(
+        [
+            httpx.Response(
+                400,
+                json={
+                    "__type": "com.amazonaws.dynamodb.v20120810#"
+                    "ConditionalCheckFailedException",
+                    "message": "The conditional request failed",
+                },
+            )
+        ]
+    )
+    try:
+        with pytest.raises(DynamoDBError) as exc_info:
+            await client.request("PutItem", {})
+    finally:
+        await client.close()
+    assert exc_info.value.code == "ConditionalCheckFailedException"
+    assert len(requests) == 1
@@ -5,6 +5,37 @@ import pytest_asyncio
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 
+def _delete_chat_messages(chat_id: str, timestamp: float) -> None:
+    from gptbundle.messaging.models import (
+        ChatMessage,
+        ChatPurge,
+        message_sort_key_prefix,
+    )
+
+    with ChatMessage.batch_write() as batch:
+        for message in ChatMessage.query(
+            chat_id, ChatMessage.sort_key.startswith(message_sort_key_prefix(timestamp))
+        ):
+            batch.delete(message)
+    # left behind by chats the test deleted
+    ChatPurge(chat_id, timestamp).delete()
+
+
+async def _delete_es_documents(es_repo, chat_id: str) -> None:
+    # without the user_email to route by, every shard is searched
+    from gptbundle.messaging.elasticsearch_repository import (
+        CHATS_ALIAS,
+        MESSAGES_ALIAS,
+    )
+
+    await es_repo.client.delete_by_query(
+        index=CHATS_ALIAS, query={"ids": {"values": [chat_id]}}, refresh=True
+    )
+    await es_repo.client.delete_by_query(
+        index=MESSAGES_ALIAS, query={"term": {"chat_id": chat_id}}, refresh=True
+    )
+
+
 @pytest_asyncio.fixture(loop_scope="function")
 async def engine_fixture():
     """
@@ -85,7 +116,7 @@ async def client_fixture(session: AsyncSession, es_repo):
 
     from gptbundle.common.db import get_pg_db
     from gptbundle.main import app
-    from gptbundle.messaging.elasticsearch_repository import ElasticsearchRepository
+    from gptbundle.messaging.search_service import get_search_backend
 
     def get_session_override():
         return session
@@ -94,7 +125,7 @@ async def client_fixture(session: AsyncSession, es_repo):
         return es_repo
 
     app.dependency_overrides[get_pg_db] = get_session_override
-    app.dependency_overrides[ElasticsearchRepository] = get_es_repo_override
+    app.dependency_overrides[get_search_backend] = get_es_repo_override
 
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"
@@ -113,7 +144,7 @@ def sync_client_fixture(sync_session, sync_es_repo):
 
     from gptbundle.common.db import get_pg_db
     from gptbundle.main import app
-    from gptbundle.messaging.elasticsearch_repository import ElasticsearchRepository
+    from gptbundle.messaging.search_service import get_search_backend
 
     def get_session_override():
         return sync_session
@@ -122,7 +153,7 @@ def sync_client_fixture(sync_session, sync_es_repo):
         return sync_es_repo
 
     app.dependency_overrides[get_pg_db] = get_session_override
-    app.dependency_overrides[ElasticsearchRepository] = get_es_repo_override
+    app.dependency_overrides[get_search_backend] = get_es_repo_override
 
     context = {"anyio_backend": "asyncio"}
     with TestClient(app=app, base_url="http://test", backend_options=context) as client:
@@ -149,6 +180,7 @@ async def cleanup_chats_fixture():
     from gptbundle.messaging.models import Chat
 
     for chat_id, timestamp in chat_keys:
+        await asyncio.to_thread(_delete_chat_messages, chat_id, timestamp)
         try:
             chat = await asyncio.to_thread(Chat.get, chat_id, timestamp)
             await asyncio.to_thread(chat.delete)
@@ -156,6 +188,20 @@ async def cleanup_chats_fixture():
             pass
 
 
+@pytest_asyncio.fixture(name="async_chat_repo")
+async def async_chat_repo_fixture():
+    """
+    Fixture to provide an AsyncChatRepository with its own DynamoDB client, so
+    that the connection pool is bound to the event loop of the test.
+    """
+    from gptbundle.common.dynamodb import AsyncDynamoDBClient
+    from gptbundle.messaging.async_repository import AsyncChatRepository
+
+    client = AsyncDynamoDBClient()
+    yield AsyncChatRepository(client)
+    await client.close()
+
+
 @pytest_asyncio.fixture(name="es_repo")
 async def es_repo_fixture():
     """
@@ -188,7 +234,7 @@ async def cleanup_es_fixture(es_repo):
 
     for chat_id in chat_ids:
         try:
-            await es_repo.delete_chat(chat_id)
+            await _delete_es_documents(es_repo, chat_id)
         except Exception:
             pass
 
@@ -202,6 +248,7 @@ def sync_cleanup_chats_fixture():
     from gptbundle.messaging.models import Chat
 
     for chat_id, timestamp in chat_keys:
+        _delete_chat_messages(chat_id, timestamp)
         try:
             Chat.get(chat_id, timestamp).delete()
         except Chat.DoesNotExist:
@@ -238,7 +285,7 @@ def sync_cleanup_es_fixture(sync_es_repo):
     try:
         for chat_id in chat_ids:
             try:
-                loop.run_until_complete(sync_es_repo.delete_chat(chat_id))
+                loop.run_until_complete(_delete_es_documents(sync_es_repo, chat_id))
             except Exception:
                 pass
     finally:
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from gptbundle.common.config import settings
+from gptbundle.llm.chat_factory import msg_schema_to_lc_base_message, presign_images
+from gptbundle.media_storage.images import ImageVariant, image_key, variant_key
+from gptbundle.messaging.schemas import MessageCreate, MessageRole
+
+
+def test_history_images_are_presigned_when_read():
+    s3_key = image_key(f"{settings.S3_PERMANENT_PREFIX}cat.png")
+    message = MessageCreate(
+        content="What is this?",
+        role=MessageRole.USER,
+        img_s3_keys=[s3_key],
+        llm_model="gpt4",
+    )
+
+    with patch(
+        "gptbundle.llm.chat_factory.generate_presigned_url",
+        side_effect=lambda key: f"https://signed/{key}",
+    ) as presign:
+        history_message = msg_schema_to_lc_base_message(message)
+        presign.assert_not_called()
+
+        presigned = presign_images([history_message, AIMessage(content="A cat")])
+
+    preview_key = variant_key(s3_key, ImageVariant.PREVIEW)
+    presign.assert_called_once_with(preview_key)
+    assert presigned == [
+        HumanMessage(
+            content=[
+                {"type": "text", "text": "What is this?"},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"https://signed/{preview_key}"},
+                },
+            ]
+        ),
+        AIMessage(content="A cat"),
+    ]
+    # the stored message still refers to the object
+    assert history_message.content[1]["image_url"]["url"].startswith("s3://")
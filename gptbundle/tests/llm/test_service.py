@@ -5,6 +5,7 @@ import pytest
 
 from gptbundle.common.config import settings
 from gptbundle.llm.service import generate_image_response, generate_text_response
+from gptbundle.media_storage.storage import AsyncS3Storage
 from gptbundle.messaging.schemas import MessageCreate, MessageRole
 
 
@@ -37,14 +38,16 @@ async def test_generate_image_response_success():
         patch(
             "gptbundle.llm.service.acompletion", new_callable=AsyncMock
         ) as mock_acompletion,
-        patch("gptbundle.llm.service.upload_file") as mock_upload_file,
+        patch.object(
+            AsyncS3Storage, "upload_file", new_callable=AsyncMock
+        ) as mock_upload_file,
         patch(
             "gptbundle.llm.service.generate_presigned_url"
         ) as mock_generate_presigned_url,
     ):
         mock_acompletion.return_value = mock_response
-        mock_generate_presigned_url.side_effect = (
-            lambda key: f"https://s3.example.com/{key}"
+        mock_generate_presigned_url.side_effect = lambda key: (
+            f"https://s3.example.com/{key}"
         )
 
         # Execute
@@ -125,6 +128,7 @@ async def test_generate_text_response_conversational_chain():
             use_rag=False,
             chat_id=chat_id,
             is_rag_chat=False,
+            pdf_s3_keys=None,
         )
         mock_astream_call.assert_called_once_with(
             {"input": "Hello"},
@@ -174,6 +178,7 @@ async def test_generate_text_response_rag_chain():
             use_rag=True,
             chat_id=chat_id,
             is_rag_chat=True,
+            pdf_s3_keys=["doc1.pdf"],
         )
         mock_astream_call.assert_called_once_with(
             {"input": "What is in the document?"},
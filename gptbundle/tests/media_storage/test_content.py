@@ -0,0 +1,112 @@
+import io
+import time
+import uuid
+
+import boto3
+import pytest
+from moto import mock_aws
+from pynamodb.connection import Connection
+from pynamodb.transactions import TransactWrite
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.content import (
+    add_references,
+    content_key,
+    file_digest,
+    is_content_key,
+    release_references,
+    release_unreferenced,
+)
+from gptbundle.media_storage.models import ContentObject, PendingUpload
+from gptbundle.media_storage.pending import PendingUploadSweeper
+from gptbundle.media_storage.storage import AsyncS3Storage, S3Storage
+
+USER_EMAIL = "content@example.com"
+
+
+def _release(s3_keys: list[str]) -> None:
+    connection = Connection(
+        region=settings.AWS_REGION, host=settings.AWS_ENDPOINT_URL_DYNAMODB
+    )
+    with TransactWrite(connection=connection) as transaction:
+        release_references(transaction, s3_keys)
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    monkeypatch.setattr(
+        "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
+    )
+    monkeypatch.setattr(S3Storage, "_shared", None)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name=settings.S3_REGION)
+        bucket_config = {}
+        if settings.S3_REGION != "us-east-1":
+            bucket_config["CreateBucketConfiguration"] = {
+                "LocationConstraint": settings.S3_REGION
+            }
+        s3.create_bucket(Bucket=settings.S3_BUCKET_NAME, **bucket_config)
+        yield s3
+
+
+@pytest.fixture
+def content_keys():
+    keys = [content_key(USER_EMAIL, uuid.uuid4().hex, ".pdf") for _ in range(2)]
+    yield keys
+    for key in keys:
+        PendingUpload(key).delete()
+        ContentObject(key).delete()
+
+
+def test_content_key():
+    data = b"same bytes"
+    digest = file_digest(io.BytesIO(data))
+
+    key = content_key(USER_EMAIL, digest, ".PDF")
+
+    assert is_content_key(key)
+    assert key.endswith(f"{digest}.pdf")
+    assert key == content_key(USER_EMAIL, file_digest(io.BytesIO(data)), ".pdf")
+    assert key != content_key("other@example.com", digest, ".pdf")
+    assert not is_content_key(f"{settings.S3_PERMANENT_PREFIX}image.png")
+
+
+def test_release_references(content_keys):
+    shared, single = content_keys
+    add_references([shared, single, f"{settings.S3_PERMANENT_PREFIX}own.png"])
+    add_references([shared])
+
+    _release([shared, single])
+    assert release_unreferenced(USER_EMAIL, [shared, single]) == [single]
+
+    assert ContentObject.get(shared).refs == 1
+    assert ContentObject.get(single).refs == 0
+    # left to the sweeper, as an upload that expired already
+    expired = time.time() - settings.S3_PENDING_UPLOAD_TTL
+    assert PendingUpload.get(single).uploaded_at <= expired
+    with pytest.raises(PendingUpload.DoesNotExist):
+        PendingUpload.get(shared)
+
+
+@pytest.mark.asyncio
+async def test_sweeper_keeps_referenced_content(s3_setup, content_keys):
+    referenced, unreferenced = content_keys
+    for key in content_keys:
+        s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"pdf")
+    add_references(content_keys)
+    add_references([referenced])
+    _release(content_keys)
+    release_unreferenced(USER_EMAIL, content_keys)
+    # uploaded again, and expired, while still attached to a message
+    PendingUpload(referenced, user_email=USER_EMAIL, uploaded_at=0).save()
+
+    storage = AsyncS3Storage(max_workers=2)
+    try:
+        assert await PendingUploadSweeper(storage=storage).sweep() == 2
+    finally:
+        storage.close()
+
+    listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    assert [item["Key"] for item in listed["Contents"]] == [referenced]
+    assert ContentObject.get(referenced).refs == 1
+    assert ContentObject.count(unreferenced) == 0
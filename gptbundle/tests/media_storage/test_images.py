@@ -0,0 +1,132 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.images import (
+    ImageProcessor,
+    ImageVariant,
+    RenderOptions,
+    has_variants,
+    image_key,
+    render_variants,
+    variant_key,
+    variant_keys,
+    with_variants,
+)
+
+
+def _image(size: tuple[int, int], mode: str = "RGB", image_format="PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_variant_keys():
+    temp_key = image_key(f"{settings.S3_TEMP_PREFIX}photo.png")
+    assert temp_key == f"{settings.S3_TEMP_PREFIX}{settings.S3_IMAGE_PREFIX}photo.png"
+    assert has_variants(temp_key)
+    assert variant_key(temp_key, ImageVariant.ORIGINAL) == temp_key
+    preview_key = variant_key(temp_key, ImageVariant.PREVIEW)
+    assert preview_key == (
+        f"{settings.S3_TEMP_PREFIX}{settings.S3_IMAGE_PREFIX}preview/photo.png"
+    )
+    # moving an image to its permanent key moves it within the image directory
+    permanent_key = temp_key.replace(
+        settings.S3_TEMP_PREFIX, settings.S3_PERMANENT_PREFIX
+    )
+    assert variant_keys(permanent_key) == [
+        preview_key.replace(settings.S3_TEMP_PREFIX, settings.S3_PERMANENT_PREFIX),
+        variant_key(permanent_key, ImageVariant.THUMBNAIL),
+    ]
+    # variants have no variants of their own
+    assert not has_variants(preview_key)
+
+    # stored before variants existed
+    legacy_key = f"{settings.S3_PERMANENT_PREFIX}photo.png"
+    assert variant_key(legacy_key, ImageVariant.PREVIEW) == legacy_key
+    assert with_variants([legacy_key, temp_key]) == [
+        legacy_key,
+        temp_key,
+        *variant_keys(temp_key),
+    ]
+
+
+def test_render_variants():
+    options = RenderOptions.from_settings()
+
+    variants = render_variants(_image((4000, 1000), image_format="JPEG"), options)
+
+    assert list(variants) == [ImageVariant.PREVIEW, ImageVariant.THUMBNAIL]
+    preview = Image.open(io.BytesIO(variants[ImageVariant.PREVIEW]))
+    assert preview.format == settings.IMAGE_FORMAT
+    assert preview.size == (settings.IMAGE_PREVIEW_MAX_SIZE, 392)
+    thumbnail = Image.open(io.BytesIO(variants[ImageVariant.THUMBNAIL]))
+    assert max(thumbnail.size) == settings.IMAGE_THUMBNAIL_MAX_SIZE
+
+    # small images are re-encoded, not scaled up
+    variants = render_variants(_image((100, 80), mode="RGBA"), options)
+    preview = Image.open(io.BytesIO(variants[ImageVariant.PREVIEW]))
+    assert preview.size == (100, 80)
+    assert preview.mode == "RGBA"
+
+    jpeg = render_variants(
+        _image((100, 80), mode="RGBA"), options._replace(image_format="JPEG")
+    )
+    assert Image.open(io.BytesIO(jpeg[ImageVariant.PREVIEW])).mode == "RGB"
+
+
+def test_render_variants_rejects():
+    options = RenderOptions.from_settings()
+
+    assert render_variants(b"not an image", options) is None
+    assert render_variants(_image((100, 100)), options._replace(max_pixels=100)) is None
+
+
+@pytest.mark.asyncio
+async def test_image_processor():
+    processor = ImageProcessor(max_workers=1)
+    try:
+        variants = await processor.render(_image((2000, 2000)))
+        assert await processor.render(b"not an image") is None
+    finally:
+        processor.close()
+
+    preview = Image.open(io.BytesIO(variants[ImageVariant.PREVIEW]))
+    assert preview.size == (
+        settings.IMAGE_PREVIEW_MAX_SIZE,
+        settings.IMAGE_PREVIEW_MAX_SIZE,
+    )
+
+
+@pytest.mark.asyncio
+async def test_image_processor_reads_when_a_worker_is_free(monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_MAX_BYTES", 1000)
+    image = _image((10, 10))
+    reading = 0
+    most_reading = 0
+
+    async def read() -> bytes:
+        nonlocal reading, most_reading
+        reading += 1
+        most_reading = max(most_reading, reading)
+        await asyncio.sleep(0.01)
+        reading -= 1
+        return image
+
+    async def unread() -> bytes:
+        raise AssertionError("read an image above IMAGE_MAX_BYTES")
+
+    processor = ImageProcessor(max_workers=1)
+    try:
+        rendered = await asyncio.gather(
+            *(processor.render_read(len(image), read) for _ in range(3))
+        )
+        assert await processor.render_read(1001, unread) is None
+    finally:
+        processor.close()
+
+    assert all(rendered)
+    assert most_reading == 1
@@ -0,0 +1,89 @@
+import time
+import uuid
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.exceptions import PendingUploadError
+from gptbundle.media_storage.models import PendingUpload
+from gptbundle.media_storage.pending import (
+    PendingUploadSweeper,
+    confirm_pending_uploads,
+    record_pending_uploads,
+)
+from gptbundle.media_storage.storage import AsyncS3Storage, S3Storage
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    monkeypatch.setattr(
+        "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
+    )
+    monkeypatch.setattr(S3Storage, "_shared", None)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name=settings.S3_REGION)
+        bucket_config = {}
+        if settings.S3_REGION != "us-east-1":
+            bucket_config["CreateBucketConfiguration"] = {
+                "LocationConstraint": settings.S3_REGION
+            }
+        s3.create_bucket(Bucket=settings.S3_BUCKET_NAME, **bucket_config)
+        yield s3
+
+
+@pytest.fixture
+def pending_keys():
+    keys = [f"{settings.S3_PERMANENT_PREFIX}{uuid.uuid4()}.png" for _ in range(3)]
+    yield keys
+    with PendingUpload.batch_write() as batch:
+        for key in keys:
+            batch.delete(PendingUpload(key))
+
+
+def test_confirm_pending_uploads(pending_keys):
+    record_pending_uploads("owner@example.com", pending_keys)
+
+    with pytest.raises(PendingUploadError) as exc_info:
+        confirm_pending_uploads("other@example.com", pending_keys[:1])
+    assert exc_info.value.keys == pending_keys[:1]
+
+    confirm_pending_uploads("owner@example.com", pending_keys[:2])
+    assert PendingUpload.count(pending_keys[0]) == 0
+    assert PendingUpload.get(pending_keys[2]).user_email == "owner@example.com"
+
+    # confirmed uploads cannot be attached a second time
+    with pytest.raises(PendingUploadError):
+        confirm_pending_uploads("owner@example.com", pending_keys)
+
+
+@pytest.mark.asyncio
+async def test_sweeper_deletes_expired_uploads(s3_setup, pending_keys):
+    for key in pending_keys:
+        s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"data")
+    record_pending_uploads("owner@example.com", pending_keys[:2])
+    PendingUpload(pending_keys[0]).update(
+        actions=[PendingUpload.uploaded_at.set(time.time() - 3600)]
+    )
+    # not pending, e.g. attached to a message
+    attached = pending_keys[2]
+
+    storage = AsyncS3Storage(max_workers=2)
+    try:
+        sweeper = PendingUploadSweeper(storage=storage, ttl=60)
+        assert await sweeper.sweep() == 1
+        assert await sweeper.sweep() == 0
+    finally:
+        storage.close()
+
+    listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    assert {item["Key"] for item in listed["Contents"]} == {
+        pending_keys[1],
+        attached,
+    }
+    with pytest.raises(PendingUpload.DoesNotExist):
+        PendingUpload.get(pending_keys[0])
+    # swept, a message can no longer attach it
+    with pytest.raises(PendingUploadError):
+        confirm_pending_uploads("owner@example.com", pending_keys[:1])
@@ -1,3 +1,7 @@
+import asyncio
+import io
+import time
+
 import boto3
 import pytest
 from botocore.exceptions import ClientError
@@ -5,8 +9,12 @@ from moto import mock_aws
 
 from gptbundle.common.config import settings
 from gptbundle.media_storage.storage import (
+    AsyncS3Storage,
+    PresignedUrlCache,
+    S3Storage,
     delete_objects,
     generate_presigned_url,
+    get_s3_client,
     move_file,
     upload_file,
 )
@@ -17,6 +25,8 @@ def s3_setup(monkeypatch):
     monkeypatch.setattr(
         "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
     )
+    # the shared client has to be created inside the mock
+    monkeypatch.setattr(S3Storage, "_shared", None)
     with mock_aws():
         s3 = boto3.client("s3", region_name=settings.S3_REGION)
         bucket_config = {}
@@ -89,3 +99,105 @@ def test_delete_objects(s3_setup):
     for key in keys:
         with pytest.raises(ClientError):
             s3_setup.get_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+
+
+def test_s3_client_is_reused(s3_setup):
+    client = get_s3_client()
+    upload_file(b"data", "reused.txt")
+    generate_presigned_url("reused.txt")
+    assert get_s3_client() is client
+
+
+@pytest.mark.asyncio
+async def test_async_storage(s3_setup):
+    storage = AsyncS3Storage(max_workers=2)
+    try:
+        keys = [f"{settings.S3_TEMP_PREFIX}async{i}.txt" for i in range(5)]
+        # more uploads than workers, they queue on the executor
+        await asyncio.gather(*(storage.upload_file(b"async", key) for key in keys))
+        await storage.move_file(keys[0], "moved.txt")
+        response = s3_setup.get_object(Bucket=settings.S3_BUCKET_NAME, Key="moved.txt")
+        assert response["Body"].read() == b"async"
+
+        await storage.delete_objects(keys[1:])
+        listed = s3_setup.list_objects_v2(
+            Bucket=settings.S3_BUCKET_NAME, Prefix=settings.S3_TEMP_PREFIX
+        )
+        assert listed["KeyCount"] == 0
+    finally:
+        storage.close()
+
+
+def test_presigned_urls_are_reused_until_close_to_expiry(s3_setup, monkeypatch):
+    storage = S3Storage()
+    url = storage.generate_presigned_url("cached.txt")
+    assert storage.generate_presigned_url("cached.txt") == url
+    assert (storage.presigned_urls.hits, storage.presigned_urls.misses) == (1, 1)
+
+    storage.generate_presigned_url("short.txt", expiration=10)
+    now = time.time()
+    # less than half of its lifetime left, signed again
+    monkeypatch.setattr(time, "time", lambda: now + 6)
+    storage.generate_presigned_url("short.txt", expiration=10)
+    assert storage.presigned_urls.misses == 3
+
+    storage.delete_objects(["cached.txt"])
+    storage.generate_presigned_url("cached.txt")
+    assert storage.presigned_urls.misses == 4
+
+
+def test_presigned_url_cache_evicts_least_recently_used():
+    cache = PresignedUrlCache(max_entries=2)
+    signed = []
+
+    def _sign(key: str):
+        signed.append(key)
+        return f"https://s3/{key}"
+
+    for key in ("a", "b", "a", "c", "a", "b"):
+        cache.get_or_sign(key, 3600, lambda key=key: _sign(key))
+    assert signed == ["a", "b", "c", "b"]
+
+
+def test_upload_fileobj_multipart(s3_setup, monkeypatch):
+    # S3 parts other than the last one have to be at least 5 MiB
+    part_size = 5 * 1024 * 1024
+    monkeypatch.setattr(settings, "S3_MULTIPART_THRESHOLD", part_size)
+    monkeypatch.setattr(settings, "S3_MULTIPART_CHUNK_SIZE", part_size)
+    data = b"x" * (2 * part_size + 1)
+
+    S3Storage().upload_fileobj(io.BytesIO(data), "large.bin")
+
+    response = s3_setup.get_object(Bucket=settings.S3_BUCKET_NAME, Key="large.bin")
+    # the ETag of a multipart upload ends with the number of parts
+    assert response["ETag"].strip('"').endswith("-3")
+    assert response["Body"].read() == data
+
+
+@pytest.mark.asyncio
+async def test_async_delete_objects_in_batches(s3_setup, monkeypatch):
+    monkeypatch.setattr("gptbundle.media_storage.storage.DELETE_BATCH_SIZE", 2)
+    keys = [f"batch{i}.txt" for i in range(5)]
+    for key in keys:
+        s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"test")
+    storage = AsyncS3Storage(max_workers=2)
+    delete_batch = storage.storage.delete_batch
+    batches = []
+
+    def failing_delete_batch(batch: list[str]) -> dict[str, str]:
+        batches.append(batch)
+        if "batch2.txt" in batch:
+            raise ClientError({"Error": {"Code": "SlowDown"}}, "DeleteObjects")
+        return delete_batch(batch)
+
+    monkeypatch.setattr(storage.storage, "delete_batch", failing_delete_batch)
+    try:
+        failed = await storage.delete_objects(keys)
+    finally:
+        storage.close()
+
+    assert sorted(map(len, batches)) == [1, 2, 2]
+    # the keys of the failed request are reported for a retry
+    assert list(failed) == ["batch2.txt", "batch3.txt"]
+    listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    assert [item["Key"] for item in listed["Contents"]] == list(failed)
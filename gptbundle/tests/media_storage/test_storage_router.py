@@ -1,18 +1,34 @@
+import hashlib
 import io
+import time
+from unittest.mock import AsyncMock
 
 import boto3
 import pytest
 from moto import mock_aws
+from PIL import Image
 
 from gptbundle.common.config import settings
+from gptbundle.media_storage.content import content_key
+from gptbundle.media_storage.images import ImageVariant, has_variants, variant_key
+from gptbundle.media_storage.models import PendingUpload
+from gptbundle.media_storage.storage import AsyncS3Storage, S3Storage
 from gptbundle.security.service import generate_access_token
 
 
+def _png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "teal").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 @pytest.fixture
 def s3_setup(monkeypatch):
     monkeypatch.setattr(
         "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
     )
+    # the shared client has to be created inside the mock
+    monkeypatch.setattr(S3Storage, "_shared", None)
     with mock_aws():
         s3 = boto3.client("s3", region_name=settings.S3_REGION)
         bucket_config = {}
@@ -49,6 +65,45 @@ async def test_upload_media_success(client, s3_setup):
         # Verify file exists in S3
         response_s3 = s3_setup.get_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
         assert response_s3["Body"].read() in [b"dummy image 1", b"dummy image 2"]
+        # pending until a message attaches it
+        PendingUpload.get(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_upload_media_renders_image_variants(client, s3_setup):
+    token = generate_access_token("variants@example.com")
+    image = _png(3000, 2000)
+
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_media",
+        files=[
+            ("files", ("photo.png", io.BytesIO(image), "image/png")),
+            ("files", ("doc.pdf", io.BytesIO(b"%PDF"), "application/pdf")),
+        ],
+        cookies={"access_token": token},
+    )
+
+    assert response.status_code == 200
+    image_key, pdf_key = response.json()["keys"]
+    try:
+        assert has_variants(image_key)
+        assert not has_variants(pdf_key)
+        original = s3_setup.get_object(Bucket=settings.S3_BUCKET_NAME, Key=image_key)
+        assert original["Body"].read() == image
+        preview = s3_setup.get_object(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=variant_key(image_key, ImageVariant.PREVIEW),
+        )
+        assert preview["ContentType"] == "image/webp"
+        assert Image.open(preview["Body"]).size == (
+            settings.IMAGE_PREVIEW_MAX_SIZE,
+            settings.IMAGE_PREVIEW_MAX_SIZE * 2 // 3,
+        )
+        listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+        assert listed["KeyCount"] == 4
+    finally:
+        for key in (image_key, pdf_key):
+            PendingUpload(key).delete()
 
 
 @pytest.mark.asyncio
@@ -60,3 +115,251 @@ async def test_upload_media_unauthenticated(client):
     )
 
     assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_upload_media_direct(client, s3_setup, monkeypatch):
+    user_email = "direct@example.com"
+    token = generate_access_token(user_email)
+
+    async def upload(*files):
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/upload_media",
+            params={"direct": True},
+            files=[("files", (name, io.BytesIO(data))) for name, data in files],
+            cookies={"access_token": token},
+        )
+        assert response.status_code == 200
+        return response.json()["keys"]
+
+    image_key, pdf_key = await upload(("test1.jpg", b"image"), ("doc.PDF", b"pdf"))
+    keys = [image_key, pdf_key]
+    try:
+        assert image_key == content_key(
+            user_email, hashlib.sha256(b"image").hexdigest(), ".jpg"
+        )
+        assert pdf_key.endswith(".pdf")
+        for key in keys:
+            s3_setup.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+            assert PendingUpload.get(key).user_email == user_email
+
+        # the same content again is not uploaded a second time
+        upload_fileobj = AsyncMock()
+        monkeypatch.setattr(AsyncS3Storage.shared(), "upload_fileobj", upload_fileobj)
+        assert await upload(("copy.PDF", b"pdf")) == [pdf_key]
+        upload_fileobj.assert_not_awaited()
+    finally:
+        for key in keys:
+            PendingUpload(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_upload_media_direct_while_swept(client, s3_setup):
+    user_email = "direct_swept@example.com"
+    token = generate_access_token(user_email)
+    key = content_key(user_email, hashlib.sha256(b"swept").hexdigest(), ".pdf")
+
+    async def upload():
+        return await client.post(
+            f"{settings.API_V1_STR}/storage/upload_media",
+            params={"direct": True},
+            files=[("files", ("doc.pdf", io.BytesIO(b"swept")))],
+            cookies={"access_token": token},
+        )
+
+    try:
+        assert (await upload()).status_code == 200
+        # a sweeper claimed the expired record and is deleting the object
+        claimed_at = time.time()
+        PendingUpload(key).update(
+            actions=[
+                PendingUpload.uploaded_at.set(0),
+                PendingUpload.sweeping_at.set(claimed_at),
+            ]
+        )
+
+        assert (await upload()).status_code == 409
+        assert PendingUpload.get(key).sweeping_at == claimed_at
+
+        # swept: the object and its record are gone, the upload stores it again
+        s3_setup.delete_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+        PendingUpload(key).delete()
+        assert (await upload()).status_code == 200
+        s3_setup.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+        assert PendingUpload.get(key).sweeping_at is None
+    finally:
+        PendingUpload(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_upload_media_limits(client, s3_setup, monkeypatch):
+    token = generate_access_token("test@example.com")
+    monkeypatch.setattr(settings, "S3_UPLOAD_MAX_FILES", 2)
+    monkeypatch.setattr(settings, "S3_UPLOAD_MAX_FILE_SIZE", 10)
+
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_media",
+        files=[("files", (f"{i}.jpg", io.BytesIO(b"small"))) for i in range(3)],
+        cookies={"access_token": token},
+    )
+    assert response.status_code == 413
+
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_media",
+        files=[("files", ("large.jpg", io.BytesIO(b"x" * 11)))],
+        cookies={"access_token": token},
+    )
+    assert response.status_code == 413
+
+    listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    assert listed["KeyCount"] == 0
+
+
+@pytest.mark.asyncio
+async def test_upload_policies_and_confirm(client, s3_setup):
+    user_email = "policy@example.com"
+    token = generate_access_token(user_email)
+
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_policies",
+        json={
+            "files": [
+                {"filename": "a.png", "content_type": "image/png", "size": 4},
+                {"filename": "b.pdf", "content_type": "application/pdf", "size": 4},
+            ]
+        },
+        cookies={"access_token": token},
+    )
+    assert response.status_code == 200
+    policies = response.json()["policies"]
+    keys = [policy["key"] for policy in policies]
+    try:
+        assert all(key.startswith(settings.S3_TEMP_PREFIX) for key in keys)
+        assert policies[0]["fields"]["Content-Type"] == "image/png"
+        assert "policy" in policies[0]["fields"]
+
+        # what the browser does with the policy
+        s3_setup.put_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=keys[0], Body=_png(40, 30)
+        )
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/confirm_uploads",
+            json={"keys": keys},
+            cookies={"access_token": token},
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == {
+            "missing": keys[1:],
+            "rejected": [],
+            "invalid": [],
+        }
+        # the image got its variants, the PDF does not have any
+        assert has_variants(keys[0])
+        assert not has_variants(keys[1])
+        thumbnail = s3_setup.get_object(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=variant_key(keys[0], ImageVariant.THUMBNAIL),
+        )
+        assert thumbnail["ContentType"] == "image/webp"
+
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/confirm_uploads",
+            json={"keys": keys[:1]},
+            cookies={"access_token": generate_access_token("other@example.com")},
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == {
+            "missing": [],
+            "rejected": keys[:1],
+            "invalid": [],
+        }
+
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/confirm_uploads",
+            json={"keys": keys[:1]},
+            cookies={"access_token": token},
+        )
+        assert response.status_code == 200
+        assert response.json() == {"keys": keys[:1]}
+    finally:
+        for key in keys:
+            PendingUpload(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_confirm_uploads_invalid_image(client, s3_setup):
+    token = generate_access_token("policy@example.com")
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_policies",
+        json={"files": [{"filename": "a.png", "content_type": "image/png", "size": 4}]},
+        cookies={"access_token": token},
+    )
+    key = response.json()["policies"][0]["key"]
+    try:
+        s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"data")
+
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/confirm_uploads",
+            json={"keys": [key]},
+            cookies={"access_token": token},
+        )
+
+        assert response.status_code == 400
+        assert response.json()["detail"]["invalid"] == [key]
+        listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+        assert listed["KeyCount"] == 0
+    finally:
+        PendingUpload(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_confirm_uploads_of_other_users(client, s3_setup, monkeypatch):
+    token = generate_access_token("policy@example.com")
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_policies",
+        json={"files": [{"filename": "a.png", "content_type": "image/png", "size": 4}]},
+        cookies={"access_token": token},
+    )
+    key = response.json()["policies"][0]["key"]
+    stored_key = f"{settings.S3_PERMANENT_PREFIX}{settings.S3_IMAGE_PREFIX}b.png"
+    try:
+        for s3_key in (key, stored_key):
+            s3_setup.put_object(
+                Bucket=settings.S3_BUCKET_NAME, Key=s3_key, Body=b"data"
+            )
+        head_object = AsyncMock()
+        monkeypatch.setattr(AsyncS3Storage.shared(), "head_object", head_object)
+
+        response = await client.post(
+            f"{settings.API_V1_STR}/storage/confirm_uploads",
+            json={"keys": [key, stored_key]},
+            cookies={"access_token": generate_access_token("other@example.com")},
+        )
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == {
+            "missing": [],
+            "rejected": [key, stored_key],
+            "invalid": [],
+        }
+        # neither read nor deleted, though Pillow cannot read them
+        head_object.assert_not_called()
+        listed = s3_setup.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+        assert listed["KeyCount"] == 2
+    finally:
+        PendingUpload(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_upload_policies_content_type(client, s3_setup):
+    token = generate_access_token("policy@example.com")
+
+    response = await client.post(
+        f"{settings.API_V1_STR}/storage/upload_policies",
+        json={
+            "files": [{"filename": "a.exe", "content_type": "text/x-script", "size": 4}]
+        },
+        cookies={"access_token": token},
+    )
+
+    assert response.status_code == 415
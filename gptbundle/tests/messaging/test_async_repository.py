@@ -0,0 +1,157 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from gptbundle.messaging.exceptions import (
+    ChatAlreadyExistsError,
+    ChatVersionConflictError,
+)
+from gptbundle.messaging.models import Chat as ChatModel
+from gptbundle.messaging.repository import ChatRepository, chat_write_states
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+
+
+def _message(content: str, role: MessageRole = MessageRole.USER) -> MessageCreate:
+    return MessageCreate(
+        content=content,
+        role=role,
+        message_type="text",
+        llm_model="gpt4",
+    )
+
+
+@pytest.mark.asyncio
+async def test_async_repository_round_trip(async_chat_repo, cleanup_chats: list):
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = f"async_repo_{uuid.uuid4().hex[:8]}@example.com"
+    chat_in = ChatCreate(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[_message("Hello async")],
+    )
+
+    await async_chat_repo.create_chat(chat_in)
+    cleanup_chats.append((chat_id, timestamp))
+    with pytest.raises(ChatAlreadyExistsError):
+        await async_chat_repo.create_chat(chat_in)
+
+    assert await async_chat_repo.append_messages(
+        chat_id,
+        timestamp,
+        [_message("Hi there", MessageRole.ASSISTANT), _message("Bye")],
+        user_email,
+    )
+    assert not await async_chat_repo.append_messages(
+        chat_id, timestamp, [_message("intruder")], "intruder@example.com"
+    )
+
+    chat = await async_chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert [msg.content for msg in chat.messages] == ["Hello async", "Hi there", "Bye"]
+    assert await async_chat_repo.get_chat(chat_id, timestamp, "x@example.com") is None
+    # both repositories read and write the same layout
+    sync_chat = ChatRepository().get_chat(chat_id, timestamp, user_email)
+    assert sync_chat == chat
+
+    page = await async_chat_repo.get_messages_paginated(
+        chat_id, timestamp, user_email, limit=2
+    )
+    assert len(page["items"]) == 2
+    assert page["last_eval_key"] is not None
+
+    summaries = await async_chat_repo.get_chats_by_user_email_paginated(user_email)
+    assert len(summaries["items"]) == 1
+    assert summaries["items"][0].message_count == 3
+    assert summaries["items"][0].title == "Hello async"
+
+
+@pytest.mark.asyncio
+async def test_async_repository_delete_chat(async_chat_repo, cleanup_chats: list):
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "async_repo_delete@example.com"
+    await async_chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message(f"message {i}") for i in range(30)],
+        )
+    )
+    cleanup_chats.append((chat_id, timestamp))
+
+    assert not await async_chat_repo.delete_chat(
+        chat_id, timestamp, "other@example.com"
+    )
+    assert await async_chat_repo.delete_chat(chat_id, timestamp, user_email)
+    assert await async_chat_repo.get_chat(chat_id, timestamp, user_email) is None
+    assert not await async_chat_repo.delete_chat(chat_id, timestamp, user_email)
+
+
+@pytest.mark.asyncio
+async def test_async_repository_version_conflict(async_chat_repo, cleanup_chats: list):
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "async_repo_version@example.com"
+    await async_chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("first")],
+        )
+    )
+    cleanup_chats.append((chat_id, timestamp))
+
+    # the sync repository plays the concurrent writer
+    assert ChatRepository().append_messages(
+        chat_id, timestamp, [_message("second")], user_email
+    )
+    chat_write_states.set(chat_id, timestamp, 1, 1)
+
+    with pytest.raises(ChatVersionConflictError):
+        await async_chat_repo.append_messages(
+            chat_id, timestamp, [_message("third")], user_email
+        )
+    assert await async_chat_repo.append_messages(
+        chat_id, timestamp, [_message("third")], user_email
+    )
+    assert chat_write_states.get(chat_id, timestamp) == (3, 3)
+
+    chat = await async_chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert [msg.content for msg in chat.messages] == ["first", "second", "third"]
+
+
+@pytest.mark.asyncio
+async def test_async_repository_pages_legacy_messages(
+    async_chat_repo, cleanup_chats: list
+):
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "async_repo_legacy@example.com"
+    ChatModel(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[_message("legacy").model_dump()],
+    ).save()
+    cleanup_chats.append((chat_id, timestamp))
+    assert await async_chat_repo.append_messages(
+        chat_id, timestamp, [_message("appended")], user_email
+    )
+
+    page = await async_chat_repo.get_messages_paginated(
+        chat_id, timestamp, user_email, limit=1
+    )
+    assert [msg.content for msg in page["items"]] == ["legacy"]
+    page = await async_chat_repo.get_messages_paginated(
+        chat_id,
+        timestamp,
+        user_email,
+        limit=5,
+        last_evaluated_key=page["last_eval_key"],
+    )
+    assert [msg.content for msg in page["items"]] == ["appended"]
+    assert page["last_eval_key"] is None
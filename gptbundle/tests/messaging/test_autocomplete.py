@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from gptbundle.messaging.autocomplete import AutocompleteCoalescer
+from gptbundle.messaging.outbox import chat_created_event
+from gptbundle.messaging.schemas import Chat, MessageCreate, MessageRole
+from gptbundle.messaging.search_cache import SearchResultCache
+from gptbundle.messaging.search_service import autocomplete_chats
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
+
+
+@pytest.mark.asyncio
+async def test_coalescer_drops_superseded_queries():
+    coalescer = AutocompleteCoalescer(debounce_seconds=0.05)
+    searched = []
+
+    async def _search(query: str) -> str:
+        searched.append(query)
+        return query
+
+    results = await asyncio.gather(
+        *(
+            coalescer.run("u@example.com", query, lambda q=query: _search(q))
+            for query in ("p", "pe", "pen")
+        ),
+        coalescer.run("v@example.com", "x", lambda: _search("x")),
+    )
+    # only the last keystroke of a session is searched
+    assert results == [None, None, "pen", "x"]
+    assert sorted(searched) == ["pen", "x"]
+    assert coalescer.superseded == 2
+
+
+@pytest.mark.asyncio
+async def test_coalescer_shares_identical_searches_in_flight():
+    coalescer = AutocompleteCoalescer(debounce_seconds=0)
+    release = asyncio.Event()
+    calls = 0
+
+    async def _search() -> str:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    first = asyncio.create_task(coalescer.run("u@example.com", "pen", _search))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(coalescer.run("u@example.com", "pen", _search))
+    await asyncio.sleep(0.01)
+    release.set()
+
+    assert await first == await second == "result"
+    assert calls == 1
+    assert coalescer.coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_autocomplete_chats_on_sqlite(tmp_path):
+    backend = SQLiteSearchBackend(str(tmp_path / "search.db"))
+    user_email = "autocomplete@example.com"
+    chat = Chat(
+        chat_id="chat-1",
+        timestamp=1.0,
+        user_email=user_email,
+        messages=[
+            MessageCreate(
+                content="planning a trip to Reykjavik",
+                role=MessageRole.USER,
+                llm_model="x",
+            )
+        ],
+    )
+    cache = SearchResultCache(settle_seconds=0, enabled=True)
+    coalescer = AutocompleteCoalescer(debounce_seconds=0)
+    try:
+        await backend.apply_events([chat_created_event(chat)])
+        response = await autocomplete_chats(
+            backend, user_email, "trip to reyk", cache=cache, coalescer=coalescer
+        )
+        assert [item.chat_id for item in response.items] == ["chat-1"]
+        assert response.items[0].title == "planning a trip to Reykjavik"
+        assert "<em>Reykjavik</em>" in response.items[0].snippet
+
+        response = await autocomplete_chats(
+            backend, user_email, "zzz", cache=cache, coalescer=coalescer
+        )
+        assert response.items == []
+    finally:
+        backend.close()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from gptbundle.messaging.elasticsearch_indexer import ElasticsearchBulkIndexer
+from gptbundle.messaging.exceptions import SearchIndexingError
+
+
+class FakeBulkClient:
+    def __init__(self):
+        self.requests = []
+
+    async def bulk(self, operations, refresh):
+        self.requests.append((operations, refresh))
+        items = []
+        for op in operations:
+            if "index" in op or "delete" in op:
+                action, meta = next(iter(op.items()))
+                status = 404 if meta["_id"] == "missing" else 200
+                items.append({action: {"_id": meta["_id"], "status": status}})
+        return {"items": items}
+
+
+def _index(doc_id: str) -> tuple[dict, dict]:
+    return {"index": {"_index": "chats", "_id": doc_id}}, {"chat_id": doc_id}
+
+
+@pytest.mark.asyncio
+async def test_bulk_indexer_batches_until_stopped():
+    client = FakeBulkClient()
+    indexer = ElasticsearchBulkIndexer(client, max_actions=3, flush_interval=10)
+    indexer.start()
+    for i in range(7):
+        await indexer.submit(*_index(f"chat_{i}"))
+    await indexer.submit({"delete": {"_index": "chats", "_id": "missing"}})
+    await indexer.stop()
+
+    assert [len(ops) for ops, _ in client.requests] == [6, 6, 3]
+    assert all(refresh is False for _, refresh in client.requests)
+    metrics = indexer.metrics()
+    assert metrics["flushes"] == 3
+    assert metrics["flushed_actions"] == 8
+    assert metrics["failed_actions"] == 1
+    assert metrics["queue_depth"] == 0
+    assert not metrics["running"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_indexer_wait_for_refresh_flushes_right_away():
+    client = FakeBulkClient()
+    indexer = ElasticsearchBulkIndexer(client, max_actions=100, flush_interval=10)
+    indexer.start()
+    try:
+        await indexer.submit(*_index("queued"))
+        result = await asyncio.wait_for(
+            indexer.submit(*_index("waiting"), wait_for_refresh=True), timeout=1
+        )
+        assert result["_id"] == "waiting"
+        assert client.requests[0][1] == "wait_for"
+        assert len(client.requests[0][0]) == 4
+
+        with pytest.raises(SearchIndexingError) as exc_info:
+            await indexer.submit(
+                {"delete": {"_index": "chats", "_id": "missing"}},
+                wait_for_refresh=True,
+            )
+        assert exc_info.value.status == 404
+    finally:
+        await indexer.stop()
+
+
+class SlowBulkClient(FakeBulkClient):
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def bulk(self, operations, refresh):
+        self.started.set()
+        await self.release.wait()
+        return await super().bulk(operations, refresh)
+
+
+@pytest.mark.asyncio
+async def test_bulk_indexer_survives_cancelled_caller():
+    client = SlowBulkClient()
+    indexer = ElasticsearchBulkIndexer(client, max_actions=100, flush_interval=10)
+    indexer.start()
+    try:
+        # e.g. a websocket that disconnected while its write was in flight
+        caller = asyncio.create_task(
+            indexer.submit(*_index("cancelled"), wait_for_result=True)
+        )
+        await asyncio.wait_for(client.started.wait(), timeout=1)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        client.release.set()
+
+        result = await asyncio.wait_for(
+            indexer.submit(*_index("next"), wait_for_result=True), timeout=1
+        )
+        assert result["_id"] == "next"
+        assert indexer.running
+    finally:
+        client.release.set()
+        await indexer.stop()
@@ -2,7 +2,16 @@ from datetime import datetime
 
 import pytest
 
-from gptbundle.messaging.schemas import Chat, MessageCreate, MessageRole
+from gptbundle.messaging.elasticsearch_repository import (
+    MESSAGES_ALIAS,
+    index_messages_operations,
+)
+from gptbundle.messaging.schemas import (
+    Chat,
+    MessageCreate,
+    MessageRole,
+    MessageSearchSort,
+)
 
 
 @pytest.mark.asyncio
@@ -112,8 +121,167 @@ async def test_delete_from_es(es_repo, cleanup_es: list):
     assert len(results) == 1
 
     # Delete it
-    await es_repo.delete_chat(chat_id)
+    await es_repo.delete_chat(chat_id, user_email)
 
     # Verify it's gone
     results_after = await es_repo.search_chats(user_email, "delete")
     assert len(results_after) == 0
+
+
+@pytest.mark.asyncio
+async def test_append_messages_to_es(es_repo, cleanup_es: list):
+    chat_id = "es_append_messages_id"
+    user_email = "es_append@example.com"
+
+    chat = Chat(
+        chat_id=chat_id,
+        user_email=user_email,
+        timestamp=datetime.now().timestamp(),
+        messages=[
+            MessageCreate(
+                content="first message",
+                role=MessageRole.USER,
+                message_type="text",
+                llm_model="gpt4",
+            )
+        ],
+    )
+    await es_repo.store_chat(chat)
+    cleanup_es.append(chat_id)
+
+    assert await es_repo.append_messages(
+        chat_id,
+        user_email,
+        [
+            MessageCreate(
+                content="appended pdf answer",
+                role=MessageRole.ASSISTANT,
+                message_type="text",
+                pdf_s3_keys=["doc.pdf"],
+                llm_model="gpt4",
+            )
+        ],
+    )
+
+    results = await es_repo.search_chats(user_email, "appended")
+    assert len(results) == 1
+    assert [msg.content for msg in results[0].messages] == [
+        "first message",
+        "appended pdf answer",
+    ]
+    assert results[0].is_rag
+
+    assert not await es_repo.append_messages(
+        "es_not_indexed_id", user_email, chat.messages
+    )
+
+
+@pytest.mark.asyncio
+async def test_search_messages_pages_with_search_after(es_repo, cleanup_es: list):
+    user_email = "es_messages@example.com"
+    chat_ids = ["es_messages_old_id", "es_messages_new_id"]
+    now = datetime.now().timestamp()
+    for i, chat_id in enumerate(chat_ids):
+        cleanup_es.append(chat_id)
+        errors = await es_repo.apply_operations(
+            index_messages_operations(
+                chat_id,
+                now + i,
+                user_email,
+                [
+                    {"role": "user", "content": f"needle number {seq} in {chat_id}"}
+                    for seq in range(3)
+                ],
+                first_seq=0,
+            )
+        )
+        assert errors == [None, None, None]
+    await es_repo.client.indices.refresh(index=MESSAGES_ALIAS)
+
+    page = await es_repo.search_messages(
+        user_email, "needle", size=4, sort=MessageSearchSort.RECENT
+    )
+    assert [(hit.chat_id, hit.seq) for hit in page.items] == [
+        ("es_messages_new_id", 2),
+        ("es_messages_new_id", 1),
+        ("es_messages_new_id", 0),
+        ("es_messages_old_id", 2),
+    ]
+    assert "<em>needle</em>" in page.items[0].snippets[0]
+    assert page.search_after is not None
+
+    next_page = await es_repo.search_messages(
+        user_email,
+        "needle",
+        size=4,
+        search_after=page.search_after,
+        sort=MessageSearchSort.RECENT,
+    )
+    assert [(hit.chat_id, hit.seq) for hit in next_page.items] == [
+        ("es_messages_old_id", 1),
+        ("es_messages_old_id", 0),
+    ]
+    assert next_page.search_after is None
+
+    assert not (await es_repo.search_messages("other@example.com", "needle")).items
+
+
+@pytest.mark.asyncio
+async def test_search_chat_hits_are_compact(es_repo, cleanup_es: list):
+    chat_id = "es_chat_hits_id"
+    user_email = "es_hits@example.com"
+    chat = Chat(
+        chat_id=chat_id,
+        user_email=user_email,
+        timestamp=datetime.now().timestamp(),
+        messages=[
+            MessageCreate(
+                content=f"long chat message {i} mentioning a haystack",
+                role=MessageRole.USER,
+                message_type="text",
+                llm_model="gpt4",
+            )
+            for i in range(50)
+        ],
+    )
+    await es_repo.store_chat(chat)
+    cleanup_es.append(chat_id)
+
+    hits = await es_repo.search_chat_hits(user_email, "haystack")
+    assert len(hits) == 1
+    assert hits[0].chat_id == chat_id
+    assert hits[0].title == "long chat message 0 mentioning a haystack"
+    assert "<em>haystack</em>" in hits[0].snippet
+    assert hits[0].score > 0
+
+    chats = await es_repo.search_chats(user_email, "haystack")
+    assert len(chats[0].messages) == 50
+
+
+@pytest.mark.asyncio
+async def test_autocomplete_matches_word_prefixes(es_repo, cleanup_es: list):
+    chat_id = "es_autocomplete_id"
+    user_email = "es_autocomplete@example.com"
+    chat = Chat(
+        chat_id=chat_id,
+        user_email=user_email,
+        timestamp=datetime.now().timestamp(),
+        messages=[
+            MessageCreate(
+                content="planning a trip to Reykjavik",
+                role=MessageRole.USER,
+                message_type="text",
+                llm_model="gpt4",
+            )
+        ],
+    )
+    await es_repo.store_chat(chat)
+    cleanup_es.append(chat_id)
+
+    response = await es_repo.autocomplete(user_email, "trip to reykj", timeout=5)
+    assert [item.chat_id for item in response.items] == [chat_id]
+    assert response.items[0].title == "planning a trip to Reykjavik"
+    assert not response.timed_out
+
+    response = await es_repo.autocomplete("other@example.com", "reykj", timeout=5)
+    assert response.items == []
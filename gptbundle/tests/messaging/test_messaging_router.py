@@ -24,7 +24,6 @@ def is_valid_uuid4(uuid_string: str) -> bool:
 
 
 async def create_test_chat(
-    es_repo,
     chat_id: str | None = None,
     timestamp: float | None = None,
     user_email: str = "test@example.com",
@@ -49,20 +48,17 @@ async def create_test_chat(
     }
 
     chat_in = ChatCreate(**kwargs)
-    chat = await create_chat(chat_repo=chat_repo, chat_in=chat_in, es_repo=es_repo)
+    chat = await create_chat(chat_repo=chat_repo, chat_in=chat_in)
     return chat.chat_id, chat.timestamp
 
 
 @pytest.mark.asyncio
-async def test_retrieve_chat_success(
-    client, cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_retrieve_chat_success(client, cleanup_chats: list):
     user_email = "test_get_api@example.com"
     chat_id, timestamp = await create_test_chat(
-        es_repo=es_repo, user_email=user_email, content="Found me"
+        user_email=user_email, content="Found me"
     )
     cleanup_chats.append((chat_id, timestamp))
-    cleanup_es.append(chat_id)
 
     # Retrieve it
     token = generate_access_token(user_email)
@@ -91,23 +87,33 @@ async def test_retrieve_chat_not_found(client):
 
 
 @pytest.mark.asyncio
-async def test_retrieve_chats_success(
-    client, cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_search_metrics_admins_only(client, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_EMAILS", ["admin@example.com"])
+
+    for path in ("search_cache_metrics", "search_indexer_metrics"):
+        response = await client.get(
+            f"{settings.API_V1_STR}/messaging/{path}",
+            cookies={"access_token": generate_access_token("user@example.com")},
+        )
+        assert response.status_code == 403
+
+    response = await client.get(
+        f"{settings.API_V1_STR}/messaging/search_cache_metrics",
+        cookies={"access_token": generate_access_token("admin@example.com")},
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_retrieve_chats_success(client, cleanup_chats: list):
     user_email = f"multi_chat_user_{uuid.uuid4().hex[:8]}@example.com"
 
     # Create two chats
-    c1_id, c1_ts = await create_test_chat(
-        es_repo=es_repo, user_email=user_email, content="Msg 1"
-    )
+    c1_id, c1_ts = await create_test_chat(user_email=user_email, content="Msg 1")
     cleanup_chats.append((c1_id, c1_ts))
-    cleanup_es.append(c1_id)
 
-    c2_id, c2_ts = await create_test_chat(
-        es_repo=es_repo, user_email=user_email, content="Msg 2"
-    )
+    c2_id, c2_ts = await create_test_chat(user_email=user_email, content="Msg 2")
     cleanup_chats.append((c2_id, c2_ts))
-    cleanup_es.append(c2_id)
 
     # Retrieve all
     token = generate_access_token(user_email)
@@ -132,18 +138,13 @@ async def test_retrieve_chats_not_found(client):
 
 
 @pytest.mark.asyncio
-async def test_retrieve_chats_pagination(
-    client, cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_retrieve_chats_pagination(client, cleanup_chats: list):
     user_email = f"paginated_user_{uuid.uuid4().hex[:8]}@example.com"
 
     # Create 3 chats
     for i in range(3):
-        c_id, c_ts = await create_test_chat(
-            es_repo=es_repo, user_email=user_email, content=f"Msg {i}"
-        )
+        c_id, c_ts = await create_test_chat(user_email=user_email, content=f"Msg {i}")
         cleanup_chats.append((c_id, c_ts))
-        cleanup_es.append(c_id)
 
     token = generate_access_token(user_email)
 
@@ -170,14 +171,11 @@ async def test_retrieve_chats_pagination(
 
 
 @pytest.mark.asyncio
-async def test_delete_chat_success(
-    client, cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_delete_chat_success(client, cleanup_chats: list):
     user_email = "test_delete_api@example.com"
     chat_id, timestamp = await create_test_chat(
-        es_repo=es_repo, user_email=user_email, content="To be deleted"
+        user_email=user_email, content="To be deleted"
     )
-    cleanup_es.append(chat_id)
     # No need to add to cleanup_chats since we're deleting it
 
     # Delete the chat
@@ -208,3 +206,29 @@ async def test_delete_chat_not_found(client):
     )
     assert response.status_code == 404
     assert response.json()["detail"] == "Chat not found"
+
+
+@pytest.mark.asyncio
+async def test_retrieve_chat_messages_pagination(client, cleanup_chats: list):
+    user_email = f"messages_user_{uuid.uuid4().hex[:8]}@example.com"
+    chat_id, timestamp = await create_test_chat(
+        user_email=user_email, content="First page"
+    )
+    cleanup_chats.append((chat_id, timestamp))
+
+    token = generate_access_token(user_email)
+    response = await client.get(
+        f"{settings.API_V1_STR}/messaging/chat/{chat_id}/{timestamp}/messages?limit=1",
+        cookies={"access_token": token},
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert len(content["items"]) == 1
+    assert content["items"][0]["content"] == "First page"
+
+    other_token = generate_access_token("someone_else@example.com")
+    response = await client.get(
+        f"{settings.API_V1_STR}/messaging/chat/{chat_id}/{timestamp}/messages",
+        cookies={"access_token": other_token},
+    )
+    assert response.status_code == 404
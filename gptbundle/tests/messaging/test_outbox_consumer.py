@@ -0,0 +1,209 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from gptbundle.common.config import settings
+from gptbundle.messaging.elasticsearch_repository import ElasticsearchRepository
+from gptbundle.messaging.exceptions import SearchIndexingError
+from gptbundle.messaging.models import SearchOutboxCheckpoint
+from gptbundle.messaging.outbox import outbox_shard
+from gptbundle.messaging.outbox_consumer import SearchOutboxConsumer
+from gptbundle.messaging.repository import ChatRepository
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+
+
+class RecordingSearchRepository(ElasticsearchRepository):
+    """Records the operations the consumer applies, failing the ones listed
+    in failures with the given status once."""
+
+    def __init__(self, failures: dict[str, int] | None = None):
+        super().__init__()
+        self.operations = []
+        self.failures = failures or {}
+        self.deleted_messages = []
+
+    async def apply_operations(self, operations):
+        errors = []
+        for op in operations:
+            self.operations.append(op)
+            action, meta = next(iter(op.action.items()))
+            status = self.failures.pop(f"{action}:{meta['_id']}", None)
+            errors.append(SearchIndexingError(status) if status else None)
+        return errors
+
+    async def delete_chat_messages(self, chat_id, user_email):
+        self.deleted_messages.append(chat_id)
+
+
+def _message(content: str) -> MessageCreate:
+    return MessageCreate(
+        content=content, role=MessageRole.USER, message_type="text", llm_model="gpt4"
+    )
+
+
+def _release_lease(shard: int) -> None:
+    SearchOutboxCheckpoint(shard).update(
+        actions=[SearchOutboxCheckpoint.lease_expires_at.set(0)]
+    )
+
+
+async def _drain(consumer: SearchOutboxConsumer, shard: int) -> None:
+    # a consumer of an app started by another test may still hold the lease
+    _release_lease(shard)
+    while await consumer.process_shard(shard):
+        pass
+
+
+def _chat_operations(es_repo: RecordingSearchRepository, chat_id: str) -> list:
+    return [
+        next(iter(op.action))
+        for op in es_repo.operations
+        if next(iter(op.action.values()))["_id"] == chat_id
+    ]
+
+
+@pytest.mark.asyncio
+async def test_outbox_consumer_applies_chat_writes(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "outbox@example.com"
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("hello")],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+    assert chat_repo.append_messages(chat_id, timestamp, [_message("more")], user_email)
+    assert chat_repo.delete_chat(chat_id, timestamp, user_email)
+
+    es_repo = RecordingSearchRepository()
+    consumer = SearchOutboxConsumer(search_backend=es_repo, read_delay=0)
+    shard = outbox_shard(chat_id)
+    await _drain(consumer, shard)
+
+    assert _chat_operations(es_repo, chat_id) == ["index", "update", "delete"]
+    append = next(
+        op
+        for op in es_repo.operations
+        if "update" in op.action and op.action["update"]["_id"] == chat_id
+    )
+    assert append.body["script"]["params"]["first_seq"] == 1
+    assert append.body["script"]["params"]["messages"][0]["content"] == "more"
+    # every message is indexed as a document of its own as well
+    message_documents = [
+        op.body
+        for op in es_repo.operations
+        if op.action.get("index", {}).get("_id", "").startswith(f"{chat_id}#")
+    ]
+    assert [(doc["seq"], doc["content"]) for doc in message_documents] == [
+        (0, "hello"),
+        (1, "more"),
+    ]
+    assert chat_id in es_repo.deleted_messages
+    # everything of the chat is routed to the shard of its user
+    assert all(
+        next(iter(op.action.values()))["routing"] == user_email
+        for op in es_repo.operations
+        if next(iter(op.action.values()))["_id"].startswith(chat_id)
+    )
+
+    # the checkpoint moved, nothing is applied twice
+    assert await consumer.process_shard(shard) == 0
+    # the shard is leased to the first consumer
+    assert await SearchOutboxConsumer(read_delay=0).process_shard(shard) == 0
+    _release_lease(shard)
+
+
+@pytest.mark.asyncio
+async def test_outbox_consumer_retries_and_reindexes_missing_chats(
+    sync_cleanup_chats: list,
+):
+    chat_repo = ChatRepository()
+    user_email = "outbox_retry@example.com"
+    timestamp = datetime.now().timestamp()
+    failing_chat_id, missing_chat_id = str(uuid.uuid4()), str(uuid.uuid4())
+    # in a shared shard the retry of one chat would resend the other one too
+    while outbox_shard(missing_chat_id) == outbox_shard(failing_chat_id):
+        missing_chat_id = str(uuid.uuid4())
+    for chat_id in (failing_chat_id, missing_chat_id):
+        chat_repo.create_chat(
+            ChatCreate(
+                chat_id=chat_id,
+                timestamp=timestamp,
+                user_email=user_email,
+                messages=[_message("hello")],
+            )
+        )
+        sync_cleanup_chats.append((chat_id, timestamp))
+        assert chat_repo.append_messages(
+            chat_id, timestamp, [_message("more")], user_email
+        )
+
+    es_repo = RecordingSearchRepository(
+        failures={f"index:{failing_chat_id}": 503, f"update:{missing_chat_id}": 404}
+    )
+    consumer = SearchOutboxConsumer(search_backend=es_repo, read_delay=0)
+    for shard in {outbox_shard(failing_chat_id), outbox_shard(missing_chat_id)}:
+        await _drain(consumer, shard)
+        _release_lease(shard)
+
+    # everything from the failed operation on was sent again, in order
+    assert _chat_operations(es_repo, failing_chat_id) == [
+        "index",
+        "update",
+        "index",
+        "update",
+    ]
+    # the append to the missing document became an index of the whole chat
+    assert _chat_operations(es_repo, missing_chat_id) == ["index", "update", "index"]
+    reindexed = next(
+        op
+        for op in reversed(es_repo.operations)
+        if op.action.get("index", {}).get("_id") == missing_chat_id
+    )
+    assert [msg["content"] for msg in reindexed.body["messages"]] == ["hello", "more"]
+    assert reindexed.body["next_seq"] == 2
+
+
+@pytest.mark.asyncio
+async def test_outbox_consumer_keeps_its_leases(monkeypatch):
+    shard = 0
+    _release_lease(shard)
+    consumer = SearchOutboxConsumer(
+        search_backend=RecordingSearchRepository(), read_delay=3600
+    )
+    other = SearchOutboxConsumer(
+        search_backend=RecordingSearchRepository(), read_delay=3600
+    )
+    acquired = []
+    for c in (consumer, other):
+        acquire_lease = c._acquire_lease
+
+        def _acquire_lease(shard, c=c, acquire_lease=acquire_lease):
+            acquired.append(c)
+            return acquire_lease(shard)
+
+        monkeypatch.setattr(c, "_acquire_lease", _acquire_lease)
+    try:
+        for _ in range(3):
+            await consumer.process_shard(shard)
+            await other.process_shard(shard)
+        # one write each, the held lease is not close to its expiry and the
+        # other consumer waits for the lease interval
+        assert acquired == [consumer, other]
+
+        monkeypatch.setattr(
+            settings,
+            "SEARCH_OUTBOX_LEASE_SECONDS",
+            settings.SEARCH_OUTBOX_LEASE_SECONDS * 10,
+        )
+        await consumer.process_shard(shard)
+        assert acquired == [consumer, other, consumer]
+        assert SearchOutboxCheckpoint.get(shard).owner == consumer.owner
+    finally:
+        _release_lease(shard)
@@ -0,0 +1,183 @@
+import time
+import uuid
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.content import add_references, content_key
+from gptbundle.media_storage.models import ContentObject, PendingUpload
+from gptbundle.media_storage.storage import AsyncS3Storage, S3Storage
+from gptbundle.messaging.models import ChatMessage, ChatPurge
+from gptbundle.messaging.purge_worker import ChatPurgeWorker, retry_delay
+from gptbundle.messaging.repository import ChatRepository
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+
+USER_EMAIL = "purge@example.com"
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    monkeypatch.setattr(
+        "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
+    )
+    monkeypatch.setattr(S3Storage, "_shared", None)
+    storage = AsyncS3Storage(max_workers=2)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name=settings.S3_REGION)
+        bucket_config = {}
+        if settings.S3_REGION != "us-east-1":
+            bucket_config["CreateBucketConfiguration"] = {
+                "LocationConstraint": settings.S3_REGION
+            }
+        s3.create_bucket(Bucket=settings.S3_BUCKET_NAME, **bucket_config)
+        yield s3, storage
+    storage.close()
+
+
+@pytest.fixture
+def content_keys():
+    keys = [content_key(USER_EMAIL, uuid.uuid4().hex, ".pdf") for _ in range(2)]
+    yield keys
+    for key in keys:
+        PendingUpload(key).delete()
+        ContentObject(key).delete()
+
+
+@pytest.fixture
+def llm_cleanup():
+    with (
+        patch("gptbundle.messaging.purge_worker.delete_vector_store") as vector_store,
+        patch("gptbundle.messaging.purge_worker.get_chat_history") as chat_history,
+    ):
+        chat_history.return_value = MagicMock()
+        yield vector_store, chat_history
+
+
+def _deleted_chat(sync_cleanup_chats: list, s3_keys: list[str]) -> tuple[str, float]:
+    repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=USER_EMAIL,
+            messages=[
+                MessageCreate(
+                    content="Attachments",
+                    role=MessageRole.USER,
+                    img_s3_keys=[key for key in s3_keys if key.endswith(".png")],
+                    pdf_s3_keys=[key for key in s3_keys if key.endswith(".pdf")],
+                    llm_model="gpt4",
+                ),
+                MessageCreate(
+                    content="No attachments",
+                    role=MessageRole.ASSISTANT,
+                    llm_model="gpt4",
+                ),
+            ],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+    assert repo.delete_chat(chat_id, timestamp, USER_EMAIL)
+    return chat_id, timestamp
+
+
+@pytest.mark.asyncio
+async def test_purge_worker_purges_deleted_chat(
+    s3_setup, content_keys, llm_cleanup, sync_cleanup_chats
+):
+    s3, storage = s3_setup
+    shared, single = content_keys
+    own_key = f"{settings.S3_PERMANENT_PREFIX}{uuid.uuid4()}.png"
+    s3.put_object(Bucket=settings.S3_BUCKET_NAME, Key=own_key, Body=b"png")
+    # the shared PDF is attached to another chat as well
+    add_references([shared, shared, single])
+    chat_id, timestamp = _deleted_chat(sync_cleanup_chats, [own_key, *content_keys])
+
+    await ChatPurgeWorker(storage=storage, batch_size=100).purge_due()
+
+    assert ChatPurge.count(chat_id) == 0
+    assert ChatMessage.count(chat_id) == 0
+    assert "Contents" not in s3.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    assert ContentObject.get(shared).refs == 1
+    # left to the sweeper, as an upload that expired already
+    assert ContentObject.get(single).refs == 0
+    expired = time.time() - settings.S3_PENDING_UPLOAD_TTL
+    assert PendingUpload.get(single).uploaded_at <= expired
+    assert PendingUpload.count(shared) == 0
+    # purges other tests left behind may have been due as well
+    vector_store, chat_history = llm_cleanup
+    vector_store.assert_any_call(chat_id)
+    chat_history.assert_any_call(chat_id)
+    chat_history.return_value.clear.assert_called_with()
+
+
+@pytest.mark.asyncio
+async def test_purge_worker_retries(
+    s3_setup, content_keys, llm_cleanup, sync_cleanup_chats
+):
+    _, storage = s3_setup
+    shared = content_keys[0]
+    add_references([shared, shared])
+    chat_id, timestamp = _deleted_chat(sync_cleanup_chats, [shared])
+    vector_store, _ = llm_cleanup
+    vector_store.side_effect = RuntimeError("chroma is down")
+    worker = ChatPurgeWorker(storage=storage, batch_size=100)
+
+    await worker.purge_due()
+
+    purge = ChatPurge.get(chat_id, timestamp)
+    assert purge.attempts == 1
+    assert purge.last_error == "RuntimeError: chroma is down"
+    assert purge.next_attempt_at > time.time() + retry_delay(1) - 60
+    assert purge.s3_keys == [shared]
+    assert ChatMessage.count(chat_id) == 0
+    assert ContentObject.get(shared).refs == 1
+
+    # due again, and the vector store is back
+    purge.update(actions=[ChatPurge.next_attempt_at.set(time.time())])
+    vector_store.side_effect = None
+    await worker.purge_due()
+
+    assert ChatPurge.count(chat_id) == 0
+    # released once only
+    assert ContentObject.get(shared).refs == 1
+    assert worker.purged_chats >= 1
+    assert worker.failed_purges == 1
+
+
+@pytest.mark.asyncio
+async def test_purge_worker_hands_failed_deletes_to_sweeper(
+    s3_setup, llm_cleanup, sync_cleanup_chats
+):
+    _, storage = s3_setup
+    s3_keys = [f"{settings.S3_PERMANENT_PREFIX}{uuid.uuid4()}.png" for _ in range(2)]
+    chat_id, _ = _deleted_chat(sync_cleanup_chats, s3_keys)
+
+    try:
+        with patch.object(
+            storage,
+            "delete_objects",
+            new_callable=AsyncMock,
+            return_value={s3_keys[1]: "InternalError: try again"},
+        ):
+            await ChatPurgeWorker(storage=storage, batch_size=100).purge_due()
+
+        assert ChatPurge.count(chat_id) == 0
+        pending = PendingUpload.get(s3_keys[1])
+        assert pending.user_email == USER_EMAIL
+        assert pending.uploaded_at <= time.time() - settings.S3_PENDING_UPLOAD_TTL
+        assert PendingUpload.count(s3_keys[0]) == 0
+    finally:
+        PendingUpload(s3_keys[1]).delete()
+
+
+def test_retry_delay():
+    assert retry_delay(1) == settings.CHAT_PURGE_RETRY_DELAY
+    assert retry_delay(2) == 2 * settings.CHAT_PURGE_RETRY_DELAY
+    assert retry_delay(100) == settings.CHAT_PURGE_MAX_RETRY_DELAY
@@ -0,0 +1,346 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from pynamodb.exceptions import TransactWriteError
+
+from gptbundle.messaging.exceptions import ChatVersionConflictError
+from gptbundle.messaging.models import Chat as ChatModel
+from gptbundle.messaging.repository import (
+    MAX_APPENDED_MESSAGES,
+    ChatRepository,
+    chat_write_states,
+)
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+
+
+def _message(content: str, role: MessageRole = MessageRole.USER) -> MessageCreate:
+    return MessageCreate(
+        content=content,
+        role=role,
+        message_type="text",
+        llm_model="gpt4",
+    )
+
+
+def test_append_messages_keeps_order(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_append@example.com"
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("first")],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+
+    for i in range(12):
+        assert chat_repo.append_messages(
+            chat_id, timestamp, [_message(f"message {i}")], user_email
+        )
+
+    chat = chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert chat is not None
+    assert [msg.content for msg in chat.messages] == ["first"] + [
+        f"message {i}" for i in range(12)
+    ]
+    assert ChatModel.get(chat_id, timestamp).message_count == 13
+
+
+def test_append_messages_unauthorized_or_missing(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email="owner@example.com",
+            messages=[_message("hello")],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+
+    assert not chat_repo.append_messages(
+        chat_id, timestamp, [_message("intruder")], "intruder@example.com"
+    )
+    assert not chat_repo.append_messages(
+        "nonexistent_id", timestamp, [_message("nobody")], "owner@example.com"
+    )
+    chat = chat_repo.get_chat(chat_id, timestamp, "owner@example.com")
+    assert [msg.content for msg in chat.messages] == ["hello"]
+
+
+def test_get_messages_paginated(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_paginated@example.com"
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message(f"message {i}") for i in range(5)],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+
+    page1 = chat_repo.get_messages_paginated(chat_id, timestamp, user_email, limit=3)
+    assert [msg.content for msg in page1["items"]] == [
+        "message 0",
+        "message 1",
+        "message 2",
+    ]
+    assert page1["last_eval_key"] is not None
+
+    page2 = chat_repo.get_messages_paginated(
+        chat_id,
+        timestamp,
+        user_email,
+        limit=3,
+        last_evaluated_key=page1["last_eval_key"],
+    )
+    assert [msg.content for msg in page2["items"]] == ["message 3", "message 4"]
+
+    assert (
+        chat_repo.get_messages_paginated(chat_id, timestamp, "other@example.com")
+        is None
+    )
+
+
+def test_migrate_legacy_chat(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_migrate@example.com"
+
+    legacy_chat = ChatModel(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[
+            _message("legacy 1").model_dump(),
+            _message("legacy 2", MessageRole.ASSISTANT).model_dump(),
+        ],
+    )
+    legacy_chat.save()
+    sync_cleanup_chats.append((chat_id, timestamp))
+
+    # appended after the deploy, before the migration ran
+    assert chat_repo.append_messages(
+        chat_id, timestamp, [_message("appended")], user_email
+    )
+
+    migrated = chat_repo.migrate_legacy_chat(ChatModel.get(chat_id, timestamp))
+    assert migrated == 2
+
+    chat_model = ChatModel.get(chat_id, timestamp)
+    assert chat_model.messages is None
+    assert chat_model.message_count == 3
+    chat = chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert [msg.content for msg in chat.messages] == [
+        "legacy 1",
+        "legacy 2",
+        "appended",
+    ]
+
+
+def test_chat_summaries_are_maintained_on_write(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = f"repo_summary_{uuid.uuid4().hex[:8]}@example.com"
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("x" * 500)],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+    assert chat_repo.append_messages(
+        chat_id,
+        timestamp,
+        [
+            MessageCreate(
+                content="answer",
+                role=MessageRole.ASSISTANT,
+                message_type="text",
+                llm_model="other-model",
+            )
+        ],
+        user_email,
+    )
+
+    response = chat_repo.get_chats_by_user_email_paginated(user_email)
+    assert len(response["items"]) == 1
+    summary = response["items"][0]
+    assert summary.chat_id == chat_id
+    assert summary.title == "x" * 100
+    assert summary.message_count == 2
+    assert summary.last_model == "other-model"
+    assert not summary.is_rag
+
+
+def test_append_messages_version_conflict(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_version@example.com"
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("first")],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+    assert chat_write_states.get(chat_id, timestamp) == (1, 1)
+    assert chat_repo.append_messages(
+        chat_id, timestamp, [_message("second")], user_email
+    )
+    assert ChatModel.get(chat_id, timestamp).version == 2
+
+    # another process appends behind the back of this one
+    chat_write_states.invalidate(chat_id, timestamp)
+    assert chat_repo.append_messages(
+        chat_id, timestamp, [_message("third")], user_email
+    )
+    chat_write_states.set(chat_id, timestamp, 2, 2)
+
+    with pytest.raises(ChatVersionConflictError):
+        chat_repo.append_messages(chat_id, timestamp, [_message("fourth")], user_email)
+    # the conflict refreshed the cached version, the retry goes through
+    assert chat_repo.append_messages(
+        chat_id, timestamp, [_message("fourth")], user_email
+    )
+
+    chat = chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert [msg.content for msg in chat.messages] == [
+        "first",
+        "second",
+        "third",
+        "fourth",
+    ]
+
+
+def test_append_messages_to_chat_without_version(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_no_version@example.com"
+
+    chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("first")],
+        )
+    )
+    sync_cleanup_chats.append((chat_id, timestamp))
+    # written before chats had a version
+    chat_model = ChatModel.get(chat_id, timestamp)
+    ChatModel._get_connection().update_item(
+        *chat_model._get_hash_range_key_serialized_values(),
+        actions=[ChatModel.version.remove()],
+    )
+    chat_write_states.invalidate(chat_id, timestamp)
+
+    assert chat_repo.append_messages(
+        chat_id, timestamp, [_message("second")], user_email
+    )
+
+    assert ChatModel.get(chat_id, timestamp).version == 1
+    chat = chat_repo.get_chat(chat_id, timestamp, user_email)
+    assert [msg.content for msg in chat.messages] == ["first", "second"]
+
+
+def test_get_messages_paginated_legacy_chat(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "repo_paginated_legacy@example.com"
+
+    ChatModel(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[_message(f"legacy {i}").model_dump() for i in range(3)],
+    ).save()
+    sync_cleanup_chats.append((chat_id, timestamp))
+    for i in range(2):
+        assert chat_repo.append_messages(
+            chat_id, timestamp, [_message(f"appended {i}")], user_email
+        )
+
+    pages = []
+    last_eval_key = None
+    while True:
+        page = chat_repo.get_messages_paginated(
+            chat_id, timestamp, user_email, limit=2, last_evaluated_key=last_eval_key
+        )
+        pages.append([msg.content for msg in page["items"]])
+        last_eval_key = page["last_eval_key"]
+        if last_eval_key is None:
+            break
+
+    assert [content for page in pages for content in page] == [
+        "legacy 0",
+        "legacy 1",
+        "legacy 2",
+        "appended 0",
+        "appended 1",
+    ]
+    assert all(len(page) <= 2 for page in pages)
+
+    unpaged = chat_repo.get_messages_paginated(chat_id, timestamp, user_email)
+    assert [msg.content for msg in unpaged["items"]][:3] == [
+        "legacy 0",
+        "legacy 1",
+        "legacy 2",
+    ]
+
+
+def test_create_chat_writes_nothing_when_a_message_fails(sync_cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    sync_cleanup_chats.append((chat_id, timestamp))
+    # larger than a DynamoDB item may be
+    too_large = _message("x" * 500_000)
+
+    with pytest.raises(TransactWriteError):
+        chat_repo.create_chat(
+            ChatCreate(
+                chat_id=chat_id,
+                timestamp=timestamp,
+                user_email="repo_create@example.com",
+                messages=[_message("first"), too_large],
+            )
+        )
+
+    assert ChatModel.count(chat_id) == 0
+    assert list(chat_repo._query_messages(chat_id, timestamp)) == []
+
+    with pytest.raises(ValueError, match="at most"):
+        chat_repo.create_chat(
+            ChatCreate(
+                chat_id=chat_id,
+                timestamp=timestamp,
+                user_email="repo_create@example.com",
+                messages=[_message("more")] * (MAX_APPENDED_MESSAGES + 1),
+            )
+        )
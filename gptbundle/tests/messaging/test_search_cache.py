@@ -0,0 +1,123 @@
+import pytest
+from pydantic import TypeAdapter
+
+from gptbundle.common.config import settings
+from gptbundle.messaging.outbox import chat_created_event
+from gptbundle.messaging.schemas import Chat, MessageCreate, MessageRole
+from gptbundle.messaging.search_cache import SearchResultCache
+from gptbundle.messaging.search_service import search_chats_by_keyword
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
+
+ADAPTER = TypeAdapter(list[str])
+
+
+class CountingSearch:
+    def __init__(self, result: list[str]):
+        self.result = result
+        self.calls = 0
+
+    async def __call__(self) -> list[str]:
+        self.calls += 1
+        return list(self.result)
+
+
+@pytest.mark.asyncio
+async def test_search_cache_hits_until_invalidated():
+    cache = SearchResultCache(settle_seconds=0, enabled=True)
+    search = CountingSearch(["a"])
+
+    for _ in range(3):
+        assert await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER)
+    assert search.calls == 1
+    # other users and other pages are cached separately
+    await cache.get_or_search("v@example.com", {"q": "x"}, search, ADAPTER)
+    await cache.get_or_search("u@example.com", {"q": "x", "page": 2}, search, ADAPTER)
+    assert search.calls == 3
+
+    search.result = ["a", "b"]
+    await cache.invalidate("u@example.com")
+    assert await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER) == [
+        "a",
+        "b",
+    ]
+    assert search.calls == 4
+
+    metrics = cache.metrics()
+    assert (metrics.hits, metrics.misses, metrics.invalidations) == (2, 4, 1)
+    assert metrics.hit_ratio == pytest.approx(2 / 6)
+
+
+@pytest.mark.asyncio
+async def test_search_cache_skips_results_right_after_a_change():
+    cache = SearchResultCache(settle_seconds=60, enabled=True)
+    search = CountingSearch(["a"])
+
+    # nothing changed yet, cached
+    await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER)
+    await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER)
+    assert search.calls == 1
+
+    # the index may not have refreshed yet, not cached
+    await cache.invalidate("u@example.com")
+    await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER)
+    await cache.get_or_search("u@example.com", {"q": "x"}, search, ADAPTER)
+    assert search.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_search_cache_evicts_least_recently_used():
+    cache = SearchResultCache(max_entries=2, settle_seconds=0, enabled=True)
+    search = CountingSearch(["a"])
+
+    for query in ("x", "y", "x", "z", "x", "y"):
+        await cache.get_or_search("u@example.com", {"q": query}, search, ADAPTER)
+    # y was evicted by z, x was kept by being used
+    assert search.calls == 4
+    assert cache.metrics().entries == 2
+
+
+@pytest.mark.asyncio
+async def test_search_chats_by_keyword_is_cached(tmp_path):
+    backend = SQLiteSearchBackend(str(tmp_path / "search.db"))
+    cache = SearchResultCache(settle_seconds=0, enabled=True)
+    user_email = "cached@example.com"
+
+    def _chat(chat_id: str, timestamp: float) -> Chat:
+        return Chat(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[
+                MessageCreate(content="otters", role=MessageRole.USER, llm_model="x")
+            ],
+        )
+
+    try:
+        await backend.apply_events([chat_created_event(_chat("chat-1", 1.0))])
+        hits = await search_chats_by_keyword(backend, user_email, "otters", cache=cache)
+        assert [hit.chat_id for hit in hits] == ["chat-1"]
+
+        await backend.apply_events([chat_created_event(_chat("chat-2", 2.0))])
+        # the outbox consumer has not invalidated yet
+        hits = await search_chats_by_keyword(backend, user_email, "otters", cache=cache)
+        assert len(hits) == 1
+
+        await cache.invalidate(user_email)
+        hits = await search_chats_by_keyword(backend, user_email, "otters", cache=cache)
+        assert len(hits) == 2
+        assert cache.metrics().hits == 1
+    finally:
+        backend.close()
+
+
+def test_search_cache_settles_past_the_outbox_delay(monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_OUTBOX_READ_DELAY", 5.0)
+
+    cache = SearchResultCache(enabled=True)
+
+    assert cache.settle_seconds > settings.SEARCH_OUTBOX_READ_DELAY
+    assert cache.settle_seconds == (
+        5.0
+        + settings.SEARCH_OUTBOX_POLL_INTERVAL
+        + settings.SEARCH_CACHE_SETTLE_SECONDS
+    )
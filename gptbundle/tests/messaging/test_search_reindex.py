@@ -0,0 +1,228 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from gptbundle.messaging.models import Chat as ChatModel
+from gptbundle.messaging.models import SearchOutboxCheckpoint
+from gptbundle.messaging.outbox import outbox_shard
+from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
+from gptbundle.messaging.search_reindex import SearchReindexer, SQLiteSearchReindexer
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend
+
+
+class FakeIndices:
+    def __init__(self, aliases: dict[str, list[str]]):
+        self.aliases = aliases
+        self.created = {}
+        self.settings = {}
+        self.alias_actions = []
+        self.templates = {}
+
+    async def put_index_template(self, name, index_patterns, template):
+        self.templates[name] = (index_patterns, template)
+
+    async def create(self, index, body):
+        self.created[index] = body
+
+    async def put_settings(self, index, settings):
+        self.settings[index] = settings
+
+    async def refresh(self, index):
+        pass
+
+    async def exists_alias(self, name):
+        return name in self.aliases
+
+    async def get_alias(self, name):
+        return {index: {"aliases": {name: {}}} for index in self.aliases[name]}
+
+    async def exists(self, index):
+        return index in self.aliases
+
+    async def update_aliases(self, actions):
+        self.alias_actions.extend(actions)
+
+
+class FakeLifecycle:
+    def __init__(self):
+        self.policies = {}
+
+    async def put_lifecycle(self, name, policy):
+        self.policies[name] = policy
+
+
+class FakeSearchClient:
+    def __init__(self, failing_chat_id: str | None = None):
+        self.indices = FakeIndices({"chats": ["chats-old"]})
+        self.ilm = FakeLifecycle()
+        self.documents = {}
+        self.failing_chat_id = failing_chat_id
+
+    async def bulk(self, operations):
+        items = []
+        for action, document in zip(operations[::2], operations[1::2], strict=True):
+            meta = action["index"]
+            if meta["_id"] == self.failing_chat_id:
+                items.append({"index": {"_id": meta["_id"], "status": 400}})
+                continue
+            self.documents[meta["_id"]] = (meta["_index"], document)
+            items.append({"index": {"_id": meta["_id"], "status": 201}})
+        return {"items": items}
+
+
+def _message(content: str) -> MessageCreate:
+    return MessageCreate(
+        content=content, role=MessageRole.USER, message_type="text", llm_model="gpt4"
+    )
+
+
+@pytest.mark.asyncio
+async def test_reindex_search_swaps_alias(async_chat_repo, cleanup_chats: list):
+    user_email = "reindex@example.com"
+    timestamp = datetime.now().timestamp()
+    chat_id, legacy_chat_id = str(uuid.uuid4()), str(uuid.uuid4())
+    await async_chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("hello")],
+        )
+    )
+    cleanup_chats.append((chat_id, timestamp))
+    assert await async_chat_repo.append_messages(
+        chat_id, timestamp, [_message("more")], user_email
+    )
+    ChatModel(
+        chat_id=legacy_chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[_message("legacy").model_dump()],
+    ).save()
+    cleanup_chats.append((legacy_chat_id, timestamp))
+    assert await async_chat_repo.append_messages(
+        legacy_chat_id, timestamp, [_message("appended")], user_email
+    )
+    shard = outbox_shard(chat_id)
+    SearchOutboxCheckpoint(shard, event_id=f"{2**62:020d}#ffffffff").save()
+
+    es_client = FakeSearchClient()
+    progress = []
+    result = await SearchReindexer(
+        es_client,
+        async_chat_repo.client,
+        segments=3,
+        concurrency=2,
+        batch_size=2,
+        on_progress=progress.append,
+    ).run()
+
+    assert result.swapped
+    assert result.previous_indices == ["chats-old"]
+    assert result.documents == sum(progress)
+    index, document = es_client.documents[chat_id]
+    assert index == result.indices["chats"]
+    assert [msg["content"] for msg in document["messages"]] == ["hello", "more"]
+    assert document["next_seq"] == 2
+    _, legacy_document = es_client.documents[legacy_chat_id]
+    assert [msg["content"] for msg in legacy_document["messages"]] == [
+        "legacy",
+        "appended",
+    ]
+    # appends of a legacy chat are numbered from 0 without the legacy messages
+    assert legacy_document["next_seq"] == 1
+    index, message = es_client.documents[f"{legacy_chat_id}#-1"]
+    assert index == result.indices["chat_messages"]
+    assert message["content"] == "legacy"
+    assert es_client.documents[f"{legacy_chat_id}#0"][1]["content"] == "appended"
+
+    for index in result.indices.values():
+        created = es_client.indices.created[index]
+        assert created["settings"]["refresh_interval"] == "-1"
+        assert es_client.indices.settings[index]["refresh_interval"] is None
+    assert es_client.indices.alias_actions == [
+        {"add": {"index": result.indices["chats"], "alias": "chats"}},
+        {"remove": {"index": "chats-old", "alias": "chats"}},
+        {
+            "add": {
+                "index": result.indices["chat_messages"],
+                "alias": "chat_messages",
+                "is_write_index": True,
+            }
+        },
+    ]
+    # the messages index rolls over, the indices it creates get the same layout
+    assert result.indices["chat_messages"].endswith("-000001")
+    patterns, template = es_client.indices.templates["chat_messages"]
+    assert patterns == ["chat_messages-*"]
+    assert template["settings"]["index.lifecycle.rollover_alias"] == "chat_messages"
+    assert "rollover" in str(es_client.ilm.policies["chat_messages"])
+    # the outbox replays what was written during the reindex
+    checkpoint = SearchOutboxCheckpoint.get(shard)
+    assert checkpoint.event_id < f"{2**62:020d}"
+    assert checkpoint.owner is None
+
+
+@pytest.mark.asyncio
+async def test_reindex_search_keeps_alias_on_failures(
+    async_chat_repo, cleanup_chats: list
+):
+    chat_id, timestamp = str(uuid.uuid4()), datetime.now().timestamp()
+    await async_chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email="reindex_failure@example.com",
+            messages=[_message("hello")],
+        )
+    )
+    cleanup_chats.append((chat_id, timestamp))
+
+    es_client = FakeSearchClient(failing_chat_id=chat_id)
+    result = await SearchReindexer(es_client, async_chat_repo.client).run()
+
+    assert result.failed == 1
+    assert not result.swapped
+    assert es_client.indices.alias_actions == []
+
+
+@pytest.mark.asyncio
+async def test_reindex_search_fills_sqlite(
+    async_chat_repo, cleanup_chats: list, tmp_path
+):
+    user_email = f"reindex_sqlite_{uuid.uuid4().hex[:8]}@example.com"
+    chat_id, timestamp = str(uuid.uuid4()), datetime.now().timestamp()
+    await async_chat_repo.create_chat(
+        ChatCreate(
+            chat_id=chat_id,
+            timestamp=timestamp,
+            user_email=user_email,
+            messages=[_message("written before the switch")],
+        )
+    )
+    cleanup_chats.append((chat_id, timestamp))
+    assert await async_chat_repo.append_messages(
+        chat_id, timestamp, [_message("appended later")], user_email
+    )
+    shard = outbox_shard(chat_id)
+    SearchOutboxCheckpoint(shard, event_id=f"{2**62:020d}#ffffffff").save()
+    backend = SQLiteSearchBackend(str(tmp_path / "search.db"))
+
+    try:
+        result = await SQLiteSearchReindexer(
+            backend, async_chat_repo.client, segments=2, batch_size=2
+        ).run()
+
+        assert result.failed == 0
+        hits = await backend.search_chat_hits(user_email, "switch")
+        assert [hit.chat_id for hit in hits] == [chat_id]
+        chats = await backend.search_chats(user_email, "appended")
+        assert [msg.content for msg in chats[0].messages] == [
+            "written before the switch",
+            "appended later",
+        ]
+    finally:
+        backend.close()
+    # writes made during the reindex are replayed
+    assert SearchOutboxCheckpoint.get(shard).event_id < f"{2**62:020d}"
@@ -1,9 +1,13 @@
+import time
 import uuid
 from datetime import datetime
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
 
+from gptbundle.media_storage.storage import AsyncS3Storage
+from gptbundle.messaging.exceptions import AttachmentAccessError
+from gptbundle.messaging.models import ChatMessage, ChatPurge
 from gptbundle.messaging.repository import ChatRepository
 from gptbundle.messaging.schemas import ChatCreate, MessageCreate, MessageRole
 from gptbundle.messaging.service import (
@@ -12,11 +16,12 @@ from gptbundle.messaging.service import (
     delete_chat,
     get_chat,
     get_chats_by_user_email_paginated,
+    presign_chat_attachments,
 )
 
 
 @pytest.mark.asyncio
-async def test_create_chat(cleanup_chats: list, es_repo, cleanup_es: list):
+async def test_create_chat(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     chat_id = "test_chat_id"
@@ -35,9 +40,8 @@ async def test_create_chat(cleanup_chats: list, es_repo, cleanup_es: list):
         chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
     )
 
-    chat = await create_chat(chat_in, chat_repo, es_repo)
+    chat = await create_chat(chat_in, chat_repo)
     cleanup_chats.append((chat.chat_id, chat.timestamp))
-    cleanup_es.append(chat.chat_id)
 
     assert chat.chat_id == chat_id
     assert chat.user_email == user_email
@@ -55,9 +59,7 @@ async def test_create_chat(cleanup_chats: list, es_repo, cleanup_es: list):
 
 
 @pytest.mark.asyncio
-async def test_create_chat_with_no_messages(
-    cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_create_chat_with_no_messages(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     chat_id = "test_chat_id"
@@ -69,9 +71,8 @@ async def test_create_chat_with_no_messages(
         chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
     )
 
-    chat = await create_chat(chat_in, chat_repo, es_repo)
+    chat = await create_chat(chat_in, chat_repo)
     cleanup_chats.append((chat.chat_id, chat.timestamp))
-    cleanup_es.append(chat.chat_id)
 
     assert chat.chat_id == chat_id
     assert chat.user_email == user_email
@@ -85,7 +86,7 @@ async def test_create_chat_with_no_messages(
 
 
 @pytest.mark.asyncio
-async def test_get_chat(cleanup_chats: list, es_repo, cleanup_es: list):
+async def test_get_chat(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     chat_id = "test_get_chat_id"
@@ -104,9 +105,8 @@ async def test_get_chat(cleanup_chats: list, es_repo, cleanup_es: list):
         chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
     )
 
-    chat = await create_chat(chat_in, chat_repo, es_repo)
+    chat = await create_chat(chat_in, chat_repo)
     cleanup_chats.append((chat.chat_id, chat.timestamp))
-    cleanup_es.append(chat.chat_id)
 
     found_chat = await get_chat(chat_id, timestamp, chat_repo, user_email)
     assert found_chat is not None
@@ -117,9 +117,7 @@ async def test_get_chat(cleanup_chats: list, es_repo, cleanup_es: list):
 
 
 @pytest.mark.asyncio
-async def test_get_chats_by_useremail_paginated(
-    cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_get_chats_by_useremail_paginated(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     timestamp = datetime.now().timestamp()
@@ -140,9 +138,8 @@ async def test_get_chats_by_useremail_paginated(
             )
         ],
     )
-    await create_chat(chat_in_1, chat_repo, es_repo)
+    await create_chat(chat_in_1, chat_repo)
     cleanup_chats.append(("chat1", timestamp))
-    cleanup_es.append("chat1")
 
     chat_in_2 = ChatCreate(
         chat_id="chat2",
@@ -157,9 +154,8 @@ async def test_get_chats_by_useremail_paginated(
             )
         ],
     )
-    await create_chat(chat_in_2, chat_repo, es_repo)
+    await create_chat(chat_in_2, chat_repo)
     cleanup_chats.append(("chat2", timestamp + 1))
-    cleanup_es.append("chat2")
 
     chat_in_3 = ChatCreate(
         chat_id="chat3",
@@ -174,9 +170,8 @@ async def test_get_chats_by_useremail_paginated(
             )
         ],
     )
-    await create_chat(chat_in_3, chat_repo, es_repo)
+    await create_chat(chat_in_3, chat_repo)
     cleanup_chats.append(("chat3", timestamp))
-    cleanup_es.append("chat3")
 
     user1_response = await get_chats_by_user_email_paginated(user_email_1, chat_repo)
     user1_chats = user1_response["items"]
@@ -196,9 +191,7 @@ async def test_get_chats_by_useremail_paginated(
 
 
 @pytest.mark.asyncio
-async def test_get_chats_paginated_multi_page(
-    cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_get_chats_paginated_multi_page(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     timestamp = datetime.now().timestamp()
@@ -220,9 +213,8 @@ async def test_get_chats_paginated_multi_page(
                 )
             ],
         )
-        await create_chat(chat_in, chat_repo, es_repo)
+        await create_chat(chat_in, chat_repo)
         cleanup_chats.append((chat_id, timestamp + i))
-        cleanup_es.append(chat_id)
 
     # Test pagination with limit 2
     response1 = await get_chats_by_user_email_paginated(
@@ -252,7 +244,7 @@ async def test_get_chats_paginated_multi_page(
 
 
 @pytest.mark.asyncio
-async def test_append_messages(cleanup_chats: list, es_repo, cleanup_es: list):
+async def test_append_messages(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     chat_id = "test_append_messages_id"
@@ -271,9 +263,8 @@ async def test_append_messages(cleanup_chats: list, es_repo, cleanup_es: list):
         chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
     )
 
-    chat = await create_chat(chat_in, chat_repo, es_repo)
+    chat = await create_chat(chat_in, chat_repo)
     cleanup_chats.append((chat.chat_id, chat.timestamp))
-    cleanup_es.append(chat.chat_id)
 
     new_messages = [
         MessageCreate(
@@ -291,13 +282,13 @@ async def test_append_messages(cleanup_chats: list, es_repo, cleanup_es: list):
     ]
 
     updated_chat = await append_messages(
-        chat_id, timestamp, new_messages, chat_repo, user_email, es_repo
+        chat_id, timestamp, new_messages, chat_repo, user_email
     )
     assert updated_chat
 
 
 @pytest.mark.asyncio
-async def test_delete_chat(cleanup_chats: list, es_repo, cleanup_es: list):
+async def test_delete_chat(cleanup_chats: list):
     chat_repo = ChatRepository()
 
     chat_id = "test_delete_chat_id"
@@ -316,8 +307,7 @@ async def test_delete_chat(cleanup_chats: list, es_repo, cleanup_es: list):
         chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
     )
 
-    await create_chat(chat_in, chat_repo, es_repo)
-    cleanup_es.append(chat_id)
+    await create_chat(chat_in, chat_repo)
     # No need to add to cleanup_chats since we're deleting it
 
     # Verify the chat exists
@@ -325,58 +315,97 @@ async def test_delete_chat(cleanup_chats: list, es_repo, cleanup_es: list):
     assert found_chat is not None
 
     # Delete the chat
-    deleted = await delete_chat(chat_id, timestamp, chat_repo, user_email, es_repo)
+    deleted = await delete_chat(chat_id, timestamp, chat_repo, user_email)
     assert deleted is True
 
     # Verify the chat no longer exists
     deleted_chat = await get_chat(chat_id, timestamp, chat_repo, user_email)
     assert deleted_chat is None
 
-    # Deleting a non-existent chat should return False
-    deleted_again = await delete_chat(
-        chat_id, timestamp, chat_repo, user_email, es_repo
+
+@pytest.mark.asyncio
+async def test_delete_chat_leaves_purge(cleanup_chats: list):
+    chat_repo = ChatRepository()
+    chat_id = str(uuid.uuid4())
+    timestamp = datetime.now().timestamp()
+    user_email = "test_s3@example.com"
+    chat_in = ChatCreate(
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[
+            MessageCreate(
+                content="Hello with images",
+                role=MessageRole.USER,
+                message_type="image",
+                img_s3_keys=["key1", "key2"],
+                llm_model="gpt4",
+            )
+        ],
     )
-    assert deleted_again is False
+    await create_chat(chat_in, chat_repo)
+    cleanup_chats.append((chat_id, timestamp))
+
+    with patch.object(
+        AsyncS3Storage, "delete_objects", new_callable=AsyncMock
+    ) as mock_delete_objects:
+        assert await delete_chat(chat_id, timestamp, chat_repo, user_email)
+    # returns before anything but the chat header is deleted
+    mock_delete_objects.assert_not_called()
+    assert await get_chat(chat_id, timestamp, chat_repo, user_email) is None
+    purge = ChatPurge.get(chat_id, timestamp)
+    assert purge.user_email == user_email
+    assert purge.next_attempt_at <= time.time()
+    assert ChatMessage.count(chat_id) == 1
 
+    # Deleting a non-existent chat should return False
+    assert not await delete_chat(chat_id, timestamp, chat_repo, user_email)
     # Deleting with wrong chat_id should return False
-    deleted_wrong_id = await delete_chat(
-        "nonexistent_id", timestamp, chat_repo, user_email, es_repo
-    )
-    assert deleted_wrong_id is False
+    assert not await delete_chat("nonexistent_id", timestamp, chat_repo, user_email)
 
 
 @pytest.mark.asyncio
-async def test_delete_chat_with_s3_objects(
-    cleanup_chats: list, es_repo, cleanup_es: list
-):
+async def test_presign_chat_attachments(cleanup_chats: list):
     chat_repo = ChatRepository()
-    chat_id = "test_s3_delete_chat_id"
+    chat_id = str(uuid.uuid4())
     timestamp = datetime.now().timestamp()
-    user_email = "test_s3@example.com"
-    s3_keys = ["key1", "key2"]
-
-    messages = [
-        MessageCreate(
-            content="Hello with images",
-            role=MessageRole.USER,
-            message_type="image",
-            img_s3_keys=s3_keys,
-            llm_model="gpt4",
-        )
-    ]
-
+    user_email = "presign@example.com"
+    img_keys = [f"permanent/{uuid.uuid4()}.png" for _ in range(2)]
     chat_in = ChatCreate(
-        chat_id=chat_id, timestamp=timestamp, user_email=user_email, messages=messages
+        chat_id=chat_id,
+        timestamp=timestamp,
+        user_email=user_email,
+        messages=[
+            MessageCreate(
+                content="Look at these",
+                role=MessageRole.USER,
+                message_type="image",
+                img_s3_keys=img_keys,
+                llm_model="gpt4",
+            )
+        ],
     )
+    await create_chat(chat_in, chat_repo)
+    cleanup_chats.append((chat_id, timestamp))
 
-    await create_chat(chat_in, chat_repo, es_repo)
-    cleanup_es.append(chat_id)
+    chat = await get_chat(chat_id, timestamp, chat_repo, user_email, presign=False)
+    assert chat.messages[0].img_s3_keys == img_keys
+    assert chat.messages[0].img_presigned_urls is None
 
-    with patch("gptbundle.messaging.service.delete_objects") as mock_delete_objects:
-        deleted = await delete_chat(chat_id, timestamp, chat_repo, user_email, es_repo)
-        assert deleted is True
-        mock_delete_objects.assert_called_once_with(s3_keys)
+    presigned = await presign_chat_attachments(
+        chat_id, timestamp, img_keys[:1], chat_repo, user_email
+    )
+    assert list(presigned["urls"]) == img_keys[:1]
+    assert img_keys[0] in presigned["urls"][img_keys[0]]
+    assert presigned["min_valid_seconds"] > 0
 
-    # Verify the chat no longer exists
-    deleted_chat = await get_chat(chat_id, timestamp, chat_repo, user_email)
-    assert deleted_chat is None
+    with pytest.raises(AttachmentAccessError):
+        await presign_chat_attachments(
+            chat_id, timestamp, ["permanent/other.png"], chat_repo, user_email
+        )
+    assert (
+        await presign_chat_attachments(
+            chat_id, timestamp, img_keys, chat_repo, "intruder@example.com"
+        )
+        is None
+    )
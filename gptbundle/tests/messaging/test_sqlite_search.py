@@ -0,0 +1,127 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from gptbundle.messaging.outbox import (
+    chat_created_event,
+    chat_deleted_event,
+    messages_appended_event,
+)
+from gptbundle.messaging.schemas import Chat, MessageCreate, MessageRole
+from gptbundle.messaging.schemas import MessageSearchSort as Sort
+from gptbundle.messaging.sqlite_search import SQLiteSearchBackend, fts_query
+
+
+def _message(content: str, role: MessageRole = MessageRole.USER) -> MessageCreate:
+    return MessageCreate(
+        content=content, role=role, message_type="text", llm_model="gpt4"
+    )
+
+
+def _chat(user_email: str, *contents: str, timestamp: float | None = None) -> Chat:
+    return Chat(
+        chat_id=str(uuid.uuid4()),
+        timestamp=timestamp or datetime.now().timestamp(),
+        user_email=user_email,
+        messages=[_message(content) for content in contents],
+    )
+
+
+@pytest.fixture(name="backend")
+def backend_fixture(tmp_path):
+    backend = SQLiteSearchBackend(str(tmp_path / "search.db"))
+    yield backend
+    backend.close()
+
+
+def test_fts_query_quotes_words():
+    assert fts_query('hello "world" AND') == '"hello" OR "world" OR "AND"'
+    assert fts_query("  ?! ") is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_search_applies_outbox_events(backend: SQLiteSearchBackend):
+    user_email = "sqlite@example.com"
+    chat = _chat(user_email, "tell me about penguins")
+    other_chat = _chat("other@example.com", "penguins are birds")
+    appended = messages_appended_event(
+        chat.chat_id,
+        chat.timestamp,
+        user_email,
+        [_message("penguins live in the south", MessageRole.ASSISTANT)],
+        first_seq=1,
+    )
+
+    errors = await backend.apply_events(
+        [chat_created_event(chat), chat_created_event(other_chat), appended]
+    )
+    assert errors == [None, None, None]
+    # replaying the append changes nothing
+    assert await backend.apply_events([appended]) == [None]
+
+    chats = await backend.search_chats(user_email, "penguins")
+    assert [c.chat_id for c in chats] == [chat.chat_id]
+    assert [msg.content for msg in chats[0].messages] == [
+        "tell me about penguins",
+        "penguins live in the south",
+    ]
+
+    hits = await backend.search_chat_hits(user_email, "south")
+    assert len(hits) == 1
+    assert hits[0].title == "tell me about penguins"
+    assert "<em>south</em>" in hits[0].snippet
+    assert hits[0].score > 0
+
+    await backend.apply_events(
+        [chat_deleted_event(chat.chat_id, chat.timestamp, user_email)]
+    )
+    assert await backend.search_chats(user_email, "penguins") == []
+
+
+@pytest.mark.asyncio
+async def test_sqlite_search_append_to_missing_chat(backend: SQLiteSearchBackend):
+    chat = _chat("missing@example.com", "first")
+    event = messages_appended_event(
+        chat.chat_id, chat.timestamp, chat.user_email, [_message("second")], 1
+    )
+
+    [error] = await backend.apply_events([event])
+    assert error.status == 404
+
+    # what the outbox consumer does to resolve it
+    chat.messages.append(_message("second"))
+    await backend.index_document(chat_created_event(chat).payload["document"])
+    hits = await backend.search_chat_hits(chat.user_email, "second")
+    assert [hit.chat_id for hit in hits] == [chat.chat_id]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_search_messages_pages(backend: SQLiteSearchBackend):
+    user_email = "pages@example.com"
+    timestamp = datetime.now().timestamp()
+    chats = [
+        _chat(user_email, "kiwi one", "kiwi two", timestamp=timestamp + i)
+        for i in range(3)
+    ]
+    await backend.apply_events([chat_created_event(chat) for chat in chats])
+
+    for sort in Sort:
+        seen = []
+        search_after = None
+        while True:
+            page = await backend.search_messages(
+                user_email, "kiwi", size=4, search_after=search_after, sort=sort
+            )
+            seen.extend((hit.chat_id, hit.seq) for hit in page.items)
+            if page.search_after is None:
+                break
+            search_after = page.search_after
+        assert len(seen) == len(set(seen)) == 6
+
+    page = await backend.search_messages(user_email, "kiwi", sort=Sort.RECENT)
+    assert [(hit.chat_id, hit.seq) for hit in page.items[:2]] == [
+        (chats[-1].chat_id, 1),
+        (chats[-1].chat_id, 0),
+    ]
+    assert page.items[0].snippets == ["<em>kiwi</em> two"]
@@ -0,0 +1,184 @@
+import asyncio
+import uuid
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from gptbundle.common.config import settings
+from gptbundle.media_storage.content import content_key
+from gptbundle.media_storage.models import ContentObject, PendingUpload
+from gptbundle.media_storage.pending import record_pending_uploads
+from gptbundle.media_storage.storage import AsyncS3Storage, S3Storage
+from gptbundle.messaging.exceptions import AttachmentPromotionError
+from gptbundle.messaging.schemas import MessageCreate, MessageRole
+from gptbundle.messaging.websocket_service import (
+    finish_attachments,
+    process_attachments,
+)
+
+OWNER = "owner@example.com"
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    monkeypatch.setattr(
+        "gptbundle.media_storage.storage.settings.S3_ENDPOINT_URL", None
+    )
+    monkeypatch.setattr(S3Storage, "_shared", None)
+    storage = AsyncS3Storage(max_workers=4)
+    monkeypatch.setattr(AsyncS3Storage, "_shared", storage)
+    with mock_aws():
+        s3 = boto3.client("s3", region_name=settings.S3_REGION)
+        bucket_config = {}
+        if settings.S3_REGION != "us-east-1":
+            bucket_config["CreateBucketConfiguration"] = {
+                "LocationConstraint": settings.S3_REGION
+            }
+        s3.create_bucket(Bucket=settings.S3_BUCKET_NAME, **bucket_config)
+        yield s3
+    storage.close()
+    with PendingUpload.batch_write() as batch:
+        for pending in PendingUpload.scan(PendingUpload.user_email == OWNER):
+            batch.delete(pending)
+
+
+def _keys(s3) -> set[str]:
+    listed = s3.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)
+    return {item["Key"] for item in listed.get("Contents", [])}
+
+
+def _message(s3) -> MessageCreate:
+    img_keys = [f"{settings.S3_TEMP_PREFIX}img{i}.png" for i in range(3)]
+    pdf_keys = [f"{settings.S3_TEMP_PREFIX}doc{i}.pdf" for i in range(2)]
+    for key in img_keys + pdf_keys:
+        s3.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"data")
+    record_pending_uploads(OWNER, img_keys + pdf_keys)
+    return MessageCreate(
+        content="See attached",
+        role=MessageRole.USER,
+        img_s3_keys=img_keys,
+        pdf_s3_keys=pdf_keys,
+        llm_model="gpt4",
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_attachments(s3_setup):
+    message = _message(s3_setup)
+
+    await process_attachments(message, "chat-1", OWNER)
+
+    pdf_prefix = f"{settings.S3_PERMANENT_PREFIX}{settings.S3_DOC_PREFIX}chat-1/"
+    assert message.img_s3_keys == [
+        f"{settings.S3_PERMANENT_PREFIX}img{i}.png" for i in range(3)
+    ]
+    assert message.pdf_s3_keys == [f"{pdf_prefix}doc{i}.pdf" for i in range(2)]
+    assert _keys(s3_setup) == set(message.img_s3_keys + message.pdf_s3_keys)
+
+
+@pytest.mark.asyncio
+async def test_process_attachments_moves_concurrently(s3_setup, monkeypatch):
+    message = _message(s3_setup)
+    running = 0
+    max_running = 0
+
+    async def slow_move(source_key: str, target_key: str) -> None:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    monkeypatch.setattr(settings, "S3_ATTACHMENT_CONCURRENCY", 2)
+    monkeypatch.setattr(AsyncS3Storage.shared(), "move_file", slow_move)
+
+    await process_attachments(message, "chat-1", OWNER)
+
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_process_attachments_rolls_back(s3_setup, monkeypatch):
+    message = _message(s3_setup)
+    temp_keys = list(message.img_s3_keys + message.pdf_s3_keys)
+    storage = AsyncS3Storage.shared()
+    move_file = storage.move_file
+
+    async def failing_move(source_key: str, target_key: str) -> None:
+        if source_key.endswith("img1.png"):
+            raise ClientError({"Error": {"Code": "InternalError"}}, "CopyObject")
+        await move_file(source_key, target_key)
+
+    monkeypatch.setattr(storage, "move_file", failing_move)
+
+    with pytest.raises(AttachmentPromotionError) as exc_info:
+        await process_attachments(message, "chat-1", OWNER)
+
+    assert list(exc_info.value.failed) == [f"{settings.S3_TEMP_PREFIX}img1.png"]
+    # the message is unchanged and every attachment is back at its temp key
+    assert message.img_s3_keys + message.pdf_s3_keys == temp_keys
+    assert _keys(s3_setup) == set(temp_keys)
+    # pending again, the message can be sent once more
+    assert PendingUpload.get(temp_keys[0]).user_email == OWNER
+
+
+@pytest.mark.asyncio
+async def test_process_attachments_direct_uploads(s3_setup):
+    temp_key = f"{settings.S3_TEMP_PREFIX}img.png"
+    direct_keys = [
+        content_key(OWNER, uuid.uuid4().hex, ".png"),
+        content_key(OWNER, uuid.uuid4().hex, ".pdf"),
+    ]
+    for key in [temp_key, *direct_keys]:
+        s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=key, Body=b"data")
+    record_pending_uploads(OWNER, [temp_key, *direct_keys])
+    message = MessageCreate(
+        content="See attached",
+        role=MessageRole.USER,
+        img_s3_keys=[temp_key, direct_keys[0]],
+        pdf_s3_keys=direct_keys[1:],
+        llm_model="gpt4",
+    )
+
+    with pytest.raises(AttachmentPromotionError):
+        await process_attachments(message, "chat-1", "other@example.com")
+    assert _keys(s3_setup) == {temp_key, *direct_keys}
+
+    await process_attachments(message, "chat-1", OWNER)
+
+    assert message.img_s3_keys == [
+        f"{settings.S3_PERMANENT_PREFIX}img.png",
+        direct_keys[0],
+    ]
+    assert message.pdf_s3_keys == direct_keys[1:]
+    for key in [temp_key, *direct_keys]:
+        with pytest.raises(PendingUpload.DoesNotExist):
+            PendingUpload.get(key)
+    try:
+        await finish_attachments(message, OWNER, message_saved=True)
+        # the objects the message refers to are counted, moved ones are its own
+        assert [ContentObject.get(key).refs for key in direct_keys] == [1, 1]
+        assert ContentObject.count(message.img_s3_keys[0]) == 0
+    finally:
+        for key in direct_keys:
+            ContentObject(key).delete()
+
+
+@pytest.mark.asyncio
+async def test_finish_attachments_of_unsaved_message(s3_setup):
+    message = _message(s3_setup)
+    direct_key = content_key(OWNER, uuid.uuid4().hex, ".png")
+    s3_setup.put_object(Bucket=settings.S3_BUCKET_NAME, Key=direct_key, Body=b"data")
+    record_pending_uploads(OWNER, [direct_key])
+    message.img_s3_keys.append(direct_key)
+    await process_attachments(message, "chat-1", OWNER)
+
+    # e.g. the chat is not the user's
+    await finish_attachments(message, OWNER, message_saved=False)
+
+    # left to the sweeper, unless sent again
+    for key in message.img_s3_keys + message.pdf_s3_keys:
+        assert PendingUpload.get(key).user_email == OWNER
+    assert ContentObject.count(direct_key) == 0
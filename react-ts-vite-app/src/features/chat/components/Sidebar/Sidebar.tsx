@@ -3,12 +3,12 @@ import { LuChevronDown, LuPanelLeftClose } from "react-icons/lu";
 import { useEffect, useRef } from "react";
 import { SearchField } from "./SearchField";
 import { ChatListItem } from "./ChatListItem";
-import type { Chat, ChatMetadata } from "../../types";
+import type { ChatMetadata, ChatSummary } from "../../types";
 
 interface SidebarProps {
     onToggle: () => void;
     startNewChat: () => void;
-    chats: Chat[];
+    chats: ChatSummary[];
     isLoading: boolean;
     error: string | null;
     onDeleteChat: (chatId: string, timestamp: number) => Promise<void>;
@@ -90,7 +90,7 @@ export const Sidebar = ({
                 )}
 
                 {!isLoading && !error && chats.map((chat) => {
-                    const firstMessage = chat.messages[0]?.content || "New Chat";
+                    const firstMessage = chat.title || "New Chat";
                     const date = new Date(chat.timestamp * 1000).toLocaleDateString();
 
                     return (
@@ -1,10 +1,21 @@
 import { useState, useEffect, useCallback, useRef } from "react";
-import type { Chat, ChatPaginatedResponse } from "../types";
+import type { ChatSearchHit, ChatSummary, ChatSummaryPaginatedResponse } from "../types";
 import { apiClient } from "../../../api/client";
 import { AxiosError } from "axios";
 
+// search hits carry no messages, the fields the sidebar does not show stay empty
+const toChatSummary = (hit: ChatSearchHit): ChatSummary => ({
+    chat_id: hit.chat_id,
+    timestamp: hit.timestamp,
+    user_email: "",
+    title: hit.title,
+    message_count: 0,
+    is_rag: hit.is_rag,
+    last_model: null,
+});
+
 export const useChats = () => {
-    const [chats, setChats] = useState<Chat[]>([]);
+    const [chats, setChats] = useState<ChatSummary[]>([]);
     const [isLoading, setIsLoading] = useState(false);
     const [isDeleting, setIsDeleting] = useState(false);
     const [error, setError] = useState<string | null>(null);
@@ -25,7 +36,7 @@ export const useChats = () => {
                 setMoreChatsClicked(false);
             }
 
-            const response = await apiClient.get<ChatPaginatedResponse>('/messaging/chats', {
+            const response = await apiClient.get<ChatSummaryPaginatedResponse>('/messaging/chats', {
                 params: {
                     limit: paginationLimit,
                     ...(lastEvalKey.current && { last_eval_key: JSON.stringify(lastEvalKey.current) }),
@@ -54,8 +65,8 @@ export const useChats = () => {
         }
         try {
             setMoreChatsClicked(false);
-            const response = await apiClient.get(`/messaging/search_chats?search_term=${searchTerm}`);
-            setChats(response.data);
+            const response = await apiClient.get<ChatSearchHit[]>(`/messaging/search_chats?search_term=${searchTerm}`);
+            setChats(response.data.map(toChatSummary));
             setNoMoreChatsToLoad(true);
         } catch (err) {
             if (err instanceof AxiosError && err.response?.status !== 404) {
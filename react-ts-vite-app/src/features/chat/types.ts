@@ -37,8 +37,27 @@ export interface Chat {
     messages: Message[];
 }
 
-export interface ChatPaginatedResponse {
-    items: Chat[];
+export interface ChatSummary {
+    chat_id: string;
+    timestamp: number;
+    user_email: string;
+    title: string | null;
+    message_count: number;
+    is_rag: boolean;
+    last_model: string | null;
+}
+
+export interface ChatSearchHit {
+    chat_id: string;
+    timestamp: number;
+    title: string | null;
+    is_rag: boolean;
+    snippet: string | null;
+    score: number | null;
+}
+
+export interface ChatSummaryPaginatedResponse {
+    items: ChatSummary[];
     last_eval_key: string | null;
 }
 